@@ -1,11 +1,46 @@
-import tkinter as tk
-from tkinter import ttk, messagebox
+import time
+import argparse
+import signal
 import threading
-import pyaudiowpatch as pyaudio
 import numpy as np
 import threading
-import time
 import os, sys
+import json
+from functools import lru_cache
+from math import exp, gcd
+import types
+import hashlib
+import csv
+import socket
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyaudiowpatch as pyaudio
+except ImportError:
+    # pyaudiowpatch only exists on Windows. Elsewhere the simulated backend still works,
+    # so provide the PortAudio constants it and the router rely on (same values as PortAudio)
+    pyaudio = types.SimpleNamespace(
+        PyAudio=None,
+        paFloat32=1, paInt32=2, paInt24=4, paInt16=8, paInt8=16, paUInt8=32,
+        paContinue=0, paComplete=1, paAbort=2,
+        paInputUnderflow=1, paInputOverflow=2, paOutputUnderflow=4, paOutputOverflow=8,
+        paWASAPI=13,
+    )
+
+try:
+    import soundfile # Only needed to record FLAC
+except ImportError:
+    soundfile = None
+
+# Startup timings in the logs count from here, once the imports are done. benchmark.py startup times those separately
+LAUNCHED = time.perf_counter()
+
+# What the capture callback returns every time. Input-only streams take no output data
+CALLBACK_CONTINUE = (None, pyaudio.paContinue)
 
 def resource_path(filename):
     if hasattr(sys, "_MEIPASS"):
@@ -14,147 +49,2424 @@ def resource_path(filename):
     # Running in normal Python
     return os.path.join(os.path.dirname(__file__), filename)
 
-# Helper function to get supported rates
-def get_supported_rates(p, device_index, io='output'):
-    """Tests common sample rates for a given device."""
-    info = p.get_device_info_by_index(device_index)
-    supported_rates = []
-    common_rates = [44100, 48000, 96000, 88200, 192000]
+COMMON_RATES = [44100, 48000, 96000, 88200, 192000]
 
-    for rate in common_rates:
+def _rate_supported(p, device_index, rate, channels, io, query=True):
+    """Asks PortAudio whether the device takes `rate`, opening a stream only if it can't say."""
+    format = pyaudio.paInt16
+    if query:
         try:
-            format = pyaudio.paInt16
-            channels = 1 # Start with mono to maximize compatibility for testing
-            if io == 'output' and info['maxOutputChannels'] >= 2:
-                channels = 2
-            elif io == 'input' and info['maxInputChannels'] >= 2:
-                channels = 2
+            if io == 'output':
+                p.is_format_supported(rate, output_device=device_index, output_channels=channels, output_format=format)
+            else:
+                p.is_format_supported(rate, input_device=device_index, input_channels=channels, input_format=format)
+            return True
+        except ValueError:
+            return False
+        except Exception:
+            pass # No answer from the host API, try it for real
+
+    try:
+        if io == 'output':
+            stream = p.open(
+                format=format,
+                channels=channels,
+                rate=rate,
+                output=True,
+                frames_per_buffer=1024,
+                output_device_index=device_index
+            )
+        else: # input or loopback
+            stream = p.open(
+                format=format,
+                channels=channels,
+                rate=rate,
+                input=True,
+                frames_per_buffer=1024,
+                input_device_index=device_index
+            )
+        stream.stop_stream()
+        stream.close()
+        return True
+    except Exception:
+        return False
+
+def probe_supported_rates(p, device_index, io='output', query=True):
+    """Tests common sample rates for a given device, bypassing the capability cache.
+
+    With query=False every rate is tested by opening a stream, which is reliable but slow.
+    """
+    info = p.get_device_info_by_index(device_index)
+    channels = 1 # Start with mono to maximize compatibility for testing
+    if io == 'output' and info['maxOutputChannels'] >= 2:
+        channels = 2
+    elif io == 'input' and info['maxInputChannels'] >= 2:
+        channels = 2
+    return [rate for rate in COMMON_RATES if _rate_supported(p, device_index, rate, channels, io, query)]
+
+# Helper function to get supported rates
+def get_supported_rates(p, device_index, io='output', capabilities=None):
+    """Common sample rates the device supports, from the capability cache when it knows them."""
+    if capabilities is None:
+        capabilities = CapabilityCache()
+    return capabilities.supported_rates(p, device_index, io)
+
+# Ring buffer policies
+DROP_OLDEST = 'drop_oldest'       # overrun: overwrite the oldest unread frames
+DROP_NEWEST = 'drop_newest'       # overrun: discard the incoming frames that don't fit
+INSERT_SILENCE = 'silence'        # underrun: pad the missing frames with zeros
+REPEAT_LAST = 'repeat'            # underrun: pad the missing frames with the last block read
+
+class RingBuffer:
+    """Preallocated single-producer/single-consumer ring of audio frames.
+
+    The producer (the capture callback) only ever moves the write position and the
+    consumer (an output writer) only ever moves the read position. Both positions are
+    monotonically increasing frame counters, so neither side needs a lock.
+    """
+    def __init__(self, capacity_ms, sample_rate, channels, dtype=np.int16,
+                 overrun_policy=DROP_OLDEST, underrun_policy=INSERT_SILENCE, clock=time.perf_counter):
+        if overrun_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown overrun policy: {overrun_policy}")
+        if underrun_policy not in (INSERT_SILENCE, REPEAT_LAST):
+            raise ValueError(f"Unknown underrun policy: {underrun_policy}")
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.capacity = max(1, int(round(sample_rate * capacity_ms / 1000.0)))
+        self.buffer = np.zeros((self.capacity, channels), dtype=dtype)
+        self.overrun_policy = overrun_policy
+        self.underrun_policy = underrun_policy
+
+        self._write_pos = 0
+        self._read_pos = 0
+
+        # When and how much the producer last wrote, for sub-block fill estimates
+        self.clock = clock
+        self.last_write_time = None
+        self.last_write_frames = 0
+
+        # Only allocated when it's needed to repeat the last block on underrun
+        self._last_block = np.zeros_like(self.buffer) if underrun_policy == REPEAT_LAST else None
+        self._last_len = 0
+
+        # Producer-side counters
+        self.overruns = 0
+        self.dropped_frames = 0
+        # Consumer-side counters
+        self.underruns = 0
+        self.inserted_frames = 0
+
+    def available(self):
+        """Number of frames waiting to be read."""
+        return min(self._write_pos - self._read_pos, self.capacity)
+
+    def free(self):
+        """Number of frames that can be written without overrunning."""
+        return self.capacity - self.available()
+
+    def write(self, frames):
+        """Copies a (frames, channels) block into the ring. Returns the frames kept."""
+        n = len(frames)
+        if n == 0:
+            return 0
+
+        w = self._write_pos
+        free = self.capacity - (w - self._read_pos)
+        if n > free:
+            self.overruns += 1
+            if self.overrun_policy == DROP_NEWEST:
+                free = max(free, 0)
+                self.dropped_frames += n - free
+                n = free
+                frames = frames[:n]
+                if n == 0:
+                    return 0
+            else:
+                # The reader notices it has been lapped and skips ahead
+                self.dropped_frames += n - max(free, 0)
+                if n > self.capacity:
+                    w += n - self.capacity
+                    frames = frames[n - self.capacity:]
+                    n = self.capacity
+
+        start = w % self.capacity
+        first = min(n, self.capacity - start)
+        # Slicing makes a new array object, skip it when the block doesn't wrap
+        if first == n:
+            self.buffer[start:start + n] = frames
+        else:
+            self.buffer[start:start + first] = frames[:first]
+            self.buffer[:n - first] = frames[first:]
+
+        self._write_pos = w + n # Publish only after the data is in place
+        self.last_write_frames = n
+        self.last_write_time = self.clock()
+        return n
+
+    def read(self, out):
+        """Fills `out` (frames, channels) from the ring, padding per the underrun policy.
+
+        Returns the number of real frames read; the rest of `out` is padding.
+        """
+        frames = len(out)
+        w = self._write_pos
+        r = self._read_pos
+        if w - r > self.capacity:
+            # Producer lapped us under DROP_OLDEST, the oldest frames are gone
+            r = w - self.capacity
+
+        n = min(w - r, frames)
+        if n > 0:
+            start = r % self.capacity
+            first = min(n, self.capacity - start)
+            if first == frames:
+                out[...] = self.buffer[start:start + first]
+            else:
+                out[:first] = self.buffer[start:start + first]
+                if first < n:
+                    out[first:n] = self.buffer[:n - first]
+        self._read_pos = r + n
+
+        if n < frames:
+            self.underruns += 1
+            self.inserted_frames += frames - n
+            missing = frames - n
+            if self.underrun_policy == REPEAT_LAST and self._last_len >= missing:
+                out[n:] = self._last_block[self._last_len - missing:self._last_len]
+            else:
+                out[n:] = 0
+
+        if self._last_block is not None and frames <= self.capacity:
+            self._last_block[:frames] = out
+            self._last_len = frames
+        return n
+
+    def skip(self, frames):
+        """Discards up to `frames` unread frames. Must be called from the consumer side."""
+        w = self._write_pos
+        r = max(self._read_pos, w - self.capacity)
+        n = min(frames, w - r)
+        self._read_pos = r + n
+        return n
+
+    def clear(self):
+        """Discards everything unread. Must be called from the consumer side."""
+        self._read_pos = self._write_pos
+
+class DriftEstimator:
+    """Estimates the clock drift between a producer and a consumer from a ring's fill level.
+
+    A slow PI loop turns the smoothed fill error into a resampling ratio (input frames
+    consumed per output frame). The reported drift is the long-term average correction,
+    which is what the two clocks actually differ by.
+    """
+    def __init__(self, sample_rate, target_ms, max_ppm=1000.0, kp=100.0, ki=2.0, smoothing=0.02,
+                 drift_window_s=300.0):
+        self.sample_rate = sample_rate
+        self.target_frames = sample_rate * target_ms / 1000.0
+        self.max_ppm = max_ppm
+        self.kp = kp # ppm per ms of fill error
+        self.ki = ki # ppm per ms of fill error, per second
+        self.smoothing = smoothing
+        self.drift_window_s = drift_window_s
+
+        self.fill_frames = None # Smoothed fill level
+        self.integral_ppm = 0.0
+        self.drift_ppm = 0.0
+        self.ratio = 1.0
+
+    def reset(self):
+        """Forgets the smoothed fill level but keeps the learned drift."""
+        self.fill_frames = None
+
+    def update(self, fill_frames, elapsed_frames):
+        """Feeds one fill measurement, taken after `elapsed_frames` of output. Returns the ratio."""
+        if self.fill_frames is None:
+            self.fill_frames = float(fill_frames)
+        else:
+            self.fill_frames += self.smoothing * (fill_frames - self.fill_frames)
+
+        error_ms = (self.fill_frames - self.target_frames) * 1000.0 / self.sample_rate
+        elapsed_s = elapsed_frames / self.sample_rate
+
+        # Anti-windup: the integral alone may never exceed the correction limit
+        self.integral_ppm += self.ki * error_ms * elapsed_s
+        self.integral_ppm = min(max(self.integral_ppm, -self.max_ppm), self.max_ppm)
+
+        correction_ppm = self.integral_ppm + self.kp * error_ms
+        correction_ppm = min(max(correction_ppm, -self.max_ppm), self.max_ppm)
+        self.drift_ppm += min(elapsed_s / self.drift_window_s, 1.0) * (correction_ppm - self.drift_ppm)
+        self.ratio = 1.0 + correction_ppm * 1e-6
+        return self.ratio
+
+class StreamingResampler:
+    """Fractional-ratio resampler that pulls its input from a RingBuffer.
+
+    Linear interpolation is plenty for ratios within a fraction of a percent of 1, which
+    is all drift correction needs. The read position carries over between blocks, so the
+    output is continuous no matter how the ratio changes.
+    """
+    def __init__(self, channels, max_frames, max_ratio=1.01):
+        self.channels = channels
+        self.max_frames = max_frames
+        max_input = int(np.ceil(max_frames * max_ratio)) + 2
+
+        self._input = np.zeros((max_input, channels), dtype=np.float32)
+        self._input_len = 0
+        self._position = 0.0 # Fractional read position inside self._input
+
+        self._steps = np.arange(max_frames, dtype=np.float64)
+        self._positions = np.zeros(max_frames, dtype=np.float64)
+        self._floors = np.zeros(max_frames, dtype=np.float64)
+        self._indices = np.zeros(max_frames, dtype=np.intp)
+        self._next_indices = np.zeros(max_frames, dtype=np.intp)
+        # Spelled out per channel: a broadcast multiply makes numpy allocate an iterator buffer
+        self._fractions = np.zeros((max_frames, channels), dtype=np.float32)
+        self._left = np.zeros((max_frames, channels), dtype=np.float32)
+        self._right = np.zeros((max_frames, channels), dtype=np.float32)
+        # Scalars go into ufuncs through these, a Python float is converted into a new array per call
+        self._ratio = np.zeros((), dtype=np.float64)
+        self._start = np.zeros((), dtype=np.float64)
+        # frames -> views of the scratch buffers above. Slicing makes a new array object every
+        # time, and on small blocks those objects outweigh the audio itself
+        self._views = {}
+
+    def reset(self):
+        self._input_len = 0
+        self._position = 0.0
+
+    def _scratch(self, frames):
+        views = self._views.get(frames)
+        if views is None:
+            views = self._views[frames] = (
+                self._steps[:frames], self._positions[:frames], self._floors[:frames], self._indices[:frames],
+                self._next_indices[:frames], self._fractions[:frames], self._positions[:frames, None],
+                self._left[:frames], self._right[:frames])
+        return views
+
+    def buffered(self):
+        """Input frames held inside the resampler but not yet consumed."""
+        return self._input_len - self._position
+
+    def pull(self, ring, out, ratio):
+        """Fills `out` with len(out) frames resampled from `ring` at `ratio`."""
+        frames = len(out)
+        steps, positions, floors, indices, next_indices, fractions, column, left, right = self._scratch(frames)
+        self._ratio.fill(ratio)
+        self._start.fill(self._position)
+        np.multiply(steps, self._ratio, out=positions)
+        positions += self._start
+
+        # Top up the input so that every position has a right-hand neighbour
+        needed = int(positions.item(-1)) + 2
+        if needed > self._input_len:
+            ring.read(self._input[self._input_len:needed])
+            self._input_len = needed
+
+        np.floor(positions, out=floors)
+        indices[:] = floors
+        np.add(indices, 1, out=next_indices)
+        np.subtract(positions, floors, out=positions)
+        fractions[:] = column
+
+        # mode='clip' lets numpy gather straight into `out`; the default mode buffers a copy.
+        # The method rather than np.take, whose Python wrapper allocates its keyword arguments
+        self._input.take(indices, 0, left, 'clip')
+        self._input.take(next_indices, 0, right, 'clip')
+        right -= left
+        right *= fractions
+        left += right
+
+        if out.dtype.kind in 'iu':
+            np.rint(left, out=left)
+        out[...] = left
+
+        # Slide the unconsumed tail (a frame or two) back to the front
+        next_position = self._position + frames * ratio
+        consumed = min(int(next_position), self._input_len)
+        remaining = self._input_len - consumed
+        self._input[:remaining] = self._input[consumed:self._input_len]
+        self._input_len = remaining
+        self._position = next_position - consumed
+
+class DriftCompensator:
+    """Keeps a consumer's ring near a target fill level despite independent clocks.
+
+    Small, slow drift is absorbed by the resampler. A starved ring is re-primed with
+    silence and a ring that has grown far past the target is cut back, so the latency
+    stays bounded even in multi-hour sessions.
+    """
+    def __init__(self, sample_rate, channels, max_frames, target_ms=50, max_ppm=1000.0):
+        self.sample_rate = sample_rate
+        self.estimator = DriftEstimator(sample_rate, target_ms, max_ppm=max_ppm)
+        self.resampler = StreamingResampler(channels, max_frames, max_ratio=1.0 + max_ppm * 1e-6)
+        # The ring must hold at least two blocks or the consumer catches the producer mid-block
+        self.min_target_frames = 2 * max_frames
+        self.target_frames = max(int(self.estimator.target_frames), self.min_target_frames)
+        self.estimator.target_frames = self.target_frames
+        self._new_target_frames = None
+        self.priming = True
+        self.resyncs = 0
+
+    @property
+    def ratio(self):
+        return self.estimator.ratio
+
+    @property
+    def drift_ppm(self):
+        return self.estimator.drift_ppm
+
+    def reset(self):
+        """Starts over with an empty cushion. The learned drift is kept."""
+        self.priming = True
+        self.resampler.reset()
+        self.estimator.reset()
+
+    def retarget(self, target_ms):
+        """Moves the fill target, e.g. when a delay changes. Safe to call from any thread.
+
+        The consumer applies it at its next pull by inserting silence or skipping ahead,
+        so the new latency takes effect at once instead of being slewed in at a few ppm.
+        """
+        self._new_target_frames = max(int(self.sample_rate * target_ms / 1000.0), self.min_target_frames)
+
+    def fill_frames(self, ring):
+        """Frames buffered between producer and consumer.
+
+        Capture arrives in whole blocks, so the raw ring level is a sawtooth whose phase
+        slowly slips with the drift. Counting the frames the producer has captured since
+        its last write (at most one block) smooths that out.
+        """
+        fill = ring.available() + self.resampler.buffered()
+        if ring.last_write_time is not None:
+            pending = (ring.clock() - ring.last_write_time) * self.sample_rate
+            fill += min(max(pending, 0.0), ring.last_write_frames)
+        return fill
+
+    def pull(self, ring, out):
+        """Fills `out` from `ring`, drift-corrected. Plays silence while (re)priming."""
+        frames = len(out)
+        fill = self.fill_frames(ring)
+
+        new_target = self._new_target_frames
+        if new_target is not None:
+            self._new_target_frames = None
+            self.target_frames = self.estimator.target_frames = new_target
+            self.estimator.reset()
+            if fill < new_target:
+                self.priming = True # Silence until the cushion has grown to the new target
+            elif fill > new_target + frames:
+                self._skip_to_target(ring)
+                fill = self.fill_frames(ring)
+
+        if self.priming:
+            if fill < self.target_frames:
+                out[:] = 0
+                return
+            self.priming = False
+            self.estimator.reset()
+
+        # Far too much buffered (e.g. after a stall): jump back to the target
+        if fill > 2 * self.target_frames + 2 * frames:
+            self._skip_to_target(ring)
+            self.resyncs += 1
+            self.estimator.reset()
+            fill = self.fill_frames(ring)
+
+        ratio = self.estimator.update(fill, frames)
+        underruns = ring.underruns
+        self.resampler.pull(ring, out, ratio)
+        if ring.underruns != underruns:
+            # Source went quiet (WASAPI loopback stops delivering on silence), rebuild the cushion
+            self.priming = True
+            self.resampler.reset()
+
+    def _skip_to_target(self, ring):
+        """Drops the oldest audio down to the target. Frames the producer has yet to write
+        don't count here, or the very next pull could find the ring short of a block."""
+        ring.skip(int(ring.available() + self.resampler.buffered()) - self.target_frames)
+
+    def metrics(self):
+        return {
+            'drift_ppm': self.estimator.drift_ppm,
+            'ratio': self.estimator.ratio,
+            'fill_ms': (self.estimator.fill_frames or 0.0) * 1000.0 / self.sample_rate,
+            'target_ms': self.target_frames * 1000.0 / self.sample_rate,
+            'resyncs': self.resyncs,
+        }
+
+@lru_cache(maxsize=None)
+def polyphase_filter_bank(in_rate, out_rate, taps_per_phase=32, beta=8.6, rolloff=0.92):
+    """Windowed-sinc polyphase filter bank for converting in_rate to out_rate.
+
+    Returns (up, down, bank) where bank has shape (up, taps) and each row is already
+    reversed to line up with a window of the most recent `taps` input frames. Tables are
+    cached per rate pair, so every stream converting 44.1k to 48k shares one bank.
+    """
+    g = gcd(in_rate, out_rate)
+    up, down = out_rate // g, in_rate // g
+
+    # When decimating, the cutoff drops and the filter gets proportionally longer
+    taps = int(np.ceil(taps_per_phase * max(1.0, down / up)))
+    cutoff = rolloff * 0.5 / max(up, down) # In cycles per sample at the upsampled rate
+    length = taps * up
+    n = np.arange(length) - (length - 1) / 2.0
+    prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta)
+    prototype *= up / prototype.sum()
+
+    # Phase p uses prototype[p + k * up] against input x[i - k]
+    bank = prototype.reshape(taps, up).T[:, ::-1].astype(np.float32)
+    bank = np.ascontiguousarray(bank)
+    bank.flags.writeable = False
+    return up, down, bank
+
+class PolyphaseResampler:
+    """Block-streaming sample-rate converter built on polyphase_filter_bank.
+
+    Blocks of any size up to max_input_frames go in, and whatever output they complete
+    comes out. Filter history and phase carry over between blocks. The work per block is
+    bounded by max_input_frames times the filter length.
+    """
+    def __init__(self, in_rate, out_rate, channels, max_input_frames, taps_per_phase=32):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+        self.max_input_frames = max_input_frames
+        self.up, self.down, self.bank = polyphase_filter_bank(in_rate, out_rate, taps_per_phase)
+        self.taps = self.bank.shape[1]
+        self.max_output_frames = self.output_frames_for(max_input_frames) + 1
+
+        # Channel-major so that each filter window is a contiguous run of samples
+        history = self.taps - 1
+        self._input = np.zeros((channels, history + max_input_frames), dtype=np.float32)
+        self._time = 0 # Next output position relative to the first new input frame, in upsampled samples
+        # Window j covers input frames [j - history, j], i.e. padded samples [j, j + history].
+        # Windows are gathered from the contiguous channel rows through this index table:
+        # taking from a strided view, or broadcasting j + offsets, allocates on every block
+        self._window_indices = np.arange(max_input_frames, dtype=np.intp)[:, None] + np.arange(self.taps)
+
+        # Scalars go into ufuncs as arrays, a Python int is converted into a new array per call
+        self._up = np.array(self.up, dtype=np.int64)
+        self._start = np.zeros((), dtype=np.int64)
+        self._steps = np.arange(self.max_output_frames, dtype=np.int64) * self.down
+        self._positions = np.zeros(self.max_output_frames, dtype=np.int64)
+        self._bases = np.zeros(self.max_output_frames, dtype=np.int64)
+        self._phases = np.zeros(self.max_output_frames, dtype=np.int64)
+        self._gather = np.zeros((self.max_output_frames, self.taps), dtype=np.intp)
+        self._coefficients = np.zeros((self.max_output_frames, self.taps), dtype=np.float32)
+        # Flat so that the first `count` windows of every channel make one contiguous matrix.
+        # Each window's dot product with its coefficients is then a single matrix-vector product
+        size = channels * self.max_output_frames
+        self._windows = np.zeros(size * self.taps, dtype=np.float32)
+        self._products = np.zeros(size * self.taps, dtype=np.float32)
+        self._sums = np.zeros(size, dtype=np.float32)
+        self._ones = np.ones(self.taps, dtype=np.float32)
+        self._history = np.zeros((channels, history), dtype=np.float32)
+        self._input_head = self._input[:, :history]
+        # Views of the buffers above per input frame count and per output count. Slicing makes
+        # a new array object every time, and on small blocks those outweigh the audio itself
+        self._input_views = {}
+        self._output_views = {}
+
+    def output_frames_for(self, input_frames):
+        """Upper bound on the output produced by `input_frames` of input."""
+        return -(-input_frames * self.up // self.down)
+
+    def reset(self):
+        self._input[:] = 0
+        self._time = 0
+
+    def process(self, block, out):
+        """Converts `block` (frames, channels) and writes the result into `out`.
+
+        Returns the number of output frames written.
+        """
+        frames = len(block)
+        views = self._input_views.get(frames)
+        if views is None:
+            history = self.taps - 1
+            views = self._input_views[frames] = (self._input[:, history:history + frames].T,
+                                                 self._input[:, frames:frames + history])
+        new_input, tail = views
+        new_input[...] = block
+
+        span = frames * self.up
+        count = max(0, -(-(span - self._time) // self.down))
+        if count:
+            steps, positions, bases, phases, gather, coefficients, channels, products, sums, result = \
+                self._scratch(count)
+            self._start.fill(self._time)
+            np.add(steps, self._start, out=positions)
+            np.floor_divide(positions, self._up, out=bases)
+            np.remainder(positions, self._up, out=phases)
+
+            # Methods rather than np.take, whose Python wrapper allocates its keyword arguments
+            self._window_indices.take(bases, 0, gather, 'clip')
+            self.bank.take(phases, 0, coefficients, 'clip')
+            for row, windows, channel_products in channels:
+                row.take(gather, None, windows, 'clip')
+                np.multiply(windows, coefficients, out=channel_products)
+            # np.dot with `out` goes straight to BLAS, np.matmul and np.einsum allocate per call
+            np.dot(products, self._ones, out=sums)
+            out[:count] = result
+
+        self._time += count * self.down - span
+        # Keep the last `history` input frames for the next block. The ranges overlap for
+        # short blocks, so go through a scratch buffer rather than let numpy allocate one
+        self._history[...] = tail
+        self._input_head[...] = self._history
+        return count
+
+    def _scratch(self, count):
+        """Views of the work buffers for `count` output frames."""
+        views = self._output_views.get(count)
+        if views is None:
+            size = self.channels * count
+            windows = self._windows[:size * self.taps].reshape(self.channels, count, self.taps)
+            products = self._products[:size * self.taps].reshape(self.channels, count, self.taps)
+            sums = self._sums[:size]
+            views = self._output_views[count] = (
+                self._steps[:count], self._positions[:count], self._bases[:count], self._phases[:count],
+                self._gather[:count], self._coefficients[:count], tuple(zip(self._input, windows, products)),
+                products.reshape(size, self.taps), sums, sums.reshape(self.channels, count).T)
+        return views
+
+# Speaker layouts by name, in WAVEFORMATEXTENSIBLE channel order
+CHANNEL_LAYOUTS = {
+    'mono': 1,     # C
+    'stereo': 2,   # FL FR
+    '5.1': 6,      # FL FR FC LFE BL BR
+    '7.1': 8,      # FL FR FC LFE BL BR SL SR
+}
+
+# Fold each layout down to stereo (rows are input channels). LFE is dropped, as in ITU-R BS.775
+_TO_STEREO = {
+    1: [[1.0, 1.0]],
+    2: [[1.0, 0.0], [0.0, 1.0]],
+    6: [[1.0, 0.0], [0.0, 1.0], [0.707, 0.707], [0.0, 0.0], [0.707, 0.0], [0.0, 0.707]],
+    8: [[1.0, 0.0], [0.0, 1.0], [0.707, 0.707], [0.0, 0.0], [0.707, 0.0], [0.0, 0.707], [0.707, 0.0], [0.0, 0.707]],
+}
+
+# Spread stereo out to each layout (rows are L and R). Centre stays phantom to keep the image
+_FROM_STEREO = {
+    1: [[0.5], [0.5]],
+    2: [[1.0, 0.0], [0.0, 1.0]],
+    6: [[1.0, 0.0, 0.0, 0.0, 0.707, 0.0], [0.0, 1.0, 0.0, 0.0, 0.0, 0.707]],
+    8: [[1.0, 0.0, 0.0, 0.0, 0.707, 0.0, 0.707, 0.0], [0.0, 1.0, 0.0, 0.0, 0.0, 0.707, 0.0, 0.707]],
+}
+
+def mix_matrix(in_layout, out_layout, normalize=True):
+    """Mixing matrix of shape (in_channels, out_channels) between two layouts.
+
+    Layouts are names from CHANNEL_LAYOUTS or plain channel counts. Known layouts are
+    mixed through stereo; other counts fold or repeat channels in order. With normalize,
+    no output channel can exceed full scale when every input is at full scale.
+    """
+    in_channels = CHANNEL_LAYOUTS.get(in_layout, in_layout)
+    out_channels = CHANNEL_LAYOUTS.get(out_layout, out_layout)
+    if not isinstance(in_channels, int) or not isinstance(out_channels, int) or in_channels < 1 or out_channels < 1:
+        raise ValueError(f"Unknown channel layout: {in_layout} -> {out_layout}")
+
+    if in_channels == out_channels:
+        return np.eye(in_channels, dtype=np.float32)
+
+    if (in_channels, out_channels) == (6, 8):
+        # 5.1 to 7.1: keep everything in place and feed the sides from the backs
+        matrix = np.zeros((6, 8))
+        matrix[np.arange(6), np.arange(6)] = 1.0
+        matrix[4, 6] = matrix[5, 7] = 0.707
+    elif (in_channels, out_channels) == (8, 6):
+        # 7.1 to 5.1: fold the sides into the backs
+        matrix = np.zeros((8, 6))
+        matrix[np.arange(6), np.arange(6)] = 1.0
+        matrix[6, 4] = matrix[7, 5] = 1.0
+    elif in_channels in _TO_STEREO and out_channels in _FROM_STEREO:
+        matrix = np.array(_TO_STEREO[in_channels]) @ np.array(_FROM_STEREO[out_channels])
+    else:
+        matrix = np.zeros((in_channels, out_channels))
+        if in_channels > out_channels:
+            matrix[np.arange(in_channels), np.arange(in_channels) % out_channels] = 1.0
+        else:
+            matrix[np.arange(out_channels) % in_channels, np.arange(out_channels)] = 1.0
+
+    if normalize:
+        matrix /= np.maximum(np.abs(matrix).sum(axis=0), 1.0)
+    return matrix.astype(np.float32)
 
+class ChannelMixer:
+    """Applies a channel mixing matrix to float32 blocks with a single matmul.
+
+    Without an explicit (in, out) matrix the preset from mix_matrix() is used. The output
+    buffer is allocated once, so process() doesn't allocate per block.
+    """
+    def __init__(self, in_channels, out_channels, max_frames, matrix=None):
+        if matrix is None:
+            matrix = mix_matrix(in_channels, out_channels)
+        else:
+            matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.shape != (in_channels, out_channels):
+            raise ValueError(f"Mixing matrix must have shape ({in_channels}, {out_channels}), got {matrix.shape}")
+
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self._out = np.zeros((max_frames, out_channels), dtype=np.float32)
+        self._views = {} # frames -> view of self._out
+
+    def process(self, block):
+        """Mixes `block` (frames, in_channels). Returns a view of the internal output buffer."""
+        frames = len(block)
+        out = self._views.get(frames)
+        if out is None:
+            out = self._views[frames] = self._out[:frames]
+        # np.dot with `out` goes straight to BLAS, np.matmul allocates per call
+        np.dot(block, self.matrix, out=out)
+        return out
+
+# Bytes per sample of each PortAudio sample format
+SAMPLE_SIZES = {
+    pyaudio.paFloat32: 4,
+    pyaudio.paInt32: 4,
+    pyaudio.paInt24: 3,
+    pyaudio.paInt16: 2,
+}
+FORMAT_NAMES = {
+    pyaudio.paFloat32: 'float32',
+    pyaudio.paInt32: 'int32',
+    pyaudio.paInt24: 'int24',
+    pyaudio.paInt16: 'int16',
+}
+FORMATS_BY_NAME = {name: sample_format for sample_format, name in FORMAT_NAMES.items()}
+# Full scale of the integer formats. int24 samples travel as three packed bytes
+_FULL_SCALE = {
+    pyaudio.paInt32: 2 ** 31,
+    pyaudio.paInt24: 2 ** 23,
+    pyaudio.paInt16: 2 ** 15,
+}
+# Tried in this order for a device's native format. The Windows audio engine mixes in float32,
+# so a shared-mode endpoint that takes float32 needs no conversion in the driver
+NATIVE_FORMATS = (pyaudio.paFloat32, pyaudio.paInt32, pyaudio.paInt24, pyaudio.paInt16)
+
+def native_sample_format(p, device_index, rate, channels, io='output', formats=NATIVE_FORMATS):
+    """First of `formats` the device accepts at this rate and channel count.
+
+    Falls back to int16, which every device takes, if the host API can't answer.
+    """
+    for sample_format in formats:
+        try:
             if io == 'output':
-                stream = p.open(
-                    format=format,
-                    channels=channels,
-                    rate=rate,
-                    output=True,
-                    frames_per_buffer=1024,
-                    output_device_index=device_index
-                )
-            else: # input or loopback
-                stream = p.open(
-                    format=format,
-                    channels=channels,
-                    rate=rate,
-                    input=True,
-                    frames_per_buffer=1024,
-                    input_device_index=device_index
-                )
-            
+                p.is_format_supported(rate, output_device=device_index, output_channels=channels,
+                                      output_format=sample_format)
+            else:
+                p.is_format_supported(rate, input_device=device_index, input_channels=channels,
+                                      input_format=sample_format)
+            return sample_format
+        except ValueError:
+            continue
+        except Exception:
+            break
+    return pyaudio.paInt16
+
+class SampleDecoder:
+    """Turns interleaved samples from a device into float32 frames in [-1, 1).
+
+    The bytes are copied into a buffer allocated once and converted in place from there,
+    so decode() doesn't allocate per block.
+    """
+    def __init__(self, sample_format, channels, max_frames):
+        if sample_format not in SAMPLE_SIZES:
+            raise ValueError(f"Unsupported sample format: {sample_format}")
+        self.sample_format = sample_format
+        self.channels = channels
+        self.frame_bytes = SAMPLE_SIZES[sample_format] * channels
+        # int24 is scaled after widening to int32. As an array, so the multiply converts nothing
+        full_scale = 2 ** 31 if sample_format == pyaudio.paInt24 else _FULL_SCALE.get(sample_format, 1)
+        self._scale = np.array(1.0 / full_scale, dtype=np.float32)
+        self._allocate(max_frames)
+
+    def _allocate(self, max_frames):
+        self._raw = np.zeros(max_frames * self.frame_bytes, dtype=np.uint8)
+        self._raw_bytes = memoryview(self._raw)
+        self._out = np.zeros((max_frames, self.channels), dtype=np.float32)
+        # int24 is widened by putting each 3-byte sample in the top of an int32
+        self._padded = np.zeros((max_frames * self.channels, 4), dtype=np.uint8)
+        self._views = {} # frames -> (output, copies), views of the buffers above
+
+    def _make_views(self, frames):
+        """The output for `frames` and the (destination, source) copies that fill it from the bytes."""
+        raw = self._raw[:frames * self.frame_bytes]
+        out = self._out[:frames]
+        if self.sample_format == pyaudio.paFloat32:
+            return raw.view(np.float32).reshape(frames, self.channels), ()
+        if self.sample_format == pyaudio.paInt24:
+            padded = self._padded[:frames * self.channels]
+            return out, ((padded[:, 1:], raw.reshape(-1, 3)), (out.reshape(-1), padded.view(np.int32)[:, 0]))
+        dtype = np.int32 if self.sample_format == pyaudio.paInt32 else np.int16
+        return out, ((out, raw.view(dtype).reshape(frames, self.channels)),)
+
+    def decode(self, data):
+        """Frames in `data` as float32 (frames, channels), valid until the next call."""
+        size = len(data)
+        if size > len(self._raw):
+            self._allocate(-(-size // self.frame_bytes)) # Only if the device hands over more than it was opened with
+        self._raw_bytes[:size] = data
+        frames = size // self.frame_bytes
+        views = self._views.get(frames)
+        if views is None:
+            views = self._views[frames] = self._make_views(frames)
+        out, copies = views
+        if copies:
+            for destination, source in copies:
+                destination[...] = source
+            out *= self._scale
+        return out
+
+class SampleEncoder:
+    """Turns float32 frames into a device's sample format at the output edge.
+
+    Samples are clipped to full scale, and `clipped_blocks` counts the blocks that needed
+    it. Outputs of 24 bits or less get TPDF dither of one LSB either way, so the rounding
+    error is a steady noise floor instead of distortion on quiet passages (float32 can't
+    resolve the LSB of int32, which is left undithered). encode() works in buffers
+    allocated once and returns a read-only byte view that is valid until the next call.
+    """
+    def __init__(self, sample_format, channels, max_frames, dither=True, seed=None):
+        if sample_format not in SAMPLE_SIZES:
+            raise ValueError(f"Unsupported sample format: {sample_format}")
+        self.sample_format = sample_format
+        self.channels = channels
+        self.clipped_blocks = 0
+        self.full_scale = _FULL_SCALE.get(sample_format)
+        self.dither = dither and sample_format in (pyaudio.paInt16, pyaudio.paInt24)
+        self._rng = np.random.default_rng(seed)
+        self._work = np.zeros((max_frames, channels), dtype=np.float32)
+        self._noise = np.zeros((max_frames, channels), dtype=np.float32)
+        self._noise2 = np.zeros((max_frames, channels), dtype=np.float32)
+        self._excess = np.zeros(max_frames * channels, dtype=np.float32)
+        self._energy = np.zeros((), dtype=np.float32)
+        # Bounds as arrays: ufuncs convert a Python float into a new array on every call
+        self._zero = np.array(0.0, dtype=np.float32)
+        self._one = np.array(1.0, dtype=np.float32)
+        self._minus_one = np.array(-1.0, dtype=np.float32)
+        if self.full_scale:
+            self._scale = np.array(self.full_scale, dtype=np.float32)
+            self._floor = np.array(-self.full_scale, dtype=np.float32)
+            # The largest integer float32 can hold below full scale: 2**31 - 1 itself rounds up and wraps
+            ceiling = min(self.full_scale - 1, float(np.nextafter(np.float32(self.full_scale), np.float32(0))))
+            self._ceiling = np.array(ceiling, dtype=np.float32)
+        if sample_format == pyaudio.paFloat32:
+            self._samples = np.zeros((max_frames, channels), dtype=np.float32)
+        elif sample_format == pyaudio.paInt16:
+            self._samples = np.zeros((max_frames, channels), dtype=np.int16)
+        else:
+            self._samples = np.zeros((max_frames, channels), dtype=np.int32)
+        # What goes to the device: int24 is packed down to three bytes per sample
+        self._output = self._samples
+        if sample_format == pyaudio.paInt24:
+            self._output = np.zeros((max_frames * channels, 3), dtype=np.uint8)
+        self._views = {} # frames -> views of the buffers above, the resampler only makes a couple of lengths
+
+    def _make_views(self, frames):
+        excess = self._excess[:frames * self.channels]
+        samples = self._samples[:frames]
+        packed = unpacked = None
+        rows = frames
+        if self.sample_format == pyaudio.paInt24:
+            rows = frames * self.channels
+            packed = self._output[:rows]
+            unpacked = samples.reshape(-1, 1).view(np.uint8)[:, :3]
+        # Read-only because PyAudio's write only accepts read-only buffers
+        data = memoryview(self._output[:rows]).toreadonly().cast('B')
+        return (excess.reshape(frames, self.channels), excess, samples, self._work[:frames], self._noise[:frames],
+                self._noise2[:frames], packed, unpacked, data)
+
+    def encode(self, audio):
+        """Encodes float32 `audio` (frames, channels). Returns a read-only byte view."""
+        frames = len(audio)
+        views = self._views.get(frames)
+        if views is None:
+            views = self._views[frames] = self._make_views(frames)
+        excess, flat_excess, samples, work, noise, noise2, packed, unpacked, data = views
+
+        # Anything past full scale leaves energy above it. Unlike audio.max(), which allocates
+        # for the reduction, a dot product into an array doesn't
+        np.absolute(audio, out=excess)
+        np.subtract(excess, self._one, out=excess)
+        np.maximum(excess, self._zero, out=excess)
+        np.dot(flat_excess, flat_excess, out=self._energy)
+        if float(self._energy) > 0.0:
+            self.clipped_blocks += 1
+
+        if self.full_scale is None:
+            np.minimum(audio, self._one, out=samples)
+            np.maximum(samples, self._minus_one, out=samples)
+        else:
+            np.multiply(audio, self._scale, out=work)
+            if self.dither:
+                # The difference of two uniform values is triangular over +-1 LSB
+                self._rng.random(out=noise, dtype=np.float32)
+                self._rng.random(out=noise2, dtype=np.float32)
+                noise -= noise2
+                work += noise
+            np.minimum(work, self._ceiling, out=work)
+            np.maximum(work, self._floor, out=work)
+            np.rint(work, out=work)
+            samples[...] = work
+            if packed is not None:
+                packed[...] = unpacked
+        return data
+
+def config_path(filename):
+    """Path of a TwinPlay settings file: %APPDATA%\\TwinPlay on Windows, ~/.config/TwinPlay elsewhere."""
+    base = os.environ.get('APPDATA') or os.path.join(os.path.expanduser('~'), '.config')
+    folder = os.path.join(base, 'TwinPlay')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, filename)
+
+CALIBRATION_FILE = 'calibration.json'
+
+def load_calibration():
+    """Saved delays as {primary name: {sink name: {'delay_ms', 'offset_ms', 'measured'}}}."""
+    try:
+        with open(config_path(CALIBRATION_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_calibration(primary_name, sink_name, delay_ms, offset_ms):
+    calibration = load_calibration()
+    calibration.setdefault(primary_name, {})[sink_name] = {
+        'delay_ms': delay_ms,
+        'offset_ms': offset_ms,
+        'measured': time.time(),
+    }
+    with open(config_path(CALIBRATION_FILE), 'w', encoding='utf-8') as f:
+        json.dump(calibration, f, indent=2)
+
+def saved_delay(primary_name, sink_name):
+    """Calibrated delay for this device pair in ms, or None if it was never measured."""
+    entry = load_calibration().get(primary_name, {}).get(sink_name)
+    return entry['delay_ms'] if entry else None
+
+CAPABILITY_FILE = 'devices.json'
+CAPABILITY_MAX_AGE_S = 7 * 24 * 3600 # Re-probe weekly in case a driver update changed what a device takes
+
+def device_identity(p, info):
+    """Key for a device that survives reboots and index reshuffles.
+
+    The native rate is part of it, so changing a device's format in Windows counts as a new device.
+    """
+    host_api = p.get_host_api_info_by_index(info['hostApi'])['name']
+    return (f"{host_api}|{info['name']}|in{info['maxInputChannels']}|out{info['maxOutputChannels']}"
+            f"|{int(info['defaultSampleRate'])}")
+
+class CapabilityCache:
+    """Supported sample rates per device, kept in devices.json between runs.
+
+    Entries are keyed by device_identity(). sync() prunes devices that are gone whenever the
+    device list changes. Probing uses is_format_supported, which is far cheaper than opening
+    streams. probe_all() probes several devices at once on backends that declare their format
+    queries thread safe, PortAudio itself does not promise that.
+    """
+    def __init__(self, path=None):
+        self.path = path or config_path(CAPABILITY_FILE)
+        self.fingerprint = None
+        self.devices = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            self.fingerprint = saved.get('fingerprint')
+            self.devices = saved.get('devices', {})
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        with self._lock:
+            saved = {'fingerprint': self.fingerprint, 'devices': dict(self.devices)}
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, indent=2)
+        except OSError as e:
+            print(f"Could not save device capabilities: {e}")
+
+    def sync(self, p):
+        """Checks the cache against the current device list. Returns {device index: identity}."""
+        identities = {}
+        for i in range(p.get_device_count()):
+            info = p.get_device_info_by_index(i)
+            identities[info['index']] = device_identity(p, info)
+        fingerprint = hashlib.sha1('\n'.join(sorted(identities.values())).encode('utf-8')).hexdigest()
+        if fingerprint != self.fingerprint:
+            present = set(identities.values())
+            with self._lock:
+                self.devices = {key: entry for key, entry in self.devices.items() if key in present}
+                self.fingerprint = fingerprint
+            self.save()
+        return identities
+
+    def _cached(self, identity, io):
+        entry = self.devices.get(identity)
+        if entry and io in entry and time.time() - entry.get('probed', 0) < CAPABILITY_MAX_AGE_S:
+            return entry[io]
+        return None
+
+    def _probe(self, p, device_index, identity, io):
+        rates = probe_supported_rates(p, device_index, io)
+        with self._lock:
+            entry = self.devices.setdefault(identity, {})
+            entry[io] = rates
+            entry['probed'] = time.time()
+            self.misses += 1
+        return rates
+
+    def supported_rates(self, p, device_index, io='output'):
+        identity = device_identity(p, p.get_device_info_by_index(device_index))
+        rates = self._cached(identity, io)
+        if rates is not None:
+            self.hits += 1
+            return list(rates)
+        rates = self._probe(p, device_index, identity, io)
+        self.save()
+        return list(rates)
+
+    def probe_all(self, p, workers=4):
+        """Fills the cache for every device that isn't in it yet."""
+        jobs = []
+        for index, identity in self.sync(p).items():
+            info = p.get_device_info_by_index(index)
+            for io, channels in (('output', info['maxOutputChannels']), ('input', info['maxInputChannels'])):
+                if channels <= 0:
+                    continue
+                if self._cached(identity, io) is None:
+                    jobs.append((index, identity, io))
+                else:
+                    self.hits += 1
+        if not jobs:
+            return
+
+        if getattr(p, 'thread_safe_queries', False) and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(lambda job: self._probe(p, *job), jobs))
+        else:
+            for job in jobs:
+                self._probe(p, *job)
+        self.save()
+
+    def clear(self):
+        with self._lock:
+            self.devices = {}
+        self.save()
+
+def estimate_offsets(reference, recording, sample_rate, max_lag_ms=1000, peaks=3, min_separation_ms=10):
+    """Finds where `reference` shows up in `recording` with FFT cross-correlation.
+
+    Both are mono float arrays at sample_rate. GCC-PHAT weighting whitens the spectra so
+    program material gives peaks as sharp as test noise does. Returns up to `peaks`
+    (lag_ms, strength) pairs, strongest first. A positive lag means the recording is late.
+    """
+    size = 1 << (len(reference) + len(recording) - 1).bit_length()
+    spectrum = np.fft.rfft(recording, size) * np.conj(np.fft.rfft(reference, size))
+    spectrum /= np.abs(spectrum) + 1e-12
+    correlation = np.fft.irfft(spectrum, size)
+
+    # Lags -max_lag..max_lag, negative lags wrap around to the end
+    max_lag = min(int(sample_rate * max_lag_ms / 1000), size // 2 - 1)
+    strength = np.abs(np.concatenate((correlation[-max_lag:], correlation[:max_lag + 1])))
+    separation = int(sample_rate * min_separation_ms / 1000)
+
+    found = []
+    for _ in range(peaks):
+        i = int(np.argmax(strength))
+        if strength[i] <= 0:
+            break
+        found.append(((i - max_lag) * 1000.0 / sample_rate, float(strength[i])))
+        strength[max(0, i - separation):i + separation + 1] = 0
+    return found
+
+HISTOGRAM_BINS = 24 # Bin i holds blocks that took [2^(i-1), 2^i) microseconds, the last one everything longer
+
+class BlockTimer:
+    """Remembers how long the last `history` audio blocks took to process.
+
+    Storage is preallocated, recording a block is one perf_counter pair, an array store and a
+    histogram increment. One thread records, any thread may read: readers may see a block
+    half-counted, never a torn structure, so no lock is needed.
+    """
+    def __init__(self, history=4096):
+        self.times = np.zeros(history)
+        self.count = 0
+        self.histogram = [0] * HISTOGRAM_BINS # Over every block since the last reset
+
+    def record(self, seconds):
+        self.times[self.count % len(self.times)] = seconds
+        self.histogram[min(int(seconds * 1e6).bit_length(), HISTOGRAM_BINS - 1)] += 1
+        self.count += 1
+
+    def recent(self):
+        """Durations in seconds of the most recent blocks, in no particular order."""
+        return self.times[:min(self.count, len(self.times))].copy()
+
+    def summary(self):
+        """Block count, p50/p99/max of the recent blocks in microseconds, and the histogram."""
+        recent = self.recent()
+        summary = {'count': self.count, 'histogram': list(self.histogram)}
+        if len(recent):
+            p50, p99 = np.percentile(recent, [50, 99]) * 1e6
+            summary.update(p50_us=float(p50), p99_us=float(p99), max_us=float(recent.max() * 1e6))
+        return summary
+
+    def reset(self):
+        self.count = 0
+        self.histogram = [0] * HISTOGRAM_BINS
+
+class RateMeter:
+    """Measures the real frame rate of a stream from the frames it moves and the clock.
+
+    A device whose crystal runs 100 ppm fast shows up as 48004.8 Hz instead of 48000. The
+    first `warmup_s` are ignored: an output takes blocks faster than real time until its
+    device buffer is full.
+    """
+    def __init__(self, warmup_s=1.0):
+        self.warmup_s = warmup_s
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.started = None
+        self.first = None
+        self.last = None
+        self._base = 0
+
+    def add(self, frames, now):
+        if self.started is None:
+            self.started = now
+        if self.first is None and now - self.started >= self.warmup_s:
+            # Time starts at the end of this block, so its frames don't count
+            self.first, self._base = now, self.frames + frames
+        self.frames += frames
+        self.last = now
+
+    def rate(self):
+        """Frames per second since the first block, None until there's half a second to go on."""
+        if self.first is None or self.last - self.first < 0.5:
+            return None
+        return (self.frames - self._base) / (self.last - self.first)
+
+# Latency profiles. Each device's blocks are sized from the latency it reports for the profile
+# (times `scale`, rounded up to a power of two within the profile's bounds), every sink's ring
+# keeps `cushion_blocks` blocks in reserve, and 'callback' outputs render inside the PortAudio
+# callback rather than in a writer thread doing blocking writes.
+LATENCY_PROFILES = {
+    'low': {'device_latency': 'Low', 'scale': 1.0, 'min_frames': 64, 'max_frames': 512,
+            'cushion_blocks': 3, 'callback': True},
+    'balanced': {'device_latency': 'Low', 'scale': 4.0, 'min_frames': 256, 'max_frames': 1024,
+                 'cushion_blocks': 3, 'callback': False},
+    'safe': {'device_latency': 'High', 'scale': 2.0, 'min_frames': 1024, 'max_frames': 4096,
+             'cushion_blocks': 4, 'callback': False},
+}
+NO_LATENCY_PROFILE = 'none' # The GUI's choice for fixed blocks of frames_per_buffer, the default
+MAX_BLOCK_FRAMES = 8192 # How far underruns may grow a block, whatever the profile
+BLOCK_SHRINK_AFTER_S = 60.0 # Underrun-free time before a grown block is halved again
+
+def profile_block_frames(info, io, rate, profile):
+    """Block size in frames for a device under a latency profile. `io` is 'input' or 'output'."""
+    if profile not in LATENCY_PROFILES:
+        raise ValueError(f"Unknown latency profile: {profile}")
+    settings = LATENCY_PROFILES[profile]
+    latency = info.get(f"default{settings['device_latency']}{io.capitalize()}Latency") or 0.0
+    frames = max(int(latency * settings['scale'] * rate), 1)
+    frames = 1 << (frames - 1).bit_length() # Round up to a power of two
+    return min(max(frames, settings['min_frames']), settings['max_frames'])
+
+class BlockSizeController:
+    """Adapts a sink's block size to how well it keeps up.
+
+    New underruns double the block, up to max_frames. Once there have been none for
+    stable_s it is halved again, but never below the size it started at.
+    """
+    def __init__(self, frames, max_frames=MAX_BLOCK_FRAMES, stable_s=BLOCK_SHRINK_AFTER_S):
+        self.min_frames = frames
+        self.max_frames = max(max_frames, frames)
+        self.stable_s = stable_s
+        self._underruns = None
+        self._stable_since = None
+
+    def restart(self):
+        """Forgets the underrun count, for a sink whose counters started over."""
+        self._underruns = None
+
+    def update(self, frames, underruns, now, counts=True):
+        """Returns the block size to use from now on.
+
+        `underruns` is the sink's running total. New ones are ignored unless `counts`,
+        e.g. while the source is silent and starving every sink on purpose.
+        """
+        new = self._underruns is not None and underruns > self._underruns
+        self._underruns = underruns
+        if self._stable_since is None:
+            self._stable_since = now
+        if new and counts:
+            self._stable_since = now
+            return min(frames * 2, self.max_frames)
+        if frames > self.min_frames and now - self._stable_since >= self.stable_s:
+            self._stable_since = now
+            return max(frames // 2, self.min_frames)
+        return frames
+
+class Limiter:
+    """Peak limiter for a sum of sources, so loud moments on two of them don't clip.
+
+    The gain drops far enough to keep each block's peak under `threshold`, getting there
+    within attack_ms, and recovers towards unity with a release_ms time constant. Works in
+    place on float32 blocks without allocating.
+    """
+    def __init__(self, channels, max_frames, sample_rate, threshold=0.95, attack_ms=1.0, release_ms=250.0):
+        self.threshold = threshold
+        self.attack_frames = max(1, int(sample_rate * attack_ms / 1000.0))
+        self.release_frames = sample_rate * release_ms / 1000.0
+        self.gain = 1.0
+        self.limited_blocks = 0
+        self._ramp = np.arange(max_frames, dtype=np.float32)
+        self._curve = np.zeros(max_frames, dtype=np.float32)
+        self._curves = np.zeros((max_frames, channels), dtype=np.float32)
+
+    def process(self, block):
+        """Limits `block` (frames, channels) in place and returns it."""
+        frames = len(block)
+        peak = max(float(block.max()), -float(block.min()))
+        start = self.gain
+        target = 1.0 - (1.0 - start) * exp(-frames / self.release_frames)
+        if peak * target > self.threshold:
+            target = self.threshold / peak
+            self.limited_blocks += 1
+            step = (target - start) / min(self.attack_frames, frames)
+        elif start == 1.0:
+            return block # Nothing to do, the common case
+        else:
+            step = (target - start) / frames
+
+        # Ramp from the last block's gain to the new one so the gain never jumps
+        curve = self._curve[:frames]
+        np.multiply(self._ramp[:frames], step, out=curve)
+        curve += start
+        # Hold the target once the ramp gets there, in either direction
+        if step < 0:
+            np.maximum(curve, target, out=curve)
+        else:
+            np.minimum(curve, target, out=curve)
+        self._curves[:frames] = curve[:, None]
+        block *= self._curves[:frames]
+        # Carry on from the gain actually applied, not the target, so the next block starts without a jump
+        gain = float(curve[-1])
+        self.gain = gain if gain < 0.9999 else 1.0
+        return block
+
+class SourceInput:
+    """An extra capture source as one sink hears it.
+
+    The source's callback fills `buffer` at the source's own rate and channels. pull()
+    drift-compensates it against the sink's pace, exactly like the sink's ring for the
+    primary source, and converts it to the primary's rate and channels for mixing.
+    """
+    def __init__(self, source, sample_rate, channels, frames, target_ms, buffer_ms=200, buffer=None):
+        self.source = source
+        self.buffer = buffer if buffer is not None else RingBuffer(
+            buffer_ms, source.sample_rate, source.channels, dtype=np.float32
+        )
+        # Enough source frames per pull to make `frames` at the primary's rate
+        in_frames = -(-frames * source.sample_rate // sample_rate)
+        self.drift = DriftCompensator(source.sample_rate, source.channels, in_frames, target_ms=target_ms)
+        self._block = np.zeros((in_frames, source.channels), dtype=np.float32)
+
+        self.resampler = None
+        self.pending = None
+        max_frames = frames
+        if source.sample_rate != sample_rate:
+            self.resampler = PolyphaseResampler(source.sample_rate, sample_rate, source.channels, in_frames)
+            self._converted = np.zeros((self.resampler.max_output_frames, source.channels), dtype=np.float32)
+            max_frames = max(frames, self.resampler.max_output_frames)
+            # Conversion doesn't come out in whole blocks, the rest waits here for the next pull
+            self.pending = RingBuffer(
+                3 * max_frames * 1000.0 / sample_rate, sample_rate, channels, dtype=np.float32
+            )
+        self.mixer = ChannelMixer(source.channels, channels, max_frames) if source.channels != channels else None
+
+    def reset(self, clear_buffer=True):
+        if clear_buffer:
+            self.buffer.clear()
+        self.drift.reset()
+        if self.resampler:
+            self.resampler.reset()
+            self.pending.clear()
+
+    def pull(self, out):
+        """Fills `out` (frames, channels) with this source, aligned to the primary."""
+        if self.resampler is None:
+            block = self._block[:len(out)]
+            self.drift.pull(self.buffer, block)
+            out[:] = self.mixer.process(block) if self.mixer else block
+            return
+
+        pending = self.pending
+        while pending.available() < len(out):
+            self.drift.pull(self.buffer, self._block)
+            audio = self._converted[:self.resampler.process(self._block, self._converted)]
+            pending.write(self.mixer.process(audio) if self.mixer else audio)
+        pending.read(out)
+
+class OutputSink:
+    """One output device fed from the shared loopback capture.
+
+    Each sink owns its ring, drift compensation, rate conversion, delay, writer thread
+    and stream, so a slow sink never holds up capture or the other sinks. Everything up to
+    the device is float32; with sample_format=None the stream opens in the device's native
+    format (see NATIVE_FORMATS) and the encoder converts to it as the last step.
+
+    With callback_output=True there is no writer thread: PortAudio's callback renders each
+    block as the device asks for it, which saves the blocking write's extra buffer.
+
+    `sources` are extra CaptureSources summed into the primary at their gains, each through
+    its own SourceInput, with a Limiter on the sum.
+    """
+    def __init__(self, session, device_index, source_rate, source_channels, sample_format, frames_per_buffer,
+                 buffer_ms=200, latency_ms=60, delay_ms=0, overrun_policy=DROP_OLDEST,
+                 underrun_policy=INSERT_SILENCE, channels=None, matrix=None, max_delay_ms=1000, on_failure=None,
+                 dither=True, callback_output=False, capture_frames=None, buffer=None, sources=(),
+                 source_buffers=None, primary_gain=1.0):
+        self.session = session
+        self.p = session.p
+        self.requested = (channels, matrix) # What to rebuild this sink with if its device comes back different
+        self.on_failure = on_failure # Called from the writer thread when the stream dies
+        self.failure = None
+        self.last_progress = None # perf_counter() of the last write that went through
+        self.first_audio = None # perf_counter() of the first write that carried captured audio
+        self.device_index = device_index
+        self.source_rate = source_rate
+        self.source_channels = source_channels
+        self.frames_per_buffer = frames_per_buffer
+        self.capture_frames = capture_frames or frames_per_buffer # Block size the ring is filled in
+        self.callback_output = callback_output
+        self.block_sizes = None # BlockSizeController, when the router adapts this sink's block size
+        self.taps = () # RecordingTaps of what this sink plays, see AudioRouter.add_tap()
+        self.output_underflows = 0 # Reported by PortAudio to callback outputs
+        self.latency_ms = latency_ms
+        self.max_delay_ms = max_delay_ms
+        self.delay_ms = min(max(delay_ms, 0), max_delay_ms)
+        self.muted = False
+        self.stream = None
+        self.thread = None
+        self.running = False
+
+        try:
+            self.info = self.p.get_device_info_by_index(device_index)
+        except OSError as e:
+            raise Exception(f"Could not get device info for output device {device_index}. Error: {e}")
+        self.name = self.info['name']
+
+        # Each stream opens at its own native rate and the sink converts from the loopback rate
+        supported_rates = get_supported_rates(self.p, device_index, 'output', session.capabilities)
+        self.sample_rate = int(self.info['defaultSampleRate'])
+
+        if self.sample_rate not in supported_rates:
+            # Native rate refused, prefer the loopback rate (no conversion) and then 48kHz/44.1kHz
+            preferred_rates = [source_rate, 48000, 44100] + supported_rates
+            self.sample_rate = next((rate for rate in preferred_rates if rate in supported_rates), None)
+            if self.sample_rate is None:
+                raise Exception(f"Output device '{self.name}' did not accept any common sample rate.")
+            print(f"WARNING: Output device '{self.name}' rejected its default rate, using {self.sample_rate} Hz.")
+
+        # Output channels: explicit, implied by a custom matrix, or as many as the device takes
+        if channels is None:
+            channels = np.shape(matrix)[1] if matrix is not None else min(source_channels, self.info['maxOutputChannels'])
+        if channels > self.info['maxOutputChannels']:
+            raise Exception(f"Output device '{self.name}' only supports {self.info['maxOutputChannels']} output channels, {channels} requested.")
+        self.channels = channels
+
+        # Resample whichever side of the mixer has fewer channels
+        self.resampler = None
+        max_frames = frames_per_buffer
+        if self.sample_rate != source_rate:
+            print(f"Converting {source_rate} Hz loopback audio to {self.sample_rate} Hz for '{self.name}'.")
+            self.resampler = PolyphaseResampler(
+                source_rate, self.sample_rate, min(source_channels, channels), frames_per_buffer
+            )
+            max_frames = max(max_frames, self.resampler.max_output_frames)
+
+        self.mixer = None
+        if matrix is not None or channels != source_channels:
+            print(f"Mixing {source_channels} loopback channels to {channels} for '{self.name}'.")
+            self.mixer = ChannelMixer(source_channels, channels, max_frames, matrix)
+        self.mix_first = self.mixer is not None and channels < source_channels
+
+        if sample_format is None:
+            sample_format = native_sample_format(self.p, device_index, self.sample_rate, channels, 'output')
+        self.sample_format = sample_format
+        print(f"Sending {FORMAT_NAMES.get(sample_format, sample_format)} samples to '{self.name}'.")
+        self.encoder = SampleEncoder(sample_format, channels, max_frames, dither=dither)
+        self.max_frames = max_frames # Longest block _mix() returns
+
+        # The delay line is the ring itself: the delay is extra cushion on top of the latency
+        # target, and the ring is preallocated for the largest delay we allow. A sink that
+        # replaces another one for the same device can take over its ring, audio and all.
+        self.buffer = buffer if buffer is not None else RingBuffer(
+            buffer_ms + max_delay_ms, source_rate, source_channels, dtype=np.float32,
+            overrun_policy=overrun_policy, underrun_policy=underrun_policy
+        )
+        # Callback outputs render whole blocks but hand the device exactly what it asks for,
+        # the rest waits here for the next callback
+        self.pending = None
+        if callback_output:
+            self.pending = RingBuffer(
+                4 * max_frames * 1000.0 / self.sample_rate, self.sample_rate, channels, dtype=np.float32
+            )
+        self.drift = DriftCompensator(
+            source_rate, source_channels, frames_per_buffer, target_ms=latency_ms + self.delay_ms
+        )
+        self.render_timer = BlockTimer()
+        self.rate_meter = RateMeter()
+        self.frame_bytes = SAMPLE_SIZES[sample_format] * self.channels
+
+        # Every source is pulled into a row of one stack, so a single matmul with the gains sums them
+        source_buffers = source_buffers or [None] * len(sources)
+        self.sources = [
+            SourceInput(source, source_rate, source_channels, frames_per_buffer, latency_ms + self.delay_ms,
+                        buffer_ms + max_delay_ms, buffer=ring)
+            for source, ring in zip(sources, source_buffers)
+        ]
+        self.gains = np.array([primary_gain] + [source.gain for source in sources], dtype=np.float32)
+        self.limiter = None
+        if self.sources:
+            self.limiter = Limiter(source_channels, frames_per_buffer, source_rate)
+            self._stack = np.zeros((len(self.gains), frames_per_buffer * source_channels), dtype=np.float32)
+            self._mixed = np.zeros((frames_per_buffer, source_channels), dtype=np.float32)
+
+    def set_delay(self, delay_ms):
+        """Changes this sink's delay while it plays. Returns the delay actually applied."""
+        self.delay_ms = min(max(delay_ms, 0), self.max_delay_ms)
+        self.drift.retarget(self.latency_ms + self.delay_ms)
+        for source in self.sources:
+            source.drift.retarget(self.latency_ms + self.delay_ms)
+        return self.delay_ms
+
+    def start(self, clear_buffer=True):
+        """Opens the stream and starts playing. clear_buffer=False keeps what is already in the ring."""
+        callback = None
+        if self.callback_output:
+            self._buffers = self._render_buffers()
+            self._callback_block = np.zeros((self.max_frames, self.channels), dtype=np.float32)
+            callback = self._output_callback
+        # A callback stream only starts once the state below is reset, the callback reads it
+        self.stream = self.session.open_stream(
+            self.name,
+            format=self.sample_format,
+            channels=self.channels,
+            rate=self.sample_rate,
+            output=True,
+            output_device_index=self.device_index,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=callback,
+            start=not self.callback_output
+        )
+
+        if clear_buffer:
+            self.buffer.clear()
+        self.drift.reset()
+        if self.resampler:
+            self.resampler.reset()
+        if self.pending is not None:
+            self.pending.clear()
+        for source in self.sources:
+            source.reset(clear_buffer)
+        self.failure = None
+        self.last_progress = time.perf_counter()
+        self.first_audio = None
+        self.rate_meter.reset()
+        self.running = True
+        if self.callback_output:
+            try:
+                self.stream.start_stream()
+            except Exception:
+                self.stop()
+                raise
+        else:
+            self.thread = threading.Thread(target=self._run_writer, daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=2):
+        """Stops the writer and closes the stream.
+
+        A writer still stuck in a write after `timeout` (a stalled device) gets the stream
+        aborted under it, which makes the write return. The stream is only closed once the
+        writer is gone, closing it during a write can crash PortAudio.
+        """
+        self.running = False
+        thread = self.thread
+        if thread and thread is not threading.current_thread() and thread.is_alive():
+            thread.join(timeout=timeout)
+            if thread.is_alive():
+                print(f"Writer for '{self.name}' is stuck in a write, aborting the stream.")
+                try:
+                    self.session.abort_stream(self.stream)
+                except Exception as e:
+                    print(f"Error aborting output stream on {self.name}: {e}")
+                thread.join()
+        self.thread = None
+
+        if self.stream:
+            try:
+                self.session.close_stream(self.name, self.stream)
+            except Exception as e:
+                print(f"Error closing output stream on {self.name}: {e}")
+            self.stream = None
+
+    def _render_buffers(self):
+        """Scratch buffers for _render(), allocated once per writer."""
+        resampler = self.resampler
+        if self.sources:
+            # The primary is pulled straight into its row of the mixing stack
+            block = self._stack[0].reshape(self.frames_per_buffer, self.source_channels)
+        else:
+            block = np.zeros((self.frames_per_buffer, self.source_channels), dtype=np.float32)
+        max_frames = resampler.max_output_frames if resampler else self.frames_per_buffer
+        converted = np.zeros((max_frames, resampler.channels), dtype=np.float32) if resampler else None
+        return block, converted
+
+    def _render(self, block, converted):
+        """Pulls one block from the ring and returns it as a byte view for the device.
+
+        The view belongs to the encoder and is only valid until the next call. That's fine
+        for blocking writes, which have copied the data out by the time they return.
+        """
+        # The filter can ring slightly past full scale, the encoder clips
+        return self.encoder.encode(self._mix(block, converted))
+
+    def _mix(self, block, converted):
+        """Pulls one block from the ring and returns it delayed, converted and mixed, still as float32."""
+        resampler = self.resampler
+        mixer = self.mixer
+        self.drift.pull(self.buffer, block)
+        audio = block
+        if self.sources:
+            audio = self._mix_sources(block)
+        if self.muted:
+            audio[:] = 0
+
+        if mixer and self.mix_first:
+            audio = mixer.process(audio)
+        if resampler:
+            audio = converted[:resampler.process(audio, converted)]
+        if mixer and not self.mix_first:
+            audio = mixer.process(audio)
+        for tap in self.taps:
+            tap.push(audio)
+        return audio
+
+    def _mix_sources(self, block):
+        """Sums the primary `block` with every extra source at their gains, then limits the sum."""
+        frames, channels = block.shape
+        samples = frames * channels
+        stack = self._stack
+        for row, source in enumerate(self.sources, 1):
+            source.pull(stack[row, :samples].reshape(frames, channels))
+        mixed = self._mixed[:frames]
+        np.matmul(self.gains, stack[:, :samples], out=mixed.reshape(samples))
+        return self.limiter.process(mixed)
+
+    def _output_callback(self, in_data, frame_count, time_info, status):
+        """Renders what the device asks for, on PortAudio's thread. Only for callback outputs."""
+        started = time.perf_counter()
+        if status & pyaudio.paOutputUnderflow:
+            self.output_underflows += 1
+        try:
+            # PortAudio asks for the frames_per_buffer we opened with, which the encoder has room for
+            pending = self.pending
+            while pending.available() < frame_count:
+                pending.write(self._mix(*self._buffers))
+            out = self._callback_block[:frame_count]
+            pending.read(out)
+            data = self.encoder.encode(out)
+        except Exception as e:
+            print(f"Error rendering for {self.name}: {e}")
+            self._fail(f"render failed: {e}")
+            return (None, pyaudio.paAbort)
+
+        self.last_progress = time.perf_counter()
+        self.render_timer.record(self.last_progress - started)
+        self.rate_meter.add(frame_count, self.last_progress)
+        if self.first_audio is None and not self.drift.priming:
+            self.first_audio = self.last_progress
+        return (data, pyaudio.paContinue)
+
+    def _run_writer(self):
+        """Drains the ring into the device. Blocking writes pace this loop."""
+        buffers = self._render_buffers()
+        while self.running:
+            stream = self.stream
+            if not stream or not stream.is_active():
+                self._fail("output stream stopped")
+                break
+            started = time.perf_counter()
+            data = self._render(*buffers)
+            self.render_timer.record(time.perf_counter() - started)
+            try:
+                stream.write(data)
+            except Exception as e:
+                if self.running: # Not just stop() aborting the stream
+                    print(f"Error writing to {self.name}: {e}")
+                self._fail(f"write failed: {e}")
+                break
+            self.last_progress = time.perf_counter()
+            self.rate_meter.add(len(data) // self.frame_bytes, self.last_progress)
+            if self.first_audio is None and not self.drift.priming:
+                self.first_audio = self.last_progress
+        print(f"Writer thread for '{self.name}' finished.")
+
+    def _fail(self, reason):
+        # Only a failure if nobody asked us to stop
+        if self.running:
+            self.failure = reason
+            if self.on_failure:
+                self.on_failure(self)
+
+    def estimated_latency_ms(self):
+        """Estimated capture-to-speaker latency: capture block, ring backlog, filter delay and device buffer."""
+        latency_ms = (self.capture_frames + self.buffer.available()) * 1000.0 / self.source_rate
+        if self.resampler:
+            latency_ms += self.resampler.taps / 2 * 1000.0 / self.source_rate
+        if self.pending is not None:
+            latency_ms += self.pending.available() * 1000.0 / self.sample_rate
+        stream = self.stream
+        if stream:
+            try:
+                latency_ms += stream.get_output_latency() * 1000.0
+            except Exception:
+                pass # Closed under us
+        return latency_ms
+
+    def metrics(self):
+        """Snapshot of this sink's buffer and drift state."""
+        measured_rate = self.rate_meter.rate()
+        render = self.render_timer.summary()
+        metrics = {
+            'device_index': self.device_index,
+            'sample_rate': self.sample_rate,
+            'sample_format': FORMAT_NAMES.get(self.sample_format),
+            'channels': self.channels,
+            'delay_ms': self.delay_ms,
+            'frames_per_buffer': self.frames_per_buffer,
+            'output_mode': 'callback' if self.callback_output else 'blocking',
+            'output_underflows': self.output_underflows,
+            'clipped_blocks': self.encoder.clipped_blocks,
+            'overruns': self.buffer.overruns,
+            'dropped_frames': self.buffer.dropped_frames,
+            'underruns': self.buffer.underruns,
+            'inserted_frames': self.buffer.inserted_frames,
+            'backlog_frames': self.buffer.available(),
+            'latency_ms': self.estimated_latency_ms(),
+            'measured_rate': measured_rate,
+            'clock_ppm': (measured_rate / self.sample_rate - 1.0) * 1e6 if measured_rate else None,
+            'render_p50_us': render.get('p50_us'),
+            'render_p99_us': render.get('p99_us'),
+            'render_max_us': render.get('max_us'),
+        }
+        if self.limiter:
+            metrics['limited_blocks'] = self.limiter.limited_blocks
+            metrics['limiter_gain'] = self.limiter.gain
+        metrics.update(self.drift.metrics())
+        return metrics
+
+WATCHDOG_INTERVAL_S = 0.25
+# Wait between attempts to reopen a lost stream, the last value repeats until it's back
+RECOVERY_BACKOFF_S = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+class AudioSession:
+    """One PortAudio context and device map shared by device listing and every route.
+
+    Starting PortAudio enumerates every endpoint, which takes a while on machines with many
+    of them. A session does that once, so routes can be started, stopped and changed
+    without going through it again. Stream setup and teardown times are kept in
+    `stream_timings`. PortAudio only notices new or removed devices when it restarts,
+    which is what refresh(restart=True) does.
+    """
+    def __init__(self, backend=None, capabilities=None):
+        self.backend = backend
+        self.capabilities = capabilities if capabilities is not None else CapabilityCache()
+        self.stream_timings = deque(maxlen=256) # (action, stream name, ms)
+        self.p = None
+        self.refresh(restart=True)
+
+    def refresh(self, restart=False):
+        """Re-reads the device list. Restarting PortAudio is only safe with no routes running."""
+        if restart:
+            started = time.perf_counter()
+            if self.p:
+                self.p.terminate()
+            self.p = self.backend() if self.backend else create_backend()
+            self.init_ms = (time.perf_counter() - started) * 1000.0
+        self.identities = self.capabilities.sync(self.p)
+        self.devices = {}
+        for i in range(self.p.get_device_count()):
+            info = self.p.get_device_info_by_index(i)
+            self.devices[info['index']] = info
+        self._loopbacks = {}
+
+    def device_info(self, device_index):
+        info = self.devices.get(device_index)
+        if info is None:
+            raise OSError(f"Invalid device index: {device_index}")
+        return info
+
+    def list_devices(self):
+        """The deduplicated device list the GUI shows, see list_audio_devices()."""
+        return _list_devices(self.p)
+
+    def default_output_index(self):
+        return self.p.get_default_output_device_info()['index']
+
+    def find_loopback(self, output_index):
+        """Info of the WASAPI loopback that captures `output_index`, or None."""
+        if output_index not in self._loopbacks:
+            output_name = self.device_info(output_index)['name']
+            try:
+                wasapi_index = self.p.get_host_api_info_by_type(pyaudio.paWASAPI)['index']
+            except OSError:
+                wasapi_index = None
+            # The loopback is the WASAPI loopback device whose name contains the output's name
+            self._loopbacks[output_index] = next(
+                (info for info in self.devices.values()
+                 if info.get('isLoopbackDevice') and info['hostApi'] == wasapi_index and output_name in info['name']),
+                None
+            )
+        return self._loopbacks[output_index]
+
+    def _record_timing(self, action, name, started):
+        ms = (time.perf_counter() - started) * 1000.0
+        self.stream_timings.append((action, name, ms))
+        return ms
+
+    def open_stream(self, name, **kwargs):
+        """p.open() with its setup time recorded. `name` labels the stream in logs and timings."""
+        started = time.perf_counter()
+        stream = self.p.open(**kwargs)
+        ms = self._record_timing('open', name, started)
+        print(f"Opened {'input' if kwargs.get('input') else 'output'} stream on {name} in {ms:.1f} ms")
+        return stream
+
+    def abort_stream(self, stream):
+        """Stops a stream at once and drops what is queued. A write blocked on it returns."""
+        if hasattr(stream, 'abort_stream'):
+            stream.abort_stream()
+        else:
+            pyaudio.pa.abort_stream(stream._stream) # pyaudio.Stream doesn't wrap Pa_AbortStream
+
+    def close_stream(self, name, stream):
+        started = time.perf_counter()
+        try:
             stream.stop_stream()
             stream.close()
-            supported_rates.append(rate)
+        finally:
+            self._record_timing('close', name, started)
+
+    def timing_summary(self):
+        """{action: {'count', 'mean_ms', 'max_ms'}} over the recent stream opens and closes."""
+        summary = {}
+        for action in ('open', 'close'):
+            times = [ms for kind, _, ms in self.stream_timings if kind == action]
+            if times:
+                summary[action] = {'count': len(times), 'mean_ms': sum(times) / len(times), 'max_ms': max(times)}
+        return summary
+
+    def terminate(self):
+        if self.p:
+            self.p.terminate()
+            self.p = None
+            print("PyAudio terminated.")
+
+class CaptureSource:
+    """An extra loopback capture that every sink mixes in with the primary one, at `gain`.
+
+    The router opens and watches its stream like the primary's. Its callback only decodes
+    and copies into each sink's SourceInput, which does the aligning.
+    """
+    def __init__(self, session, device_index, gain=1.0, sample_format=None, frames_per_buffer=1024):
+        self.session = session
+        self.device_index = device_index
+        self.gain = gain
+        try:
+            self.name = session.p.get_device_info_by_index(device_index)['name']
+        except OSError as e:
+            raise Exception(f"Could not get device info for source device {device_index}. Error: {e}")
+        loopback = session.find_loopback(device_index)
+        if loopback is None:
+            raise Exception(f"Could not find a WASAPI loopback device for source: {self.name}")
+        # The session's device map can be older than the format the loopback has now
+        self.loopback_info = session.p.get_device_info_by_index(loopback['index'])
+        self.sample_rate = int(self.loopback_info['defaultSampleRate'])
+        self.channels = self.loopback_info['maxInputChannels']
+        self.frames_per_buffer = frames_per_buffer
+        self.sample_format = sample_format or native_sample_format(
+            session.p, self.loopback_info['index'], self.sample_rate, self.channels, 'input'
+        )
+        self.decoder = SampleDecoder(self.sample_format, self.channels, frames_per_buffer)
+        self.stream = None
+        self.last_callback = None
+        self.callback_timer = BlockTimer()
+        self.input_overflows = 0
+
+    def metrics(self):
+        callback = self.callback_timer.summary()
+        return {
+            'name': self.loopback_info['name'],
+            'device_index': self.device_index,
+            'gain': self.gain,
+            'sample_rate': self.sample_rate,
+            'sample_format': FORMAT_NAMES.get(self.sample_format),
+            'channels': self.channels,
+            'input_overflows': self.input_overflows,
+            'callback_p99_us': callback.get('p99_us'),
+        }
+
+# Recording taps: WAV headers are patched this often, and a file is never let past the 4 GB RIFF limit
+RECORDING_HEADER_S = 5.0
+WAV_MAX_DATA_BYTES = 2 ** 32 - 1 - 36
+FLAC_SUBTYPES = {pyaudio.paInt16: 'PCM_16', pyaudio.paInt24: 'PCM_24'}
+
+class RecordingTap:
+    """Records one point of a route (the loopback capture or what a sink plays) to WAV or FLAC.
+
+    The audio thread only copies each block into a preallocated ring with push(). If the
+    disk falls behind and the ring has no room, the whole block is dropped and counted:
+    the audio path never waits for the disk. A writer thread drains the ring every
+    `flush_s` into one sequential write, and patches the WAV header every
+    RECORDING_HEADER_S so a crash loses at most that much. FLAC goes through soundfile.
+
+    With rotate_mb or rotate_s a new file starts once the current one is that big or
+    old. The first file is `path`, the next ones get -002, -003... before the extension.
+    """
+    def __init__(self, path, sample_rate, channels, point='capture', sample_format=pyaudio.paInt16,
+                 queue_ms=2000, flush_s=0.5, rotate_mb=None, rotate_s=None):
+        self.path = path
+        self.stem, self.extension = os.path.splitext(path)
+        self.flac = self.extension.lower() == '.flac'
+        if not self.flac and self.extension.lower() != '.wav':
+            raise ValueError(f"Can only record to .wav or .flac files, not {path}")
+        if self.flac and soundfile is None:
+            raise Exception("soundfile is not installed, which recording to FLAC needs. Record to .wav instead.")
+        if self.flac and sample_format not in FLAC_SUBTYPES:
+            raise ValueError("FLAC recordings take int16 or int24 samples.")
+        if sample_format not in SAMPLE_SIZES:
+            raise ValueError(f"Unsupported sample format: {sample_format}")
+        self.point = point
+        self.sample_format = sample_format
+        self.queue_ms = queue_ms
+        self.flush_s = flush_s
+        self.rotate_bytes = int(rotate_mb * 1024 * 1024) if rotate_mb else None
+        self.rotate_s = rotate_s
+        self.files = [] # Every file written so far
+        self.recording = False
+        self.failure = None
+        self.written_frames = 0
+        self.written_bytes = 0
+        self.dropped_blocks = 0
+        self.dropped_frames = 0
+        self.batch_timer = BlockTimer() # Time each batch took to write
+        self._file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._configure(sample_rate, channels)
+
+    def _configure(self, sample_rate, channels):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.buffer = RingBuffer(self.queue_ms, sample_rate, channels, dtype=np.float32, overrun_policy=DROP_NEWEST)
+        # Everything the ring holds fits in one batch
+        self._batch = np.zeros((self.buffer.capacity, channels), dtype=np.float32)
+        self._encoder = SampleEncoder(self.sample_format, channels, self.buffer.capacity)
+
+    def push(self, block):
+        """Queues a (frames, channels) float32 block. Called on the audio thread, never blocks."""
+        if not self.recording:
+            return
+        if len(block) > self.buffer.free():
+            self.dropped_blocks += 1
+            self.dropped_frames += len(block)
+            return
+        self.buffer.write(block)
+
+    def start(self):
+        self._open_file()
+        self.buffer.clear()
+        self._stop.clear()
+        self.recording = True
+        self._thread = threading.Thread(target=self._run_writer, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Writes out what is still queued and closes the file."""
+        self.recording = False
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        self._thread = None
+        self._close_file()
+
+    def restart(self, sample_rate, channels):
+        """Continues in a new file with another format, for when the tapped stream changes format."""
+        self.stop()
+        self._configure(sample_rate, channels)
+        self.start()
+
+    def _open_file(self):
+        number = len(self.files) + 1
+        path = self.path if number == 1 else f"{self.stem}-{number:03d}{self.extension}"
+        if self.flac:
+            self._file = soundfile.SoundFile(path, 'w', samplerate=self.sample_rate, channels=self.channels,
+                                             format='FLAC', subtype=FLAC_SUBTYPES[self.sample_format])
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(self._wav_header(0))
+        self.files.append(path)
+        self._file_bytes = 0
+        self._file_opened = time.monotonic()
+        self._header_written = self._file_opened
+        print(f"Recording to {path}")
+
+    def _wav_header(self, data_bytes):
+        sample_size = SAMPLE_SIZES[self.sample_format]
+        block_align = sample_size * self.channels
+        return struct.pack(
+            '<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_bytes, b'WAVE', b'fmt ', 16,
+            3 if self.sample_format == pyaudio.paFloat32 else 1, # IEEE float or PCM
+            self.channels, self.sample_rate, self.sample_rate * block_align, block_align, sample_size * 8,
+            b'data', data_bytes
+        )
+
+    def _patch_header(self):
+        # Only the two sizes change, both are in the 44-byte header
+        end = self._file.tell()
+        self._file.seek(0)
+        self._file.write(self._wav_header(self._file_bytes))
+        self._file.seek(end)
+        self._file.flush()
+        self._header_written = time.monotonic()
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        try:
+            if not self.flac:
+                self._patch_header()
         except Exception as e:
-            pass
-    return supported_rates
+            print(f"Error finishing the header of recording {self.files[-1]}: {e}")
+        finally:
+            try:
+                self._file.close()
+            except Exception as e:
+                print(f"Error closing recording {self.files[-1]}: {e}")
+            self._file = None
+
+    def _rotate(self):
+        self._close_file()
+        self._open_file()
+
+    def _run_writer(self):
+        while True:
+            stopping = self._stop.wait(self.flush_s)
+            try:
+                self._write_batch(rotate=not stopping)
+            except Exception as e:
+                print(f"Error writing recording {self.files[-1]}: {e}")
+                self.failure = str(e)
+                self.recording = False
+                return
+            if stopping:
+                return
+
+    def _write_batch(self, rotate=True):
+        """Writes what is queued. rotate=False (the last batch) only starts a new file if the WAV size limit forces it."""
+        frames = self.buffer.available()
+        if frames:
+            started = time.perf_counter()
+            batch = self._batch[:frames]
+            self.buffer.read(batch)
+            if self.flac:
+                np.clip(batch, -1.0, 1.0, out=batch) # soundfile wraps what's over full scale
+                self._file.write(batch)
+                size = frames * SAMPLE_SIZES[self.sample_format] * self.channels
+                self._file_bytes += size
+            else:
+                size = self._write_wav(self._encoder.encode(batch))
+            self.written_bytes += size
+            self.written_frames += frames
+            self.batch_timer.record(time.perf_counter() - started)
+
+        now = time.monotonic()
+        # A FLAC file's size is what it takes on disk, compressed. WAV files were split by size as they were written
+        too_big = self.flac and self.rotate_bytes and os.path.getsize(self.files[-1]) >= self.rotate_bytes
+        if rotate and (too_big or (self.rotate_s and now - self._file_opened >= self.rotate_s)):
+            self._rotate()
+        elif not self.flac and now - self._header_written >= RECORDING_HEADER_S:
+            self._patch_header()
+
+    def _write_wav(self, data):
+        """Appends encoded frames, starting new files so that none goes past rotate_mb or the RIFF limit."""
+        frame_bytes = SAMPLE_SIZES[self.sample_format] * self.channels
+        limit = min(self.rotate_bytes or WAV_MAX_DATA_BYTES, WAV_MAX_DATA_BYTES)
+        limit = max(limit - limit % frame_bytes, frame_bytes) # Whole frames, at least one per file
+        written = 0
+        while written < len(data):
+            room = limit - self._file_bytes
+            if room <= 0:
+                self._rotate()
+                continue
+            chunk = data[written:written + room]
+            self._file.write(chunk)
+            self._file_bytes += len(chunk)
+            written += len(chunk)
+        return written
+
+    def metrics(self):
+        batch = self.batch_timer.summary()
+        return {
+            'point': self.point,
+            'file': self.files[-1] if self.files else None,
+            'files': len(self.files),
+            'sample_rate': self.sample_rate,
+            'channels': self.channels,
+            'sample_format': FORMAT_NAMES.get(self.sample_format),
+            'recording': self.recording,
+            'failure': self.failure,
+            'written_frames': self.written_frames,
+            'written_bytes': self.written_bytes,
+            'dropped_blocks': self.dropped_blocks,
+            'dropped_frames': self.dropped_frames,
+            'queued_ms': self.buffer.available() * 1000.0 / self.sample_rate,
+            'batch_p99_us': batch.get('p99_us'),
+        }
 
 class AudioRouter:
-    def __init__(self, primary_device_index, secondary_device_index):
-        self.p = pyaudio.PyAudio()
+    def __init__(self, primary_device_index, secondary_device_indices, buffer_ms=200, latency_ms=60,
+                 overrun_policy=DROP_OLDEST, underrun_policy=INSERT_SILENCE, backend=None, frames_per_buffer=1024,
+                 capabilities=None, session=None, stall_timeout_s=1.0, sample_format=None, dither=True,
+                 latency_profile=None, sources=None, primary_gain=1.0):
+        # A shared session keeps PortAudio and the device map alive from one route to the next.
+        # Without one the router makes its own (backend and capabilities go to it) and closes it on shutdown.
+        self.owns_session = session is None
+        self.session = session if session is not None else AudioSession(backend, capabilities)
+        self.p = self.session.p
+        self.capabilities = self.session.capabilities
+        self.timings = {} # start_ms / stop_ms of the last start_routing and stop_routing
+        self._start_requested = None
+        # Wakes the routing thread's watchdog when we stop or a sink reports a failure
+        self._wake = threading.Event()
+        # Outputs making no progress for this long are reopened. Captures without callbacks for
+        # this long are only reported idle: WASAPI loopback stops delivering while nothing plays
+        self.stall_timeout_s = stall_timeout_s
+        self.last_callback = None
+        self._idle = set() # 'capture' and ('source', device index) keys of captures that went quiet
+        self._recovering = {} # 'capture', ('source', device index) or sink device index -> recovery state
+        self.recoveries = deque(maxlen=100) # Completed recoveries, see _attempt_recovery()
+        self.block_changes = deque(maxlen=100) # Block sizes adapted to underruns, see _adapt_block_sizes()
+        self.taps = () # Every RecordingTap, see add_tap()
+        self.capture_taps = ()
         self.primary_device_index = primary_device_index
-        self.secondary_device_index = secondary_device_index
         self.stream = None # Loopback input stream
         self.primary_output_stream = None
-        self.secondary_output_stream = None
         self.running = False
         self.thread = None
+        # A profile from LATENCY_PROFILES sizes every device's blocks and cushion from its reported
+        # latency and overrides frames_per_buffer and latency_ms. Without one those apply everywhere.
+        if latency_profile is not None and latency_profile not in LATENCY_PROFILES:
+            raise ValueError(f"Unknown latency profile: {latency_profile}")
+        self.latency_profile = latency_profile
+        self.frames_per_buffer = frames_per_buffer
+        # None captures and plays each device in its native format, a PortAudio format forces it everywhere
+        self.sample_format = sample_format
+        self.dither = dither
+        self.callback_timer = BlockTimer()
+        self.jitter_timer = BlockTimer() # Capture callbacks' lateness or earliness
+        self.capture_rate = RateMeter()
+        # PortAudio status flags seen by the capture callback
+        self.input_overflows = 0
+        self.input_underflows = 0
+
+        # Every output sink gets its own ring, fed from the one loopback capture
+        self.buffer_ms = buffer_ms
+        self.latency_ms = latency_ms
+        self.overrun_policy = overrun_policy
+        self.underrun_policy = underrun_policy
+        # Swapped as a whole so the callback never sees a half-updated list
+        self.sinks = ()
+        self._sinks_lock = threading.Lock()
+        # Set while calibrate() records, the callback copies the loopback audio into it
+        self.calibration_reference = None
+
+        if isinstance(secondary_device_indices, int):
+            secondary_device_indices = [secondary_device_indices]
 
         try:
             self.primary_info = self.p.get_device_info_by_index(self.primary_device_index)
-            self.secondary_info = self.p.get_device_info_by_index(self.secondary_device_index)
         except OSError as e:
             raise Exception(f"Could not get device info for selected devices. Check indices. Error: {e}")
 
         print(f"\nSelected Primary Device: {self.primary_info['name']} (Index: {self.primary_info['index']})")
-        print(f"Selected Secondary Device: {self.secondary_info['name']} (Index: {self.secondary_info['index']})")
 
         # Find the loopback device for the primary output device
-        self.loopback_device_index = None
-        wasapi_info = self.p.get_host_api_info_by_type(pyaudio.paWASAPI)
-        
-        # Iterating through all devices to find the one marked as loopback AND matches primary
-        found_loopback_for_primary = False
-        for i in range(self.p.get_device_count()):
-            info = self.p.get_device_info_by_index(i)
-            
-            # Check if it's a WASAPI loopback device and its name contains the primary device's name
-            if info.get('isLoopbackDevice') and info['hostApi'] == wasapi_info['index'] and \
-               self.primary_info['name'] in info['name']:
-                self.loopback_device_index = info['index']
-                self.loopback_info = info
-                found_loopback_for_primary = True
-                print(f"Found loopback device for primary: {self.loopback_info['name']} (Index: {self.loopback_device_index})")
-                break
-        
-        if not found_loopback_for_primary:
+        self.loopback_info = self.session.find_loopback(self.primary_device_index)
+        if self.loopback_info is None:
             raise Exception(f"Could not find a WASAPI loopback device for primary output: {self.primary_info['name']}")
+        self.loopback_device_index = self.loopback_info['index']
+        print(f"Found loopback device for primary: {self.loopback_info['name']} (Index: {self.loopback_device_index})")
 
         # Determine common audio parameters based on the loopback device
-        self.common_sample_rate = int(self.loopback_info['defaultSampleRate'])
+        self.loopback_sample_rate = int(self.loopback_info['defaultSampleRate'])
         self.common_channels = self.loopback_info['maxInputChannels'] # Loopback maxInputChannels is its output channels
-        self.common_format = pyaudio.paInt16 # Using 16-bit integer format
-
-        # Add a check that the secondary device actually supports this rate and channels
-        secondary_supported_rates = get_supported_rates(self.p, self.secondary_device_index, 'output')
-        
-        if self.common_sample_rate not in secondary_supported_rates:
-            print(f"WARNING: Secondary device '{self.secondary_info['name']}' does not directly support the primary loopback sample rate ({self.common_sample_rate} Hz).")
-            # Fallback: find a common rate
-            fallback_rates = [48000, 44100] # Prioritize 48kHz, then 44.1kHz
-            found_fallback = False
-            for rate in fallback_rates:
-                if rate in secondary_supported_rates and self.p.is_format_supported(
-                    self.common_sample_rate, # The rate used for the loopback
-                    self.common_channels,   # The channels used for the loopback
-                    self.common_format,
-                    input_device=self.loopback_device_index
-                ) and self.p.is_format_supported(
-                    rate,
-                    self.common_channels,
-                    self.common_format,
-                    output_device=self.secondary_device_index
-                ):
-                    self.common_sample_rate = rate
-                    found_fallback = True
-                    print(f"Falling back to {self.common_sample_rate} Hz for all streams.")
-                    break
-            if not found_fallback:
-                raise Exception(f"No mutually supported sample rate found between primary loopback and secondary device. Consider using 44100Hz or 48000Hz for both.")
-        
-        # Validate channels: secondary device must support at least common_channels
-        if self.secondary_info['maxOutputChannels'] < self.common_channels:
-             # Severe Issue
-             print(f"WARNING: Secondary device '{self.secondary_info['name']}' only supports {self.secondary_info['maxOutputChannels']} output channels, but primary loopback provides {self.common_channels}. Attempting to use primary channels.")
-             # Might need to add logic to downmix if channels mismatch
-             # self.common_channels = min(self.common_channels, self.secondary_info['maxOutputChannels'])
+        self._choose_capture_block()
+        self._choose_capture_format()
+
+        print(f"Audio parameters chosen: Loopback rate={self.loopback_sample_rate} Hz, Channels={self.common_channels}, Format={FORMAT_NAMES.get(self.common_format, self.common_format)}")
+        if self.latency_profile:
+            print(f"Latency profile '{self.latency_profile}': capturing in blocks of {self.frames_per_buffer} frames")
+
+        # Extra sources mixed into every sink: output device indices, or (index, gain) pairs
+        self.primary_gain = primary_gain
+        self.sources = ()
+        for source in sources or ():
+            device_index, gain = source if isinstance(source, (tuple, list)) else (source, 1.0)
+            if device_index == self.primary_device_index or any(s.device_index == device_index for s in self.sources):
+                raise Exception(f"Device {device_index} is already an audio source.")
+            self.sources += (CaptureSource(self.session, device_index, gain, self.sample_format, self.frames_per_buffer),)
+            print(f"Mixing in source: {self.sources[-1].name} (Index: {device_index}, Gain: {gain:g})")
+
+        self.sinks = tuple(self._create_sink(index) for index in secondary_device_indices)
+        for sink in self.sinks:
+            print(f"Selected Secondary Device: {sink.name} (Index: {sink.device_index}, Rate: {sink.sample_rate} Hz)")
+
+    def _choose_capture_block(self):
+        if self.latency_profile:
+            self.frames_per_buffer = profile_block_frames(
+                self.loopback_info, 'input', self.loopback_sample_rate, self.latency_profile
+            )
 
-        print(f"Audio parameters chosen: Rate={self.common_sample_rate} Hz, Channels={self.common_channels}, Format={self.common_format}")
+    def _choose_capture_format(self):
+        """Captures in the loopback's own format, the callback converts it to float32 once for all sinks."""
+        self.common_format = self.sample_format or native_sample_format(
+            self.p, self.loopback_device_index, self.loopback_sample_rate, self.common_channels, 'input'
+        )
+        self.decoder = SampleDecoder(self.common_format, self.common_channels, self.frames_per_buffer)
+
+    def _create_sink(self, device_index, delay_ms=None, channels=None, matrix=None, frames_per_buffer=None,
+                     buffer=None, source_buffers=None):
+        if device_index == self.primary_device_index or any(s.device_index == device_index for s in self.sources):
+            raise Exception("The audio source device cannot also be an output sink.")
+        if delay_ms is None:
+            # Reuse the delay measured for this device pair last time, if any
+            sink_name = self.p.get_device_info_by_index(device_index)['name']
+            delay_ms = saved_delay(self.primary_info['name'], sink_name)
+            if delay_ms is None:
+                delay_ms = 0
+            else:
+                print(f"Using calibrated delay of {delay_ms:.1f} ms for '{sink_name}'.")
+
+        latency_ms = self.latency_ms
+        callback_output = False
+        if self.latency_profile:
+            profile = LATENCY_PROFILES[self.latency_profile]
+            if frames_per_buffer is None:
+                frames_per_buffer = profile_block_frames(
+                    self.p.get_device_info_by_index(device_index), 'output', self.loopback_sample_rate,
+                    self.latency_profile
+                )
+            # Cushion for a few of whichever block is larger, the capture's or the sink's
+            latency_ms = (profile['cushion_blocks'] * max(frames_per_buffer, self.frames_per_buffer) * 1000.0
+                          / self.loopback_sample_rate)
+            callback_output = profile['callback']
+        elif frames_per_buffer is None:
+            frames_per_buffer = self.frames_per_buffer
+
+        sink = OutputSink(
+            self.session, device_index, self.loopback_sample_rate, self.common_channels, self.sample_format,
+            frames_per_buffer, buffer_ms=self.buffer_ms, latency_ms=latency_ms, delay_ms=delay_ms,
+            overrun_policy=self.overrun_policy, underrun_policy=self.underrun_policy,
+            channels=channels, matrix=matrix, on_failure=self._on_sink_failure, dither=self.dither,
+            callback_output=callback_output, capture_frames=self.frames_per_buffer, buffer=buffer,
+            sources=self.sources, source_buffers=source_buffers, primary_gain=self.primary_gain
+        )
+        if self.latency_profile:
+            sink.block_sizes = BlockSizeController(frames_per_buffer)
+        return sink
+
+    def add_sink(self, device_index, delay_ms=None, channels=None, matrix=None):
+        """Mirrors the loopback to another device. Capture keeps running while it's added.
+
+        Without delay_ms the calibrated delay for this device pair is used, if there is one.
+        `channels` and `matrix` override the default down/upmix, see ChannelMixer.
+        """
+        with self._sinks_lock:
+            if any(sink.device_index == device_index for sink in self.sinks):
+                raise Exception(f"Device {device_index} is already an output sink.")
+            sink = self._create_sink(device_index, delay_ms, channels, matrix)
+            if self.running:
+                sink.start()
+            self.sinks = self.sinks + (sink,)
+        return sink
+
+    def remove_sink(self, device_index):
+        """Stops mirroring to a device without interrupting capture or the other sinks."""
+        with self._sinks_lock:
+            sink = next((s for s in self.sinks if s.device_index == device_index), None)
+            if sink is None:
+                return
+            self.sinks = tuple(s for s in self.sinks if s is not sink)
+        sink.stop()
+        for tap in sink.taps:
+            self.remove_tap(tap)
+
+    def add_tap(self, path, point='capture', sample_format='int16', **options):
+        """Starts recording to a .wav or .flac file. Returns the RecordingTap.
+
+        `point` is 'capture' for the loopback as captured, or a sink's device index for what
+        that sink plays after delay, conversion and mixing. Recording never blocks the audio
+        threads, see RecordingTap for the other options.
+        """
+        if sample_format not in FORMATS_BY_NAME:
+            raise ValueError(f"Unknown sample format: {sample_format}")
+        with self._sinks_lock:
+            if point == 'capture':
+                tap = RecordingTap(path, self.loopback_sample_rate, self.common_channels, point,
+                                   FORMATS_BY_NAME[sample_format], **options)
+                tap.start()
+                self.capture_taps += (tap,)
+            else:
+                sink = next((s for s in self.sinks if s.device_index == point), None)
+                if sink is None:
+                    raise ValueError(f"Device {point} is not an output sink.")
+                tap = RecordingTap(path, sink.sample_rate, sink.channels, point, FORMATS_BY_NAME[sample_format],
+                                   **options)
+                tap.start()
+                sink.taps += (tap,)
+            self.taps += (tap,)
+        return tap
+
+    def remove_tap(self, tap):
+        """Stops a recording and closes its file."""
+        with self._sinks_lock:
+            self.taps = tuple(t for t in self.taps if t is not tap)
+            self.capture_taps = tuple(t for t in self.capture_taps if t is not tap)
+            for sink in self.sinks:
+                sink.taps = tuple(t for t in sink.taps if t is not tap)
+        tap.stop()
 
     def _audio_callback(self, in_data, frame_count, time_info, status):
-        audio_data = np.frombuffer(in_data, dtype=np.int16) 
-
-        # for setting secondary output stream
-        if self.secondary_output_stream and self.secondary_output_stream.is_active():
-            try:
-                self.secondary_output_stream.write(audio_data.tobytes())
-            except Exception as e:
-                print(f"Error writing to secondary device in callback: {e}")
-
-        return (in_data, pyaudio.paContinue)
+        started = time.perf_counter()
+        previous, self.last_callback = self.last_callback, started
+        if previous is not None:
+            # How far this callback strays from one block after the previous one
+            self.jitter_timer.record(abs(started - previous - frame_count / self.loopback_sample_rate))
+        self.capture_rate.add(frame_count, started)
+        if status:
+            if status & pyaudio.paInputOverflow:
+                self.input_overflows += 1
+            if status & pyaudio.paInputUnderflow:
+                self.input_underflows += 1
+        # Only copy into the rings here, a blocking write would stall the capture thread
+        audio_data = self.decoder.decode(in_data)
+        rate, channels = self.loopback_sample_rate, self.common_channels
+        for sink in self.sinks:
+            # After a loopback format change, sinks still built for the old one wait to be rebuilt
+            if sink.source_rate == rate and sink.source_channels == channels:
+                sink.buffer.write(audio_data)
+        for tap in self.capture_taps:
+            tap.push(audio_data)
+
+        reference = self.calibration_reference
+        if reference is not None and reference.channels == channels:
+            reference.write(audio_data)
+
+        self.callback_timer.record(time.perf_counter() - started)
+        return CALLBACK_CONTINUE
+
+    def _source_callback(self, position):
+        """Capture callback for self.sources[position]: copies into that source's ring in every sink."""
+        source = self.sources[position]
+        def callback(in_data, frame_count, time_info, status):
+            started = time.perf_counter()
+            source.last_callback = started
+            if status & pyaudio.paInputOverflow:
+                source.input_overflows += 1
+            audio_data = source.decoder.decode(in_data)
+            for sink in self.sinks:
+                source_input = sink.sources[position]
+                if source_input.source is source: # Not a sink still waiting to be rebuilt for a new format
+                    source_input.buffer.write(audio_data)
+            source.callback_timer.record(time.perf_counter() - started)
+            return CALLBACK_CONTINUE
+        return callback
+
+    def set_source_gain(self, device_index, gain):
+        """Changes the gain of the primary or an extra source while it plays."""
+        if gain < 0:
+            raise ValueError(f"Gain must not be negative, got {gain}")
+        if device_index == self.primary_device_index:
+            row = 0
+            self.primary_gain = gain
+        else:
+            row = next((i for i, s in enumerate(self.sources, 1) if s.device_index == device_index), None)
+            if row is None:
+                raise ValueError(f"Device {device_index} is not an audio source.")
+            self.sources[row - 1].gain = gain
+        for sink in self.sinks:
+            if row < len(sink.gains):
+                sink.gains[row] = gain
+
+    def set_delay(self, device_index, delay_ms):
+        """Changes the delay of the sink on device_index while it plays. Returns the delay actually applied."""
+        sink = next((s for s in self.sinks if s.device_index == device_index), None)
+        if sink is None:
+            raise ValueError(f"Device {device_index} is not an output of this route.")
+        return sink.set_delay(delay_ms)
+
+    def calibrate(self, input_device_index, seconds=3.0, test_signal=True, save=True):
+        """Measures how far each sink lags the primary and sets sink delays to line them up.
+
+        Routing must be running and the microphone at input_device_index must hear every
+        output. With test_signal, quiet noise is played on the primary device so nothing
+        else needs to be playing. The primary itself can't be delayed, so all outputs are
+        lined up with whichever one is latest. Measured delays are saved per device pair.
+        Returns {sink name: {'offset_ms', 'delay_ms'}}, where offset_ms is how far the sink
+        lags the primary without any delay.
+        """
+        if not self.running or not self.stream:
+            raise Exception("Start routing before calibrating.")
+
+        sinks = self.sinks
+        was_muted = {sink: sink.muted for sink in sinks}
+        # Long enough for audio already queued in the rings and devices to play out
+        settle_s = 0.3 + max([(s.latency_ms + s.delay_ms) / 1000.0 for s in sinks] + [0.0])
+
+        stop_noise = threading.Event()
+        noise_thread = None
+        if test_signal:
+            noise_thread = threading.Thread(target=self._play_test_noise, args=(stop_noise,), daemon=True)
+            noise_thread.start()
+
+        offsets = {}
+        try:
+            # Primary alone first, so its peak can be told apart from the sinks' later on
+            for sink in sinks:
+                sink.muted = True
+            time.sleep(settle_s)
+            peaks = self._record_offsets(input_device_index, seconds)
+            if not peaks:
+                raise Exception("Calibration failed: the microphone did not pick up the primary output.")
+            primary_lag = peaks[0][0]
+            print(f"Primary output arrives at {primary_lag:.1f} ms")
+
+            for sink in sinks:
+                for other in sinks:
+                    other.muted = other is not sink
+                time.sleep(settle_s)
+                peaks = self._record_offsets(input_device_index, seconds)
+
+                # The primary is in every recording, the strongest other peak is this sink
+                lag_here = min(peaks, key=lambda peak: abs(peak[0] - primary_lag))[0]
+                strongest = max(strength for _, strength in peaks)
+                sink_lags = [lag for lag, strength in peaks if abs(lag - lag_here) > 10 and strength > 0.2 * strongest]
+                if sink_lags:
+                    offsets[sink] = sink_lags[0] - lag_here
+                else:
+                    offsets[sink] = 0.0 # Indistinguishable from the primary, already aligned
+                print(f"'{sink.name}' arrives {offsets[sink]:+.1f} ms after the primary")
+        finally:
+            stop_noise.set()
+            if noise_thread:
+                noise_thread.join(timeout=2)
+            for sink, muted in was_muted.items():
+                sink.muted = muted
+
+        # Each sink was measured with its current delay in, take that out to get how late the device itself is
+        offsets = {sink: offset - sink.delay_ms for sink, offset in offsets.items()}
+        latest = max([0.0] + list(offsets.values()))
+        results = {}
+        for sink, offset in offsets.items():
+            delay = sink.set_delay(latest - offset)
+            print(f"Delaying '{sink.name}' by {delay:.1f} ms")
+            if save:
+                save_calibration(self.primary_info['name'], sink.name, delay, offset)
+            results[sink.name] = {'offset_ms': offset, 'delay_ms': delay}
+        return results
+
+    def _record_offsets(self, input_device_index, seconds):
+        """Records the microphone and the loopback side by side and cross-correlates them."""
+        info = self.p.get_device_info_by_index(input_device_index)
+        mic_rate = int(info['defaultSampleRate'])
+        mic_channels = min(2, max(1, info['maxInputChannels']))
+        reference = RingBuffer(
+            seconds * 1000 + 1000, self.loopback_sample_rate, self.common_channels, dtype=np.float32,
+            overrun_policy=DROP_NEWEST
+        )
+
+        mic = self.p.open(
+            format=pyaudio.paInt16,
+            channels=mic_channels,
+            rate=mic_rate,
+            input=True,
+            input_device_index=input_device_index,
+            frames_per_buffer=self.frames_per_buffer
+        )
+        try:
+            self.calibration_reference = reference
+            data = mic.read(int(seconds * mic_rate), exception_on_overflow=False)
+        finally:
+            self.calibration_reference = None
+            mic.stop_stream()
+            mic.close()
+
+        recording = np.frombuffer(data, dtype=np.int16).reshape(-1, mic_channels).mean(axis=1, dtype=np.float32)
+        captured = np.zeros((reference.available(), self.common_channels), dtype=np.float32)
+        reference.read(captured)
+        reference_mono = captured.mean(axis=1, dtype=np.float32)
+
+        if mic_rate != self.loopback_sample_rate:
+            # The filter delay is the same in every recording, so it cancels out of the offsets
+            resampler = PolyphaseResampler(mic_rate, self.loopback_sample_rate, 1, len(recording))
+            converted = np.zeros((resampler.max_output_frames, 1), dtype=np.float32)
+            recording = converted[:resampler.process(recording[:, None], converted), 0]
+
+        return estimate_offsets(reference_mono, recording, self.loopback_sample_rate)
+
+    def _play_test_noise(self, stop_event, level=0.1):
+        """Plays quiet white noise on the primary device until stop_event is set."""
+        rate = int(self.primary_info['defaultSampleRate'])
+        channels = min(2, self.primary_info['maxOutputChannels'])
+        rng = np.random.default_rng()
+        stream = self.p.open(
+            format=pyaudio.paInt16,
+            channels=channels,
+            rate=rate,
+            output=True,
+            output_device_index=self.primary_device_index,
+            frames_per_buffer=self.frames_per_buffer
+        )
+        try:
+            while not stop_event.is_set():
+                noise = rng.uniform(-level, level, (self.frames_per_buffer, channels)) * 32767
+                stream.write(noise.astype(np.int16).tobytes())
+        finally:
+            stream.stop_stream()
+            stream.close()
 
     def start_routing(self):
         if self.running:
             return
 
         self.running = True
+        self._wake.clear()
+        self._start_requested = time.perf_counter()
         self.thread = threading.Thread(target=self._run_routing, daemon=True)
         self.thread.start()
 
@@ -164,50 +2476,349 @@ class AudioRouter:
             # self.primary_output_stream = self.p.open(
             #     format=self.common_format,
             #     channels=self.common_channels,
-            #     rate=self.common_sample_rate,
+            #     rate=self.loopback_sample_rate,
             #     output=True,
             #     output_device_index=self.primary_device_index,
             #     frames_per_buffer=1024
             # )
             # print(f"Opened primary output stream on {self.primary_info['name']}")
 
-            # Open the secondary output stream
-            self.secondary_output_stream = self.p.open(
-                format=self.common_format,
-                channels=self.common_channels,
-                rate=self.common_sample_rate,
-                output=True,
-                output_device_index=self.secondary_device_index,
-                frames_per_buffer=1024
-            )
-            print(f"Opened secondary output stream on {self.secondary_info['name']}")
-
-            # Open the loopback input stream
-            self.stream = self.p.open(
-                format=self.common_format,
-                channels=self.common_channels,
-                rate=self.common_sample_rate,
-                input=True,
-                input_device_index=self.loopback_device_index,
-                frames_per_buffer=1024,
-                stream_callback=self._audio_callback
-            )
-            print(f"Opened loopback input stream on {self.loopback_info['name']}")
-            print("Audio routing started...")
-
-            while self.running and self.stream.is_active():
-                time.sleep(0.1) 
+            # Open the output streams
+            with self._sinks_lock:
+                for sink in self.sinks:
+                    sink.start()
+
+            self._open_capture()
+            for source in self.sources:
+                self._open_source(source)
+            self.timings['start_ms'] = (time.perf_counter() - self._start_requested) * 1000.0
+            print(f"Audio routing started in {self.timings['start_ms']:.1f} ms...")
+
+            while self.running:
+                self._wake.wait(WATCHDOG_INTERVAL_S)
+                self._wake.clear()
+                if self.running:
+                    self._watch()
         except Exception as e:
             print(f"Error during audio routing: {e}")
             self.running = False 
         finally:
+            self.running = False
             self._cleanup_streams()
             print("Audio routing thread finished.")
 
+    def _open_capture(self):
+        # Open the loopback input stream
+        self.last_callback = time.perf_counter()
+        self.capture_rate.reset()
+        self.stream = self.session.open_stream(
+            self.loopback_info['name'],
+            format=self.common_format,
+            channels=self.common_channels,
+            rate=self.loopback_sample_rate,
+            input=True,
+            input_device_index=self.loopback_device_index,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=self._audio_callback
+        )
+
+    def _open_source(self, source):
+        source.last_callback = time.perf_counter()
+        source.stream = self.session.open_stream(
+            source.loopback_info['name'],
+            format=source.sample_format,
+            channels=source.channels,
+            rate=source.sample_rate,
+            input=True,
+            input_device_index=source.loopback_info['index'],
+            frames_per_buffer=source.frames_per_buffer,
+            stream_callback=self._source_callback(self.sources.index(source))
+        )
+
+    def _close_source(self, source):
+        stream, source.stream = source.stream, None
+        if stream:
+            try:
+                self.session.close_stream(source.loopback_info['name'], stream)
+            except Exception as e:
+                print(f"Error closing source stream on {source.name}: {e}")
+
+    def _on_sink_failure(self, sink):
+        self._wake.set()
+
+    def _watch(self):
+        """Finds streams that died or stalled and reopens them, one at a time and with backoff.
+
+        Only the broken stream is touched: capture and the other sinks keep playing. A
+        capture that is still active but gets no callbacks is idle, not broken.
+        """
+        now = time.perf_counter()
+        if 'capture' not in self._recovering:
+            if not self.stream or not self.stream.is_active():
+                self._begin_recovery('capture', "capture stream stopped")
+            else:
+                self._check_idle('capture', self.last_callback, now)
+
+        for source in self.sources:
+            key = ('source', source.device_index)
+            if key in self._recovering:
+                continue
+            if not source.stream or not source.stream.is_active():
+                self._begin_recovery(key, "source stream stopped")
+            else:
+                self._check_idle(key, source.last_callback, now)
+
+        for sink in self.sinks:
+            if sink.device_index in self._recovering:
+                continue
+            if sink.failure:
+                self._begin_recovery(sink.device_index, sink.failure)
+            elif sink.running and now - sink.last_progress > self.stall_timeout_s:
+                self._begin_recovery(sink.device_index, "output stalled", since=sink.last_progress)
+            elif sink.callback_output and sink.running and not sink.stream.is_active():
+                # Nobody else notices, there is no writer thread to fail
+                self._begin_recovery(sink.device_index, "output stream stopped")
+
+        for key, state in list(self._recovering.items()):
+            if time.perf_counter() >= state['next_attempt']:
+                self._attempt_recovery(key, state)
+
+        if self.latency_profile:
+            self._adapt_block_sizes(now)
+
+    def _adapt_block_sizes(self, now):
+        """Grows a sink's block after underruns and shrinks it back once it has been stable."""
+        # The loopback stops delivering while nothing plays, which starves every sink. That's
+        # no reason to grow, so underruns only count while capture is live.
+        capture_live = now - self.last_callback < 2.0 * self.frames_per_buffer / self.loopback_sample_rate
+        for sink in self.sinks:
+            if sink.block_sizes is None or not sink.running or sink.device_index in self._recovering:
+                continue
+            underruns = sink.buffer.underruns + sink.output_underflows
+            frames = sink.block_sizes.update(sink.frames_per_buffer, underruns, now, counts=capture_live)
+            if frames != sink.frames_per_buffer:
+                self._resize_sink(sink.device_index, frames, "underruns" if frames > sink.frames_per_buffer else "stable")
+
+    def _check_idle(self, key, last_callback, now):
+        """Logs when a capture goes quiet or comes back, which is playback pausing, not a fault."""
+        idle = now - last_callback > self.stall_timeout_s
+        if idle and key not in self._idle:
+            self._idle.add(key)
+            print(f"'{self._stream_name(key)}' is idle, nothing is playing on it")
+        elif not idle and key in self._idle:
+            self._idle.discard(key)
+            print(f"'{self._stream_name(key)}' is playing again")
+
+    def _stream_name(self, key):
+        if key == 'capture':
+            return self.loopback_info['name']
+        if isinstance(key, tuple):
+            source = next((s for s in self.sources if s.device_index == key[1]), None)
+            return source.loopback_info['name'] if source else f"source {key[1]}"
+        sink = next((s for s in self.sinks if s.device_index == key), None)
+        return sink.name if sink else f"device {key}"
+
+    def _begin_recovery(self, key, reason, since=None):
+        """Closes a broken stream and schedules its reopening. `since` is when it was last known good."""
+        print(f"Lost '{self._stream_name(key)}': {reason}. Reopening it...")
+        self._idle.discard(key)
+        if key == 'capture':
+            self._close_capture()
+        elif isinstance(key, tuple):
+            source = next((s for s in self.sources if s.device_index == key[1]), None)
+            if source:
+                self._close_source(source)
+        else:
+            sink = next((s for s in self.sinks if s.device_index == key), None)
+            if sink:
+                sink.stop(timeout=0.5)
+        now = time.perf_counter()
+        self._recovering[key] = {'reason': reason, 'since': since or now, 'attempts': 0, 'next_attempt': now}
+
+    def _attempt_recovery(self, key, state):
+        name = self._stream_name(key)
+        state['attempts'] += 1
+        try:
+            if key == 'capture':
+                self._recover_capture()
+            elif isinstance(key, tuple):
+                self._recover_source(key[1])
+            else:
+                self._replace_sink(key)
+        except Exception as e:
+            backoff = RECOVERY_BACKOFF_S[min(state['attempts'], len(RECOVERY_BACKOFF_S)) - 1]
+            state['next_attempt'] = time.perf_counter() + backoff
+            print(f"Could not reopen '{name}' ({e}), retrying in {backoff:.1f} s")
+            return
+
+        del self._recovering[key]
+        recovery_ms = (time.perf_counter() - state['since']) * 1000.0
+        self.recoveries.append({
+            'stream': name,
+            'reason': state['reason'],
+            'attempts': state['attempts'],
+            'recovery_ms': recovery_ms,
+        })
+        print(f"Recovered '{name}' in {recovery_ms:.0f} ms after {state['attempts']} attempt(s)")
+
+    def _recover_capture(self):
+        # A new format on the source changes what every sink converts from
+        info = self.p.get_device_info_by_index(self.loopback_device_index)
+        rate, channels = int(info['defaultSampleRate']), info['maxInputChannels']
+        if (rate, channels) != (self.loopback_sample_rate, self.common_channels):
+            print(f"Loopback format changed to {rate} Hz, {channels} channels, rebuilding the outputs.")
+            self.loopback_info = info
+            self.loopback_sample_rate, self.common_channels = rate, channels
+            self._choose_capture_block()
+            self._choose_capture_format()
+            for tap in self.capture_taps:
+                tap.restart(rate, channels)
+            for sink in self.sinks:
+                if sink.device_index not in self._recovering:
+                    self._begin_recovery(sink.device_index, "loopback format changed")
+            self._wake.set() # Rebuild them right away rather than on the next watchdog tick
+        self._open_capture()
+
+    def _recover_source(self, device_index):
+        source = next(s for s in self.sources if s.device_index == device_index)
+        info = self.p.get_device_info_by_index(source.loopback_info['index'])
+        if (int(info['defaultSampleRate']), info['maxInputChannels']) != (source.sample_rate, source.channels):
+            # Every sink converts from the old format, rebuild them around a new source
+            print(f"Source '{source.name}' changed format, rebuilding the outputs.")
+            new = CaptureSource(self.session, device_index, source.gain, self.sample_format, self.frames_per_buffer)
+            self.sources = tuple(new if s is source else s for s in self.sources)
+            source = new
+            for sink in self.sinks:
+                if sink.device_index not in self._recovering:
+                    self._begin_recovery(sink.device_index, "source format changed")
+            self._wake.set()
+        self._open_source(source)
+
+    def _replace_sink(self, device_index):
+        """Swaps a sink for a freshly built one, which picks up any change in the device's format."""
+        with self._sinks_lock:
+            old = next((s for s in self.sinks if s.device_index == device_index), None)
+            if old is None:
+                return # Removed while it was down
+            new = self._create_sink(device_index, old.delay_ms, *old.requested)
+            new.muted = old.muted
+            new.taps = old.taps
+            for tap in new.taps:
+                if (tap.sample_rate, tap.channels) != (new.sample_rate, new.channels):
+                    tap.restart(new.sample_rate, new.channels)
+            new.start()
+            self.sinks = tuple(new if s is old else s for s in self.sinks)
+
+    def _resize_sink(self, device_index, frames, reason):
+        """Rebuilds a sink with another block size.
+
+        The new sink takes over the old one's ring, which capture keeps filling throughout,
+        so the cushion survives and the only gap is the time it takes to reopen the stream.
+        """
+        with self._sinks_lock:
+            old = next((s for s in self.sinks if s.device_index == device_index), None)
+            if old is None:
+                return
+            new = self._create_sink(device_index, old.delay_ms, *old.requested, frames_per_buffer=frames,
+                                    buffer=old.buffer, source_buffers=[s.buffer for s in old.sources])
+            new.muted = old.muted
+            new.block_sizes = old.block_sizes
+            new.block_sizes.restart()
+            new.taps = old.taps
+            old.stop()
+            try:
+                new.start(clear_buffer=False)
+            except Exception as e:
+                self._begin_recovery(device_index, f"could not reopen with {frames}-frame blocks: {e}")
+                return
+            self.sinks = tuple(new if s is old else s for s in self.sinks)
+        self.block_changes.append({
+            'stream': new.name,
+            'reason': reason,
+            'from_frames': old.frames_per_buffer,
+            'to_frames': frames,
+        })
+        print(f"Block size for '{new.name}' changed from {old.frames_per_buffer} to {frames} frames ({reason})")
+
+    def _close_capture(self):
+        stream, self.stream = self.stream, None
+        if stream:
+            try:
+                self.session.close_stream(self.loopback_info['name'], stream)
+            except Exception as e:
+                print(f"Error closing loopback stream: {e}")
+
+    def get_recoveries(self):
+        """Recent recoveries, oldest first: {'stream', 'reason', 'attempts', 'recovery_ms'}.
+
+        recovery_ms runs from the moment the stream was last known good until it was reopened.
+        """
+        return list(self.recoveries)
+
+    def first_audio_ms(self):
+        """Time from start_routing() until captured audio first went out to a sink, or None."""
+        times = [sink.first_audio for sink in self.sinks if sink.first_audio is not None]
+        if not times or self._start_requested is None:
+            return None
+        return (min(times) - self._start_requested) * 1000.0
+
+    def achieved_latency_ms(self):
+        """{sink name: estimated capture-to-speaker latency in ms} as things stand right now."""
+        return {sink.name: sink.estimated_latency_ms() for sink in self.sinks}
+
+    def get_metrics(self):
+        """Snapshot of every sink's buffer and drift state, keyed by device name."""
+        return {sink.name: sink.metrics() for sink in self.sinks}
+
+    def snapshot(self):
+        """Capture and sink metrics as plain data for the metrics panel and exporters.
+
+        Reads counters the audio threads keep anyway, so it never slows the callback down.
+        """
+        measured_rate = self.capture_rate.rate()
+        callback = self.callback_timer.summary()
+        jitter = self.jitter_timer.summary()
+        return {
+            'time': time.time(),
+            'running': self.running,
+            'start_ms': self.timings.get('start_ms'),
+            'first_audio_ms': self.first_audio_ms(),
+            'latency_profile': self.latency_profile,
+            'capture': {
+                'name': self.loopback_info['name'],
+                'sample_rate': self.loopback_sample_rate,
+                'frames_per_buffer': self.frames_per_buffer,
+                'sample_format': FORMAT_NAMES.get(self.common_format),
+                'channels': self.common_channels,
+                'measured_rate': measured_rate,
+                'clock_ppm': (measured_rate / self.loopback_sample_rate - 1.0) * 1e6 if measured_rate else None,
+                'input_overflows': self.input_overflows,
+                'input_underflows': self.input_underflows,
+                'callback_p50_us': callback.get('p50_us'),
+                'callback_p99_us': callback.get('p99_us'),
+                'callback_max_us': callback.get('max_us'),
+                'callback_histogram': callback['histogram'],
+                'idle': 'capture' in self._idle,
+                'jitter_p50_us': jitter.get('p50_us'),
+                'jitter_p99_us': jitter.get('p99_us'),
+                'jitter_max_us': jitter.get('max_us'),
+                'recovering': 'capture' in self._recovering,
+            },
+            'sources': [dict(source.metrics(), recovering=('source', source.device_index) in self._recovering,
+                             idle=('source', source.device_index) in self._idle)
+                        for source in self.sources],
+            'sinks': self.get_metrics(),
+            'recoveries': list(self.recoveries),
+            'block_changes': list(self.block_changes),
+            'taps': [tap.metrics() for tap in self.taps],
+        }
+
     def stop_routing(self):
         if not self.running:
             return
+        started = time.perf_counter()
         self.running = False
+        self._wake.set()
         print("Signaled audio routing to stop...")
         
         if threading.current_thread() != self.thread and self.thread and self.thread.is_alive():
@@ -215,42 +2826,356 @@ class AudioRouter:
              if self.thread.is_alive():
                  print("Warning: Audio routing thread did not terminate gracefully.")
         self.thread = None
+        self.timings['stop_ms'] = (time.perf_counter() - started) * 1000.0
 
     def _cleanup_streams(self):
-        # Stop and close loopback input stream
-        if self.stream and self.stream.is_active():
-            self.stream.stop_stream()
-            self.stream.close()
-            self.stream = None
+        # Close the streams even if they already stopped, a dead stream is still open
+        self._close_capture()
+        for source in self.sources:
+            self._close_source(source)
+        self._recovering = {}
+        self._idle = set()
 
         # Stop and close primary output stream
-        if self.primary_output_stream and self.primary_output_stream.is_active():
-            self.primary_output_stream.stop_stream()
-            self.primary_output_stream.close()
+        if self.primary_output_stream:
+            try:
+                self.primary_output_stream.stop_stream()
+                self.primary_output_stream.close()
+            except Exception as e:
+                print(f"Error closing primary output stream: {e}")
             self.primary_output_stream = None
 
-        # Stop and close secondary output stream
-        if self.secondary_output_stream and self.secondary_output_stream.is_active():
-            self.secondary_output_stream.stop_stream()
-            self.secondary_output_stream.close()
-            self.secondary_output_stream = None
+        # Stop the writers and close the output streams
+        with self._sinks_lock:
+            for sink in self.sinks:
+                sink.stop()
         
         print("Audio streams closed.")
 
     def shutdown(self):
         self.stop_routing()
+        for tap in self.taps:
+            self.remove_tap(tap)
         if self.p:
-            self.p.terminate()
+            if self.owns_session:
+                self.session.terminate()
             self.p = None
-        print("PyAudio terminated.")
 
     def __del__(self):
         if self.p:
             self.shutdown()
 
 
-def list_audio_devices():
+METRICS_REFRESH_MS = 500
+CALIBRATION_POLL_MS = 200
+
+# Per-stream columns of the CSV export, one row per stream per snapshot
+METRICS_CSV_FIELDS = [
+    'time', 'stream', 'sample_rate', 'measured_rate', 'clock_ppm', 'backlog_frames', 'fill_ms', 'target_ms',
+    'latency_ms', 'delay_ms', 'drift_ppm', 'underruns', 'inserted_frames', 'overruns', 'dropped_frames',
+    'input_overflows', 'input_underflows', 'callback_p50_us', 'callback_p99_us', 'callback_max_us',
+    'render_p50_us', 'render_p99_us', 'render_max_us', 'sample_format', 'clipped_blocks',
+    'frames_per_buffer', 'output_mode', 'output_underflows',
+]
+
+class MetricsExporter:
+    """Publishes AudioRouter.snapshot() every `interval_s` seconds from a background thread.
+
+    A path ending in .csv gets one row per stream appended per snapshot, any other path is
+    overwritten with the latest snapshot as JSON. With a port, every connection to
+    127.0.0.1:port is answered with the latest snapshot as one line of JSON and closed.
+    """
+    def __init__(self, router, path=None, port=None, interval_s=1.0):
+        self.router = router
+        self.path = path
+        self.port = port
+        self.interval_s = interval_s
+        self.latest = None
+        self._stop = threading.Event()
+        self._threads = []
+        self._server = None
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._run_snapshots, daemon=True)]
+        if self.port is not None:
+            self._server = socket.create_server(('127.0.0.1', self.port))
+            self._server.settimeout(0.5)
+            self.port = self._server.getsockname()[1] # Port 0 picks a free one
+            self._threads.append(threading.Thread(target=self._run_server, daemon=True))
+            print(f"Serving metrics on 127.0.0.1:{self.port}")
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    def _run_snapshots(self):
+        while not self._stop.is_set():
+            try:
+                self.latest = self.router.snapshot()
+                if self.path:
+                    self._write(self.latest)
+            except Exception as e:
+                print(f"Could not export metrics: {e}")
+            self._stop.wait(self.interval_s)
+
+    def _write(self, snapshot):
+        if self.path.lower().endswith('.csv'):
+            rows = [dict(snapshot['capture'], stream=snapshot['capture']['name'])]
+            rows += [dict(metrics, stream=name) for name, metrics in snapshot['sinks'].items()]
+            new_file = not os.path.exists(self.path)
+            with open(self.path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, METRICS_CSV_FIELDS, extrasaction='ignore')
+                if new_file:
+                    writer.writeheader()
+                for row in rows:
+                    writer.writerow(dict(row, time=snapshot['time']))
+        else:
+            # Write aside and swap in, so readers never see half a file
+            partial = self.path + '.tmp'
+            with open(partial, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, indent=2)
+            os.replace(partial, self.path)
+
+    def _run_server(self):
+        while not self._stop.is_set():
+            try:
+                connection, _ = self._server.accept()
+            except (socket.timeout, OSError):
+                continue
+            with connection:
+                try:
+                    snapshot = self.latest or self.router.snapshot()
+                    connection.sendall(json.dumps(snapshot).encode('utf-8') + b'\n')
+                except OSError:
+                    pass # Client went away
+                except Exception as e:
+                    print(f"Could not serve metrics: {e}")
+
+# Out-of-process engine: a RouterProcess stands in for an AudioRouter running in a child process
+ENGINE_METRICS_BYTES = 1 << 18 # Shared memory for the latest snapshot, which is a few KB of JSON
+ENGINE_PUBLISH_S = 0.25
+ENGINE_REPLY_TIMEOUT_S = 15.0
+CALIBRATE_TIMEOUT_S = 120.0 # Calibration records a few seconds per output, far longer than any other call
+# AudioRouter methods a RouterProcess forwards
+ENGINE_METHODS = ('start_routing', 'stop_routing', 'add_sink', 'remove_sink', 'set_source_gain', 'set_delay',
+                  'calibrate', 'add_tap', 'achieved_latency_ms', 'first_audio_ms', 'get_recoveries', 'shutdown')
+
+class SharedSnapshot:
+    """The latest metrics snapshot in shared memory. One process publishes, any process reads.
+
+    The block holds a sequence number, the payload length and the snapshot as JSON. The
+    sequence is odd while a publish is under way (a seqlock), so a reader that sees it odd
+    or changed just reads again: neither side ever waits for the other.
+    """
+    HEADER = struct.Struct('<QQ')
+
+    def __init__(self, name=None, size=ENGINE_METRICS_BYTES):
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.name = self.shm.name
+        self.sequence = 0
+        self.oversized = 0 # Snapshots too large for the block, which readers never see
+
+    def publish(self, snapshot):
+        payload = json.dumps(snapshot).encode('utf-8')
+        buf = self.shm.buf
+        if self.HEADER.size + len(payload) > len(buf):
+            self.oversized += 1
+            return
+        self.HEADER.pack_into(buf, 0, self.sequence + 1, len(payload))
+        buf[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+        self.sequence += 2
+        self.HEADER.pack_into(buf, 0, self.sequence, len(payload))
+
+    def read(self, attempts=100):
+        """The latest snapshot, or None if nothing was published yet."""
+        buf = self.shm.buf
+        for _ in range(attempts):
+            sequence, length = self.HEADER.unpack_from(buf, 0)
+            if sequence == 0:
+                return None
+            if sequence % 2:
+                time.sleep(0) # Publish under way
+                continue
+            payload = bytes(buf[self.HEADER.size:self.HEADER.size + length])
+            if self.HEADER.unpack_from(buf, 0)[0] == sequence:
+                return json.loads(payload)
+        return None
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _run_engine(conn, metrics_name, primary_device_index, secondary_device_indices, options, backend):
+    """Engine process: hosts one AudioRouter and answers a RouterProcess's calls."""
+    metrics = SharedSnapshot(metrics_name)
+    try:
+        router = AudioRouter(primary_device_index, secondary_device_indices,
+                             backend=lambda: create_backend(backend), **options)
+    except Exception as e:
+        conn.send((False, str(e)))
+        metrics.close()
+        return
+    metrics.publish(router.snapshot())
+    conn.send((True, None))
+
+    stop = threading.Event()
+    def publish():
+        while not stop.wait(ENGINE_PUBLISH_S):
+            metrics.publish(router.snapshot())
+    publisher = threading.Thread(target=publish, daemon=True)
+    publisher.start()
+
+    method = None
+    while method != 'shutdown':
+        try:
+            method, args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            method, args, kwargs = 'shutdown', (), {} # The GUI went away without asking
+        try:
+            result = getattr(router, method)(*args, **kwargs)
+            if isinstance(result, (OutputSink, RecordingTap)):
+                result = result.metrics()
+            metrics.publish(router.snapshot()) # So the caller sees the change right away
+            reply = (True, result)
+        except Exception as e:
+            reply = (False, str(e))
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            pass
+    stop.set()
+    publisher.join()
+    metrics.close()
+
+class RouterProcess:
+    """An AudioRouter in its own process, so the GUI's Python never holds up an audio callback.
+
+    Takes the same arguments as AudioRouter, except that `backend` is a create_backend()
+    name and there is no session: the engine process opens its own PortAudio. Calls in
+    ENGINE_METHODS go over a pipe and return what the router returned (a sink's or a tap's
+    metrics for add_sink and add_tap). snapshot() reads the engine's latest published snapshot from shared
+    memory without a round trip, so it never waits for the engine.
+    """
+    def __init__(self, primary_device_index, secondary_device_indices, backend=None, **options):
+        self.metrics = SharedSnapshot()
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_run_engine, name="TwinPlay engine", daemon=True,
+            args=(child_conn, self.metrics.name, primary_device_index, secondary_device_indices, options, backend)
+        )
+        self._lock = threading.Lock()
+        self.process.start()
+        child_conn.close()
+        try:
+            self._reply()
+        except Exception:
+            self._close()
+            raise
+
+    def __getattr__(self, method):
+        if method not in ENGINE_METHODS:
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self._call(method, args, kwargs)
+
+    def _call(self, method, args, kwargs):
+        with self._lock:
+            if self.conn is None:
+                raise Exception("The audio engine process is not running.")
+            try:
+                self.conn.send((method, args, kwargs))
+            except (EOFError, OSError):
+                raise Exception("The audio engine process exited.")
+            return self._reply(CALIBRATE_TIMEOUT_S if method == 'calibrate' else ENGINE_REPLY_TIMEOUT_S)
+
+    def _reply(self, timeout=ENGINE_REPLY_TIMEOUT_S):
+        if not self.conn.poll(timeout):
+            raise Exception(f"The audio engine process did not answer within {timeout:g} s.")
+        try:
+            ok, result = self.conn.recv()
+        except (EOFError, OSError):
+            raise Exception("The audio engine process exited.")
+        if not ok:
+            raise Exception(result)
+        return result
+
+    @property
+    def running(self):
+        snapshot = self.snapshot()
+        return bool(snapshot and snapshot['running'])
+
+    def snapshot(self):
+        if self.conn is None:
+            return None
+        snapshot = self.metrics.read()
+        if snapshot is not None and not self.process.is_alive():
+            snapshot['running'] = False # Died with its last snapshot still in place
+        return snapshot
+
+    def shutdown(self):
+        if self.conn is None:
+            return
+        try:
+            self._call('shutdown', (), {})
+        except Exception as e:
+            print(f"Error shutting down the audio engine process: {e}")
+        self._close()
+
+    def _close(self):
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            print("Warning: Audio engine process did not exit, terminating it.")
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+        self.conn = None
+        self.metrics.close()
+
+def create_backend(name=None):
+    """Returns a PyAudio-compatible audio backend.
+
+    'pyaudio' (the default) talks to the real devices through pyaudiowpatch. 'simulated'
+    returns a SimulatedAudio, for running without audio hardware. The TWINPLAY_BACKEND
+    environment variable picks the backend when no name is given.
+    """
+    name = name or os.environ.get('TWINPLAY_BACKEND', 'pyaudio')
+    if name == 'simulated':
+        # Imported only when asked for, and left out of release builds
+        try:
+            from simulated import SimulatedAudio
+        except ImportError:
+            raise Exception("The simulated backend is not part of this build. Run TwinPlay from source to use it.")
+        return SimulatedAudio()
+    if name == 'pyaudio':
+        if pyaudio.PyAudio is None:
+            raise Exception("pyaudiowpatch is not installed. Install it on Windows, or use the simulated backend.")
+        return pyaudio.PyAudio()
+    raise ValueError(f"Unknown audio backend: {name}")
+
+def list_audio_devices(backend=None):
+    """Devices to offer in the GUI, from a PortAudio instance that is closed again afterwards."""
     p = None
+    try:
+        p = backend() if backend else create_backend()
+        return _list_devices(p)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return []
+    finally:
+        if p:
+            p.terminate()
+
+def _list_devices(p):
     devices = []
     seen_device_keys = set() 
 
@@ -263,8 +3188,6 @@ def list_audio_devices():
     ]
 
     try:
-        p = pyaudio.PyAudio()
-
         wasapi_host_api_index = None
         try:
             wasapi_info = p.get_host_api_info_by_type(pyaudio.paWASAPI)
@@ -328,51 +3251,423 @@ def list_audio_devices():
         traceback.print_exc()
         return []
 
-    finally:
-        if p:
-            p.terminate()
-
     return devices
 
 
+CONTROL_PORT = 47800
+# Route settings a config file may give, and what they default to
+ROUTE_DEFAULTS = {
+    'buffer_ms': 200,
+    'latency_ms': 60,
+    'frames_per_buffer': 1024,
+    'sample_format': None, # A name from FORMAT_NAMES, or None for each device's native format
+    'dither': True,
+    'latency_profile': None, # A name from LATENCY_PROFILES, which overrides latency_ms and frames_per_buffer
+    'gain': 1.0, # Of the source, when extra sources are mixed in
+}
+SINK_SETTINGS = ('device', 'delay_ms', 'channels')
+SOURCE_SETTINGS = ('device', 'gain')
+RECORD_SETTINGS = ('path', 'point', 'sample_format', 'rotate_mb', 'rotate_s')
+
+def load_routes(path):
+    """Reads a headless config file. Returns ({route name: route}, the whole config).
+
+    The file is JSON, for example:
+        {"control_port": 47800,
+         "routes": [{"name": "lobby", "source": "Speakers",
+                     "sinks": ["Headphones", {"device": "Bluetooth", "delay_ms": 120}],
+                     "sources": [{"device": "Game", "gain": 0.5}],
+                     "record": [{"path": "lobby.wav", "rotate_s": 3600}],
+                     "latency_ms": 60}]}
+    Devices are named by their full name, a part of it that only one device has, or their
+    index. Routes take the settings in ROUTE_DEFAULTS, sinks delay_ms and channels. The
+    optional sources are mixed into every sink along with the main source, at their gains.
+    Each record entry starts a RecordingTap on the capture, or with a "point" device on
+    what that sink plays.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    routes = {}
+    for i, route in enumerate(config.get('routes', [])):
+        name = route.get('name') or f"route{i + 1}"
+        if name in routes:
+            raise ValueError(f"{path}: more than one route is called '{name}'")
+        if route.get('source') is None or not route.get('sinks'):
+            raise ValueError(f"{path}: route '{name}' needs a source and at least one sink")
+        unknown = set(route) - set(ROUTE_DEFAULTS) - {'name', 'source', 'sinks', 'sources', 'record'}
+        if unknown:
+            raise ValueError(f"{path}: route '{name}' has unknown settings: {', '.join(sorted(unknown))}")
+        if route.get('sample_format') is not None and route['sample_format'] not in FORMATS_BY_NAME:
+            raise ValueError(f"{path}: route '{name}' has an unknown sample format: {route['sample_format']}")
+        if route.get('latency_profile') is not None and route['latency_profile'] not in LATENCY_PROFILES:
+            raise ValueError(f"{path}: route '{name}' has an unknown latency profile: {route['latency_profile']}")
+
+        sinks = []
+        for sink in route['sinks']:
+            sink = sink if isinstance(sink, dict) else {'device': sink}
+            if sink.get('device') is None or set(sink) - set(SINK_SETTINGS):
+                raise ValueError(f"{path}: route '{name}' has a sink without a device or with unknown settings")
+            sinks.append(sink)
+        sources = []
+        for source in route.get('sources', []):
+            source = source if isinstance(source, dict) else {'device': source}
+            if source.get('device') is None or set(source) - set(SOURCE_SETTINGS):
+                raise ValueError(f"{path}: route '{name}' has a source without a device or with unknown settings")
+            sources.append(source)
+        for record in route.get('record', []):
+            if not isinstance(record, dict) or not record.get('path') or set(record) - set(RECORD_SETTINGS):
+                raise ValueError(f"{path}: route '{name}' has a recording without a path or with unknown settings")
+            if record.get('sample_format', 'int16') not in FORMATS_BY_NAME:
+                raise ValueError(f"{path}: route '{name}' has an unknown recording format: {record['sample_format']}")
+        routes[name] = dict(ROUTE_DEFAULTS, **route)
+        routes[name].update(name=name, sinks=sinks, sources=sources, record=route.get('record', []))
+    return routes, config
+
+def find_device(devices, name, io='output'):
+    """Index of the device a config names, from a list_devices() list.
+
+    `name` is an index, a full device name, or a part of a name that only one device has.
+    """
+    channels = 'maxOutputChannels' if io == 'output' else 'maxInputChannels'
+    candidates = [d for d in devices if d[channels] > 0 and not d['is_loopback']]
+    if isinstance(name, int):
+        if any(d['index'] == name for d in candidates):
+            return name
+        raise Exception(f"There is no {io} device with index {name}.")
+    exact = [d for d in candidates if d['name'] == name]
+    if exact:
+        return exact[0]['index']
+    partial = [d for d in candidates if name.lower() in d['name'].lower()]
+    if len(partial) == 1:
+        return partial[0]['index']
+    if not partial:
+        raise Exception(f"No {io} device matches '{name}'.")
+    raise Exception(f"'{name}' matches several {io} devices: {', '.join(d['name'] for d in partial)}")
+
+class RouteDaemon:
+    """Runs the routes from a config file without a window, e.g. on kiosks that route from boot.
+
+    Every route is an AudioRouter on one shared AudioSession. While run() is going, a control
+    channel on 127.0.0.1:control_port takes one command per connection and answers with one
+    line of JSON:
+        status | start [route] | stop [route] | reload | calibrate [route] <microphone> | shutdown
+    reload re-reads the config: new and changed routes are (re)started, removed ones stopped,
+    and unchanged ones keep playing without a gap. calibrate lines up a running route's outputs
+    through a microphone (see AudioRouter.calibrate). A control_port of None turns it off.
+    """
+    def __init__(self, config_path, backend=None, control_port=CONTROL_PORT):
+        self.config_path = config_path
+        self.backend = backend
+        self.routes, _ = load_routes(config_path)
+        self.control_port = control_port
+        self.session = None
+        self.routers = {} # Route name -> AudioRouter, for routes that were started
+        self.errors = {} # Route name -> why it could not be started
+        self._reported = set() # Routes whose first audio has been logged
+        self._lock = threading.Lock() # One command at a time
+        self._stop = threading.Event()
+        self._server = None
+        self._server_thread = None
+
+    def run(self):
+        """Starts every route and the control channel, then blocks until shutdown, Ctrl+C or SIGTERM."""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.shutdown())
+            if hasattr(signal, 'SIGHUP'):
+                signal.signal(signal.SIGHUP, self._on_hangup)
+        self.session = AudioSession(self.backend)
+        print(f"PortAudio ready {(time.perf_counter() - LAUNCHED) * 1000.0:.0f} ms after loading")
+        if self.control_port is not None:
+            self._server = socket.create_server(('127.0.0.1', self.control_port))
+            self._server.settimeout(0.5)
+            self.control_port = self._server.getsockname()[1] # Port 0 picks a free one
+            self._server_thread = threading.Thread(target=self._run_control, daemon=True)
+            self._server_thread.start()
+            print(f"Listening for commands on 127.0.0.1:{self.control_port}")
+        try:
+            self.start()
+            while not self._stop.wait(0.05):
+                self._report_first_audio()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def shutdown(self):
+        self._stop.set()
+
+    def _on_hangup(self, *_):
+        # Reload on SIGHUP like other daemons, outside the signal handler
+        def reload():
+            reply = self.handle('reload')
+            print("Config reloaded" if reply['ok'] else f"Could not reload the config: {reply['error']}")
+        threading.Thread(target=reload, daemon=True).start()
+
+    def close(self):
+        self._stop.set()
+        if self._server_thread:
+            self._server_thread.join(timeout=2)
+            self._server_thread = None
+        if self._server:
+            self._server.close()
+            self._server = None
+        with self._lock:
+            for name in list(self.routers):
+                self._stop_route(name)
+        if self.session:
+            self.session.terminate()
+            self.session = None
+
+    def start(self, name=None):
+        """Starts one route, or every route that isn't running."""
+        with self._lock:
+            for route in [name] if name else list(self.routes):
+                self._start_route(route)
+
+    def stop(self, name=None):
+        """Stops one route, or all of them."""
+        with self._lock:
+            for route in [name] if name else list(self.routers):
+                if route not in self.routes:
+                    raise ValueError(f"Unknown route: {route}")
+                self._stop_route(route)
+
+    def calibrate(self, argument):
+        """Runs AudioRouter.calibrate on a route. `argument` is "[route] <microphone>", where the
+        route can be left out while only one is running. Returns the calibration results.
+        """
+        if not argument:
+            raise ValueError("Name the microphone: calibrate [route] <microphone>")
+        words = argument.split(None, 1)
+        with self._lock:
+            if len(words) > 1 and words[0] in self.routes:
+                name, microphone = words
+            elif len(self.routers) == 1:
+                name, microphone = next(iter(self.routers)), argument
+            elif not self.routers:
+                raise ValueError("No route is running.")
+            else:
+                raise ValueError("Name the route to calibrate: calibrate <route> <microphone>")
+            router = self.routers.get(name)
+            if router is None or not router.running:
+                raise ValueError(f"Route is not running: {name}")
+            microphone = int(microphone) if microphone.isdigit() else microphone
+            return router.calibrate(find_device(self.session.list_devices(), microphone, io='input'))
+
+    def reload(self):
+        """Re-reads the config file and brings the running routes in line with it.
+
+        A config that doesn't load leaves everything as it was.
+        """
+        routes, _ = load_routes(self.config_path)
+        with self._lock:
+            for name in list(self.routers):
+                if routes.get(name) != self.routes.get(name):
+                    self._stop_route(name)
+            self.routes = routes
+            self.errors = {}
+            # PortAudio only sees devices that came or went when it restarts, which needs everything stopped
+            self.session.refresh(restart=not self.routers)
+            for name in routes:
+                self._start_route(name)
+
+    def _start_route(self, name):
+        if name not in self.routes:
+            raise ValueError(f"Unknown route: {name}")
+        if name in self.routers:
+            return
+        route = self.routes[name]
+        router = None
+        try:
+            devices = self.session.list_devices()
+            router = AudioRouter(
+                find_device(devices, route['source']), [], buffer_ms=route['buffer_ms'],
+                latency_ms=route['latency_ms'], frames_per_buffer=route['frames_per_buffer'], session=self.session,
+                sample_format=FORMATS_BY_NAME.get(route['sample_format']), dither=route['dither'],
+                latency_profile=route['latency_profile'], primary_gain=route['gain'],
+                sources=[(find_device(devices, s['device']), s.get('gain', 1.0)) for s in route['sources']]
+            )
+            for sink in route['sinks']:
+                router.add_sink(find_device(devices, sink['device']), delay_ms=sink.get('delay_ms'),
+                                channels=sink.get('channels'))
+            router.start_routing()
+            for record in route['record']:
+                point = record.get('point', 'capture')
+                router.add_tap(record['path'], 'capture' if point == 'capture' else find_device(devices, point),
+                               record.get('sample_format', 'int16'), rotate_mb=record.get('rotate_mb'),
+                               rotate_s=record.get('rotate_s'))
+        except Exception as e:
+            print(f"Could not start route '{name}': {e}")
+            self.errors[name] = str(e)
+            if router:
+                router.shutdown()
+            return
+        self.routers[name] = router
+        self.errors.pop(name, None)
+        self._reported.discard(name)
+
+    def _stop_route(self, name):
+        router = self.routers.pop(name, None)
+        if router:
+            router.shutdown() # The session stays up for the other routes
+            print(f"Route '{name}' stopped")
+
+    def _report_first_audio(self):
+        for name, router in list(self.routers.items()):
+            if name in self._reported:
+                continue
+            first_audio_ms = router.first_audio_ms()
+            if first_audio_ms is not None:
+                self._reported.add(name)
+                since_launch = (router._start_requested - LAUNCHED) * 1000.0 + first_audio_ms
+                print(f"Route '{name}': first audio {first_audio_ms:.0f} ms after start, "
+                      f"{since_launch:.0f} ms after loading")
+                for sink_name, latency_ms in router.achieved_latency_ms().items():
+                    print(f"Route '{name}': about {latency_ms:.0f} ms of latency to '{sink_name}'")
+
+    def status(self):
+        """{route name: {'running', 'error', 'start_ms', 'first_audio_ms', 'metrics'}} for every configured route."""
+        status = {}
+        for name in self.routes:
+            router = self.routers.get(name)
+            snapshot = router.snapshot() if router else None
+            status[name] = {
+                'running': bool(router and router.running),
+                'error': self.errors.get(name),
+                'start_ms': snapshot['start_ms'] if snapshot else None,
+                'first_audio_ms': snapshot['first_audio_ms'] if snapshot else None,
+                'metrics': snapshot,
+            }
+        return status
+
+    def handle(self, line):
+        """Runs one control command. Returns the reply as a dict."""
+        words = line.split(None, 1)
+        command = words[0].lower() if words else ''
+        argument = words[1].strip() if len(words) > 1 else None
+        try:
+            if command == 'start':
+                self.start(argument)
+            elif command == 'stop':
+                self.stop(argument)
+            elif command == 'reload':
+                self.reload()
+            elif command == 'calibrate':
+                return {'ok': True, 'calibration': self.calibrate(argument)}
+            elif command == 'shutdown':
+                self.shutdown()
+                return {'ok': True}
+            elif command != 'status':
+                raise ValueError(f"Unknown command: {line.strip()}")
+            return {'ok': True, 'routes': self.status()}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def _run_control(self):
+        while not self._stop.is_set():
+            try:
+                connection, _ = self._server.accept()
+            except (socket.timeout, OSError):
+                continue
+            with connection:
+                try:
+                    connection.settimeout(2)
+                    line = connection.makefile('r', encoding='utf-8').readline()
+                    reply = self.handle(line)
+                    connection.sendall(json.dumps(reply).encode('utf-8') + b'\n')
+                except OSError:
+                    pass # Client went away
+
+def send_command(command, port=CONTROL_PORT, timeout=10.0):
+    """Sends one command to a running RouteDaemon and returns its reply."""
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as connection:
+        connection.sendall(command.encode('utf-8') + b'\n')
+        return json.loads(connection.makefile('r', encoding='utf-8').readline())
+
+
 class TwinPlay:
-    def __init__(self, master):
+    def __init__(self, master, backend=None, engine=None):
+        # Imported here so that headless runs, and anything else that imports this module, don't load Tk
+        import tkinter
+        from tkinter import ttk, messagebox
+        self.tk, self.ttk, self.messagebox = tkinter, ttk, messagebox
+
         self.master = master
         master.title("TwinPlay")
+        # 'process' runs the routing engine in its own process (see RouterProcess), anything else in this one
+        self.engine = engine
+        # A create_backend() name, so that an engine process can open the same backend
+        self.backend = backend
 
+        # One PortAudio session for the lifetime of the window, shared by every route
+        self.session = AudioSession(lambda: create_backend(backend))
         self.audio_router = None
-        self.devices = list_audio_devices() # Call the helper function to get device list
+        self.devices = self.session.list_devices()
 
-        self.primary_device_var = tk.StringVar(master)
-        self.secondary_device_var = tk.StringVar(master)
+        self.primary_device_var = self.tk.StringVar(master)
+        self.secondary_device_var = self.tk.StringVar(master)
+        # No profile by default: fixed 1024-frame blocks, as before there were profiles
+        self.latency_profile_var = self.tk.StringVar(master, value=NO_LATENCY_PROFILE)
+        self.microphone_var = self.tk.StringVar(master)
+        self._calibration = None
 
         self.setup_gui()
 
     def setup_gui(self):
         # Primary Device Selection
-        ttk.Label(self.master, text="Audio Source Device:").grid(row=0, column=0, padx=10, pady=5, sticky="w")
-        self.primary_device_dropdown = ttk.Combobox(self.master, textvariable=self.primary_device_var, state="readonly")
+        self.ttk.Label(self.master, text="Audio Source Device:").grid(row=0, column=0, padx=10, pady=5, sticky="w")
+        self.primary_device_dropdown = self.ttk.Combobox(self.master, textvariable=self.primary_device_var, state="readonly")
         self.primary_device_dropdown['values'] = [d['name'] for d in self.devices if not d['is_loopback'] and d['maxOutputChannels'] > 0]
         self.primary_device_dropdown.grid(row=0, column=1, padx=10, pady=5, sticky="ew")
         self.primary_device_dropdown.bind("<<ComboboxSelected>>", self.on_primary_device_selected)
 
         # Secondary Device Selection
-        ttk.Label(self.master, text="Secondary Output Device:").grid(row=1, column=0, padx=10, pady=5, sticky="w")
-        self.secondary_device_dropdown = ttk.Combobox(self.master, textvariable=self.secondary_device_var, state="readonly")
+        self.ttk.Label(self.master, text="Secondary Output Device:").grid(row=1, column=0, padx=10, pady=5, sticky="w")
+        self.secondary_device_dropdown = self.ttk.Combobox(self.master, textvariable=self.secondary_device_var, state="readonly")
         self.secondary_device_dropdown['values'] = [d['name'] for d in self.devices if not d['is_loopback'] and d['maxOutputChannels'] > 0]
         self.secondary_device_dropdown.grid(row=1, column=1, padx=10, pady=5, sticky="ew")
         self.secondary_device_dropdown.bind("<<ComboboxSelected>>", self.on_secondary_device_selected)
 
+        # Latency Profile Selection, applied the next time routing starts
+        self.ttk.Label(self.master, text="Latency Profile:").grid(row=2, column=0, padx=10, pady=5, sticky="w")
+        self.latency_profile_dropdown = self.ttk.Combobox(self.master, textvariable=self.latency_profile_var, state="readonly")
+        self.latency_profile_dropdown['values'] = [NO_LATENCY_PROFILE] + list(LATENCY_PROFILES)
+        self.latency_profile_dropdown.grid(row=2, column=1, padx=10, pady=5, sticky="ew")
+
+        # Microphone that hears every output, for calibrating the delays while routing
+        self.ttk.Label(self.master, text="Calibration Microphone:").grid(row=3, column=0, padx=10, pady=5, sticky="w")
+        self.microphone_dropdown = self.ttk.Combobox(self.master, textvariable=self.microphone_var, state="readonly")
+        self.microphone_dropdown['values'] = [d['name'] for d in self.devices if not d['is_loopback'] and d['maxInputChannels'] > 0]
+        self.microphone_dropdown.grid(row=3, column=1, padx=10, pady=5, sticky="ew")
+
         # Start/Stop Buttons
-        self.start_button = ttk.Button(self.master, text="Start Routing", command=self.start_routing)
-        self.start_button.grid(row=2, column=0, padx=10, pady=10, sticky="ew")
+        self.start_button = self.ttk.Button(self.master, text="Start Routing", command=self.start_routing)
+        self.start_button.grid(row=4, column=0, padx=10, pady=10, sticky="ew")
 
-        self.stop_button = ttk.Button(self.master, text="Stop Routing", command=self.stop_routing, state=tk.DISABLED)
-        self.stop_button.grid(row=2, column=1, padx=10, pady=10, sticky="ew")
+        self.stop_button = self.ttk.Button(self.master, text="Stop Routing", command=self.stop_routing, state=self.tk.DISABLED)
+        self.stop_button.grid(row=4, column=1, padx=10, pady=10, sticky="ew")
+
+        self.calibrate_button = self.ttk.Button(self.master, text="Calibrate Delays", command=self.calibrate, state=self.tk.DISABLED)
+        self.calibrate_button.grid(row=5, column=0, columnspan=2, padx=10, pady=5, sticky="ew")
         
         # Status Label
-        self.status_label = ttk.Label(self.master, text="Status: Ready")
-        self.status_label.grid(row=3, column=0, columnspan=2, padx=10, pady=5, sticky="w")
+        self.status_label = self.ttk.Label(self.master, text="Status: Ready")
+        self.status_label.grid(row=6, column=0, columnspan=2, padx=10, pady=5, sticky="w")
+
+        # Live metrics, refreshed while routing
+        metrics_frame = self.ttk.LabelFrame(self.master, text="Live Metrics")
+        metrics_frame.grid(row=7, column=0, columnspan=2, padx=10, pady=5, sticky="ew")
+        self.capture_metrics_label = self.ttk.Label(metrics_frame, text="Capture: not running")
+        self.capture_metrics_label.grid(row=0, column=0, padx=5, pady=2, sticky="w")
+        columns = ('output', 'buffer', 'latency', 'rate', 'drift', 'underruns', 'dropped')
+        self.metrics_tree = self.ttk.Treeview(metrics_frame, columns=columns, show='headings', height=3)
+        for column, heading, width in zip(columns, ("Output", "Buffer ms", "Latency ms", "Clock Hz", "Drift ppm", "Underruns", "Dropped"),
+                                          (200, 70, 75, 80, 70, 70, 65)):
+            self.metrics_tree.heading(column, text=heading)
+            self.metrics_tree.column(column, width=width, anchor="w" if column == 'output' else "e")
+        self.metrics_tree.grid(row=1, column=0, padx=5, pady=2, sticky="ew")
+        self._metrics_job = None
+        self.metrics_exporter = None
 
         # Initial device selection
         if len(self.devices) > 0:
@@ -393,15 +3688,15 @@ class TwinPlay:
                     self.secondary_device_var.set(available_for_secondary[0])
                 self.on_secondary_device_selected(None)
 
+            # Pre-select something that sounds like a microphone
+            microphones = self.microphone_dropdown['values']
+            if microphones:
+                self.microphone_var.set(next((name for name in microphones if "mic" in name.lower()), microphones[0]))
+
     def get_default_output_device_name(self):
         """Helper to find the currently set default output device name."""
         try:
-            # Create a *new* PyAudio instance here
-            p = pyaudio.PyAudio()
-            
-            default_output_info = p.get_default_output_device_info()
-            default_output_index = default_output_info['index']
-            p.terminate() # Always terminate PyAudio instance created in a helper
+            default_output_index = self.session.default_output_index()
 
             print(f"PyAudio default output device index: {default_output_index}")
             default_device = next((d for d in self.devices if d['index'] == default_output_index), None)
@@ -422,7 +3717,7 @@ class TwinPlay:
         selected_name = self.primary_device_var.get()
         # Allow primary and secondary to be the same initially, but the logic in AudioRouter will prevent feedback
         if selected_name == self.secondary_device_var.get() and selected_name != "":
-            messagebox.showwarning("Warning", "The audio source device and secondary output device cannot be the same.")
+            self.messagebox.showwarning("Warning", "The audio source device and secondary output device cannot be the same.")
             self.primary_device_var.set("") # Clear selection
             self.primary_selected_index = None
         else:
@@ -431,49 +3726,198 @@ class TwinPlay:
     def on_secondary_device_selected(self, event):
         selected_name = self.secondary_device_var.get()
         if selected_name == self.primary_device_var.get() and selected_name != "":
-            messagebox.showwarning("Warning", "The audio source device and secondary output device cannot be the same.")
+            self.messagebox.showwarning("Warning", "The audio source device and secondary output device cannot be the same.")
             self.secondary_device_var.set("") # Clear selection
             self.secondary_selected_index = None
         else:
+            previous_index = getattr(self, 'secondary_selected_index', None)
             self.secondary_selected_index = next((d['index'] for d in self.devices if d['name'] == selected_name), None)
+            if self.audio_router and self.audio_router.running and self.secondary_selected_index != previous_index:
+                self.switch_secondary(previous_index, self.secondary_selected_index)
+
+    def switch_secondary(self, old_index, new_index):
+        """Moves the running route to another secondary device without restarting capture."""
+        try:
+            started = time.perf_counter()
+            if new_index is not None:
+                self.audio_router.add_sink(new_index)
+            if old_index is not None:
+                self.audio_router.remove_sink(old_index)
+            print(f"Switched secondary device in {(time.perf_counter() - started) * 1000.0:.1f} ms")
+        except Exception as e:
+            self.messagebox.showerror("Error", f"Failed to switch the secondary device: {e}")
 
     def start_routing(self):
         if not self.primary_selected_index or not self.secondary_selected_index:
-            messagebox.showerror("Error", "Please select both an audio source device and a secondary output device.")
+            self.messagebox.showerror("Error", "Please select both an audio source device and a secondary output device.")
             return
 
+        latency_profile = self.latency_profile_var.get()
+        if latency_profile == NO_LATENCY_PROFILE:
+            latency_profile = None
         try:
             self.status_label.config(text="Status: Starting...")
             # AudioRouter is initiated with the two selected device indices
-            self.audio_router = AudioRouter(self.primary_selected_index, self.secondary_selected_index)
+            if self.engine == 'process':
+                self.audio_router = RouterProcess(self.primary_selected_index, self.secondary_selected_index,
+                                                  backend=self.backend, latency_profile=latency_profile)
+            else:
+                self.audio_router = AudioRouter(self.primary_selected_index, self.secondary_selected_index, session=self.session,
+                                                latency_profile=latency_profile)
             self.audio_router.start_routing()
             self.status_label.config(text="Status: Routing audio...")
-            self.start_button.config(state=tk.DISABLED)
-            self.stop_button.config(state=tk.NORMAL)
+            self.start_button.config(state=self.tk.DISABLED)
+            self.stop_button.config(state=self.tk.NORMAL)
+            self.calibrate_button.config(state=self.tk.NORMAL)
+            self.refresh_metrics()
+            self.start_metrics_export()
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to start routing: {e}\nEnsure your selected source device is the active output for audio applications like Spotify.")
+            self.messagebox.showerror("Error", f"Failed to start routing: {e}\nEnsure your selected source device is the active output for audio applications like Spotify.")
             self.status_label.config(text="Status: Error")
             self.stop_routing() # Attempt to clean up if failed to start
 
+    def calibrate(self):
+        """Lines the outputs up through the selected microphone. It takes several seconds, so it runs in a thread."""
+        microphone_index = next((d['index'] for d in self.devices if d['name'] == self.microphone_var.get()
+                                 and not d['is_loopback'] and d['maxInputChannels'] > 0), None)
+        if microphone_index is None:
+            self.messagebox.showerror("Error", "Please select a microphone that can hear every output.")
+            return
+
+        result = {}
+        def run(router=self.audio_router):
+            try:
+                result['delays'] = router.calibrate(microphone_index)
+            except Exception as e:
+                result['error'] = e
+
+        self._calibration = threading.Thread(target=run, name="TwinPlay calibration", daemon=True)
+        self._calibration.start()
+        # Stopping mid-way would close the stream the calibration is listening to
+        self.stop_button.config(state=self.tk.DISABLED)
+        self.calibrate_button.config(state=self.tk.DISABLED)
+        self.status_label.config(text="Status: Calibrating, keep the room quiet...")
+        self.master.after(CALIBRATION_POLL_MS, self.finish_calibration, result)
+
+    def finish_calibration(self, result):
+        """Waits for the calibration thread, then shows the delays it set."""
+        if self._calibration.is_alive():
+            self.master.after(CALIBRATION_POLL_MS, self.finish_calibration, result)
+            return
+        self._calibration = None
+        self.stop_button.config(state=self.tk.NORMAL)
+        self.calibrate_button.config(state=self.tk.NORMAL)
+        if 'error' in result:
+            self.status_label.config(text="Status: Routing audio...")
+            self.messagebox.showerror("Error", f"Calibration failed: {result['error']}")
+            return
+        delays = ", ".join(f"'{name}' {r['delay_ms']:.0f} ms" for name, r in result['delays'].items())
+        self.status_label.config(text=f"Status: Routing audio, calibrated ({delays})")
+
+    def refresh_metrics(self):
+        """Redraws the metrics panel, and keeps doing so twice a second while routing."""
+        self._metrics_job = None
+        if not self.audio_router:
+            return
+        snapshot = self.audio_router.snapshot()
+        capture = snapshot['capture']
+        rate = f"{capture['measured_rate']:.1f} Hz" if capture['measured_rate'] else "measuring"
+        if capture['idle']:
+            rate = "idle, nothing playing"
+        callback = f"{capture['callback_p99_us']:.0f} us" if capture['callback_p99_us'] is not None else "-"
+        self.capture_metrics_label.config(
+            text=f"Capture: {rate}, {capture['frames_per_buffer']}-frame blocks, callback p99 {callback}, "
+                 f"overflows {capture['input_overflows']}, recoveries {len(snapshot['recoveries'])}"
+        )
+        self.metrics_tree.delete(*self.metrics_tree.get_children())
+        for name, m in snapshot['sinks'].items():
+            self.metrics_tree.insert('', 'end', values=(
+                name,
+                f"{m['fill_ms']:.0f}",
+                f"{m['latency_ms']:.0f}",
+                f"{m['measured_rate']:.1f}" if m['measured_rate'] else "-",
+                f"{m['drift_ppm']:+.0f}",
+                m['underruns'],
+                m['dropped_frames'],
+            ))
+        self._metrics_job = self.master.after(METRICS_REFRESH_MS, self.refresh_metrics)
+
+    def start_metrics_export(self):
+        """Exports metrics while routing if TWINPLAY_METRICS (a .json or .csv file) or TWINPLAY_METRICS_PORT is set."""
+        path = os.environ.get('TWINPLAY_METRICS')
+        port = os.environ.get('TWINPLAY_METRICS_PORT')
+        if not path and not port:
+            return
+        try:
+            self.metrics_exporter = MetricsExporter(self.audio_router, path=path, port=int(port) if port else None)
+            self.metrics_exporter.start()
+        except Exception as e:
+            print(f"Could not start metrics export: {e}")
+            self.metrics_exporter = None
+
     def stop_routing(self):
+        if self._metrics_job:
+            self.master.after_cancel(self._metrics_job)
+            self._metrics_job = None
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+            self.metrics_exporter = None
         if self.audio_router:
             self.audio_router.stop_routing()
-            # call shutdown to ensure PyAudio is terminated
+            # The session (and PortAudio) stays up for the next start
             self.audio_router.shutdown() 
             self.audio_router = None
         self.status_label.config(text="Status: Stopped")
-        self.start_button.config(state=tk.NORMAL)
-        self.stop_button.config(state=tk.DISABLED)
+        self.start_button.config(state=self.tk.NORMAL)
+        self.stop_button.config(state=self.tk.DISABLED)
+        self.calibrate_button.config(state=self.tk.DISABLED)
 
     def on_closing(self):
         if self.audio_router:
             self.audio_router.shutdown() # Call shutdown on close
+        self.session.terminate()
         self.master.destroy()
 
-if __name__ == "__main__":
-    root = tk.Tk()
-    app = TwinPlay(root)
+def run_gui(engine=None, backend=None):
+    import tkinter
+    root = tkinter.Tk()
+    app = TwinPlay(root, backend=backend, engine=engine)
     icon_path = resource_path("TwinPlay.ico")
     root.iconbitmap(icon_path)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
     root.mainloop()
+
+def main(argv=None):
+    multiprocessing.freeze_support() # The engine process of a PyInstaller build starts here too
+    parser = argparse.ArgumentParser(description="Play one audio output on several devices at once.")
+    parser.add_argument('--headless', metavar='CONFIG', help="run the routes in a JSON config file without a window")
+    parser.add_argument('--send', metavar='COMMAND',
+                        help="send status, start [route], stop [route], reload, calibrate [route] <microphone> "
+                             "or shutdown to a headless TwinPlay")
+    parser.add_argument('--control-port', type=int,
+                        help=f"control channel port, default: the config's control_port or {CONTROL_PORT}")
+    parser.add_argument('--backend', help="audio backend, pyaudio or simulated (default: $TWINPLAY_BACKEND)")
+    parser.add_argument('--engine', choices=('thread', 'process'), default=os.environ.get('TWINPLAY_ENGINE', 'thread'),
+                        help="run the GUI's audio engine in a thread of the GUI process or in a process of its own "
+                             "(default: $TWINPLAY_ENGINE or thread)")
+    args = parser.parse_args(argv)
+
+    if args.send:
+        timeout = CALIBRATE_TIMEOUT_S if args.send.strip().lower().startswith('calibrate') else 10.0
+        reply = send_command(args.send, args.control_port or CONTROL_PORT, timeout=timeout)
+        print(json.dumps(reply, indent=2))
+        return 0 if reply.get('ok') else 1
+    if args.headless:
+        try:
+            _, config = load_routes(args.headless)
+        except (OSError, ValueError) as e:
+            print(f"Could not load {args.headless}: {e}")
+            return 2
+        port = args.control_port if args.control_port is not None else config.get('control_port', CONTROL_PORT)
+        RouteDaemon(args.headless, backend=lambda: create_backend(args.backend), control_port=port).run()
+        return 0
+    run_gui(args.engine, args.backend)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
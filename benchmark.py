@@ -0,0 +1,999 @@
+"""Benchmarks for the TwinPlay audio engine.
+
+Usage:
+    python benchmark.py resample [--seconds 10] [--channels 2] [--block 1024]
+    python benchmark.py routing [--blocks 64,256,1024,4096] [--rates 48000:48000,44100:48000]
+                                [--channels 2] [--seconds 5] [--output FILE] [--baseline FILE]
+    python benchmark.py probe [--outputs 12] [--open-ms 30] [--query-ms 2]
+    python benchmark.py session [--cycles 5] [--init-ms 300] [--open-ms 30]
+    python benchmark.py recovery [--outage 1.0]
+    python benchmark.py startup [--runs 4] [--latency-ms 60]
+    python benchmark.py formats [--seconds 10] [--channels 2] [--block 1024] [--no-dither]
+    python benchmark.py alloc-check [--block 64 256 1024] [--blocks 2000]
+    python benchmark.py latency [--seconds 5] [--device-ms 20] [--jitter-ms 0]
+    python benchmark.py mix [--sources 4] [--block 1024] [--seconds 10] [--source-rate 48000]
+    python benchmark.py isolation [--seconds 5] [--gui-ms 8] [--gui-period-ms 16] [--cpu-threads 1]
+    python benchmark.py record [--seconds 120] [--block 1024] [--flush-s 0.01] [--impact-seconds 4]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+import TwinPlay
+from TwinPlay import (FORMAT_NAMES, FORMATS_BY_NAME, LATENCY_PROFILES, NATIVE_FORMATS, AudioRouter, AudioSession,
+                      CapabilityCache, PolyphaseResampler, RecordingTap, RouterProcess, SampleDecoder,
+                      SampleEncoder, create_backend, probe_supported_rates, send_command)
+from simulated import SimulatedAudio
+
+# Rate pairs seen in the wild: CD content on 48k devices, hi-res loopbacks, and back again
+RESAMPLE_PAIRS = [
+    (44100, 48000),
+    (48000, 44100),
+    (96000, 48000),
+    (88200, 48000),
+    (48000, 96000),
+]
+
+def bench_resample(args):
+    """Reports CPU time spent per second of converted audio for each rate pair."""
+    rng = np.random.default_rng(0)
+    print(f"Polyphase resampler, {args.channels} channel(s), {args.block}-frame blocks, {args.seconds}s of audio per pair")
+    for in_rate, out_rate in RESAMPLE_PAIRS:
+        resampler = PolyphaseResampler(in_rate, out_rate, args.channels, args.block)
+        block = rng.uniform(-0.5, 0.5, (args.block, args.channels)).astype(np.float32)
+        out = np.zeros((resampler.max_output_frames, args.channels), dtype=np.float32)
+        blocks = int(args.seconds * in_rate / args.block)
+
+        resampler.process(block, out) # Warm up caches outside the timed region
+        start = time.process_time()
+        for _ in range(blocks):
+            resampler.process(block, out)
+        cpu = time.process_time() - start
+
+        audio_seconds = blocks * args.block / in_rate
+        cpu_ms_per_second = cpu * 1000.0 / audio_seconds
+        print(f"  {in_rate:>6} -> {out_rate:<6} Hz: {cpu_ms_per_second:7.2f} ms CPU per audio second "
+              f"({audio_seconds / cpu if cpu else float('inf'):.0f}x realtime, {resampler.taps} taps)")
+
+# Simulated time each routing run plays before measuring, so priming doesn't count as glitches
+ROUTING_WARMUP_S = 1.0
+# The loopback carries one click per period, longer than any latency worth measuring
+CLICK_PERIOD_S = 0.5
+ALLOC_BLOCKS = 50
+
+# Metric -> (allowed relative increase, absolute slack) before a change counts as a regression
+REGRESSION_LIMITS = {
+    'callback_us_p99': (0.5, 20.0),
+    'render_us_p99': (0.5, 50.0),
+    'cpu_ms_per_s': (0.25, 0.5),
+    'latency_ms_mean': (0.1, 5.0),
+    'alloc_kb_per_block': (0.1, 1.0),
+    'underruns': (0.0, 0),
+    'overruns': (0.0, 0),
+}
+
+def click_source(sim, clicks, period_s=CLICK_PERIOD_S, level=0.5):
+    """Simulated loopback signal: one click per period and silence in between.
+
+    The simulated time each click was captured is appended to `clicks`.
+    """
+    def source(device, start_frame, frames, channels, rate):
+        block = np.zeros((frames, channels), dtype=np.float32)
+        period = int(period_s * rate)
+        # The device asks for a block once its clock has passed the end of it
+        block_end_time = sim.now()
+        for frame in range(-(-start_frame // period) * period, start_frame + frames, period):
+            block[frame - start_frame] = level
+            clicks.append(block_end_time - (start_frame + frames - frame) / rate)
+        return block
+    return source
+
+def find_clicks(recording, rate, period_s=CLICK_PERIOD_S):
+    """Times at which the clicks in a SimulatedAudio output recording reach the speaker."""
+    peaks = [(plays_at, np.abs(block).max(axis=1)) for plays_at, block in recording]
+    loudest = max((levels.max() for _, levels in peaks if len(levels)), default=0.0)
+    found = []
+    if loudest <= 0:
+        return found
+    for plays_at, levels in peaks:
+        i = int(np.argmax(levels)) if len(levels) else 0
+        if len(levels) and levels[i] > 0.5 * loudest:
+            when = plays_at + i / rate
+            if not found or when - found[-1] > period_s / 2:
+                found.append(when)
+    return found
+
+def percentiles_us(seconds):
+    if not len(seconds):
+        return 0.0, 0.0, 0.0
+    p50, p99 = np.percentile(seconds, [50, 99]) * 1e6
+    return float(p50), float(p99), float(seconds.max() * 1e6)
+
+def measure_allocations(router, sink, blocks=ALLOC_BLOCKS):
+    """Mean peak of memory allocated while one block goes through capture and render, in KB.
+
+    Runs the callback and the sink's render step on this thread with the streams stopped,
+    so the simulator's own allocations don't count.
+    """
+    in_data = bytes(router.frames_per_buffer * router.decoder.frame_bytes)
+    buffers = sink._render_buffers()
+    for _ in range(5):
+        router._audio_callback(in_data, router.frames_per_buffer, None, 0)
+        sink._render(*buffers)
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(blocks):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        router._audio_callback(in_data, router.frames_per_buffer, None, 0)
+        sink._render(*buffers)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return float(np.mean(peaks)) / 1024
+
+def run_routing_scenario(block, in_rate, out_rate, channels, seconds, speed):
+    """Routes clicks from a simulated loopback to one simulated headphone and measures the pipeline."""
+    devices = [
+        {'name': 'Speakers', 'maxOutputChannels': channels, 'defaultSampleRate': float(in_rate)},
+        {'name': 'Speakers [Loopback]', 'maxInputChannels': channels, 'defaultSampleRate': float(in_rate),
+         'isLoopbackDevice': True},
+        {'name': 'Headphones', 'maxOutputChannels': 2, 'defaultSampleRate': float(out_rate), 'skewPpm': 50.0},
+    ]
+    sim = SimulatedAudio(devices, speed=speed, record_outputs=True)
+    clicks = []
+    sim.source = click_source(sim, clicks)
+
+    # The engine logs every stream it opens, keep the report readable. The simulated
+    # devices get their own capability cache rather than replacing the real one.
+    with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as folder:
+        capabilities = CapabilityCache(os.path.join(folder, 'devices.json'))
+        router = AudioRouter(0, [2], frames_per_buffer=block, backend=lambda: sim, capabilities=capabilities)
+        sink = router.sinks[0]
+        router.start_routing()
+        sim.sleep(ROUTING_WARMUP_S)
+
+        before = sink.metrics()
+        underflows_before = sink.stream.output_underflows if sink.stream else 0
+        router.callback_timer.reset()
+        sink.render_timer.reset()
+        measure_from = sim.now()
+        cpu_start = time.process_time()
+        sim.sleep(seconds)
+        cpu = time.process_time() - cpu_start
+        audio_seconds = sim.now() - measure_from
+
+        after = sink.metrics()
+        underflows = (sink.stream.output_underflows if sink.stream else 0) - underflows_before
+        capture_overflows = router.stream.input_overflows if router.stream else 0
+        callback_times = router.callback_timer.recent()
+        render_times = sink.render_timer.recent()
+        callbacks, renders = router.callback_timer.count, sink.render_timer.count
+        router.stop_routing()
+        alloc_kb = measure_allocations(router, sink)
+        router.shutdown()
+
+    # Pair every click heard after warm-up with the last one captured before it
+    latencies = []
+    for heard in find_clicks(sim.recordings.get(2, []), sink.sample_rate):
+        captured = [c for c in clicks if c <= heard]
+        if heard >= measure_from and captured and heard - captured[-1] < CLICK_PERIOD_S:
+            latencies.append((heard - captured[-1]) * 1000.0)
+
+    callback_p50, callback_p99, callback_max = percentiles_us(callback_times)
+    render_p50, render_p99, render_max = percentiles_us(render_times)
+    engine_seconds = callback_times.mean() * callbacks if callbacks else 0.0
+    engine_seconds += render_times.mean() * renders if renders else 0.0
+    return {
+        'callback_us_p50': callback_p50,
+        'callback_us_p99': callback_p99,
+        'callback_us_max': callback_max,
+        'render_us_p50': render_p50,
+        'render_us_p99': render_p99,
+        'render_us_max': render_max,
+        'cpu_ms_per_s': engine_seconds * 1000.0 / audio_seconds,
+        'process_cpu_ms_per_s': cpu * 1000.0 / audio_seconds * speed, # Includes the simulator
+        'latency_ms_mean': float(np.mean(latencies)) if latencies else None,
+        'latency_ms_max': float(np.max(latencies)) if latencies else None,
+        'alloc_kb_per_block': alloc_kb,
+        'underruns': after['underruns'] - before['underruns'],
+        'overruns': after['overruns'] - before['overruns'],
+        'device_underflows': underflows,
+        'capture_overflows': capture_overflows,
+    }
+
+def find_regressions(results, baseline):
+    """Metrics that got worse than REGRESSION_LIMITS allow, as printable lines."""
+    regressions = []
+    for name, metrics in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        for metric, (relative, slack) in REGRESSION_LIMITS.items():
+            old, new = base.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1.0 + relative) + slack:
+                regressions.append(f"{name}: {metric} {old:.2f} -> {new:.2f}")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_routing(args):
+    """Drives the full capture -> ring -> convert -> output path on simulated devices."""
+    blocks = [int(b) for b in args.blocks.split(',')]
+    rates = [tuple(int(r) for r in pair.split(':')) for pair in args.rates.split(',')]
+    channel_counts = [int(c) for c in args.channels.split(',')]
+
+    print(f"Routing pipeline, {args.seconds}s of simulated audio per scenario at {args.speed}x speed")
+    print(f"  {'scenario':<28} {'callback p50/p99/max us':>24} {'render p50/p99/max us':>24} "
+          f"{'CPU ms/s':>8} {'latency ms':>10} {'alloc KB':>8} {'under':>5} {'over':>4}")
+    scenarios = {}
+    for in_rate, out_rate in rates:
+        for channels in channel_counts:
+            for block in blocks:
+                name = f"{in_rate}->{out_rate} {channels}ch {block}f"
+                m = run_routing_scenario(block, in_rate, out_rate, channels, args.seconds, args.speed)
+                scenarios[name] = m
+                latency = f"{m['latency_ms_mean']:.1f}" if m['latency_ms_mean'] is not None else '-'
+                callback = f"{m['callback_us_p50']:.0f}/{m['callback_us_p99']:.0f}/{m['callback_us_max']:.0f}"
+                render = f"{m['render_us_p50']:.0f}/{m['render_us_p99']:.0f}/{m['render_us_max']:.0f}"
+                print(f"  {name:<28} {callback:>24} {render:>24} {m['cpu_ms_per_s']:>8.2f} {latency:>10} "
+                      f"{m['alloc_kb_per_block']:>8.1f} {m['underruns']:>5} {m['overruns']:>4}")
+
+    results = {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'settings': {'seconds': args.seconds, 'speed': args.speed},
+        'scenarios': scenarios,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline} ({baseline.get('commit') or 'unknown commit'})")
+    return 0
+
+def many_simulated_devices(outputs):
+    """A machine with lots of endpoints: every output has a loopback, plus a mic per four outputs."""
+    devices = []
+    for i in range(outputs):
+        name = f"Output {i + 1:02d} (Simulated)"
+        rate = 44100.0 if i % 3 == 2 else 48000.0
+        devices.append({'name': name, 'maxOutputChannels': 2, 'defaultSampleRate': rate,
+                        'supportedRates': [44100, 48000]})
+        devices.append({'name': f"{name} [Loopback]", 'maxInputChannels': 2, 'defaultSampleRate': rate,
+                        'isLoopbackDevice': True})
+        if i % 4 == 0:
+            devices.append({'name': f"Microphone {i // 4 + 1:02d} (Simulated)", 'maxInputChannels': 1,
+                            'defaultSampleRate': 48000.0})
+    return devices
+
+def bench_probe(args):
+    """Compares device capability probing by opening streams against the cached, query-first path."""
+    def new_backend(thread_safe=True):
+        sim = SimulatedAudio(many_simulated_devices(args.outputs), open_latency=args.open_ms / 1000.0,
+                             query_latency=args.query_ms / 1000.0)
+        sim.thread_safe_queries = thread_safe
+        return sim
+
+    def timed(action):
+        start = time.perf_counter()
+        action()
+        return (time.perf_counter() - start) * 1000.0
+
+    sim = new_backend()
+    endpoints = [(info['index'], io) for info in map(sim.get_device_info_by_index, range(sim.get_device_count()))
+                 for io, channels in (('output', info['maxOutputChannels']), ('input', info['maxInputChannels']))
+                 if channels > 0]
+    print(f"Capability probing, {len(endpoints)} endpoints, {args.open_ms:g} ms per stream open, "
+          f"{args.query_ms:g} ms per format query")
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'devices.json')
+
+        ms = timed(lambda: [probe_supported_rates(sim, index, io, query=False) for index, io in endpoints])
+        print(f"  open a stream per rate (previous behaviour): {ms:8.1f} ms, {sim.opens} opens")
+
+        sim = new_backend(thread_safe=False)
+        ms = timed(lambda: CapabilityCache(path).probe_all(sim))
+        print(f"  cold cache, sequential queries:             {ms:8.1f} ms, {sim.queries} queries, {sim.opens} opens")
+
+        os.remove(path)
+        sim = new_backend()
+        ms = timed(lambda: CapabilityCache(path).probe_all(sim))
+        print(f"  cold cache, parallel queries:               {ms:8.1f} ms, {sim.queries} queries")
+
+        sim = new_backend()
+        ms = timed(lambda: CapabilityCache(path).probe_all(sim))
+        print(f"  warm cache:                                 {ms:8.1f} ms, {sim.queries} queries")
+
+        # What a Start click costs: building a router that mirrors to three outputs
+        sinks = [index for index, io in endpoints if io == 'output'][1:4]
+        for label in ("cold", "warm"):
+            if label == "cold":
+                os.remove(path)
+            sim = new_backend()
+            with contextlib.redirect_stdout(io.StringIO()):
+                ms = timed(lambda: AudioRouter(0, sinks, backend=lambda: sim, capabilities=CapabilityCache(path)).shutdown())
+            print(f"  router start, {label} cache:                   {ms:8.1f} ms, {sim.queries} queries, {sim.opens} opens")
+
+def wait_until_routing(router, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while 'start_ms' not in router.timings and router.running and time.perf_counter() < deadline:
+        time.sleep(0.001)
+
+def bench_session(args):
+    """Start/stop cycles with a fresh PortAudio per route (previous behaviour) vs. one shared session."""
+    def new_backend():
+        return SimulatedAudio(many_simulated_devices(args.outputs), init_latency=args.init_ms / 1000.0,
+                              open_latency=args.open_ms / 1000.0)
+
+    outputs = [i for i, device in enumerate(many_simulated_devices(args.outputs)) if device.get('maxOutputChannels')]
+    primary, secondary, other = outputs[0], outputs[1], outputs[2]
+    print(f"Route start/stop, {args.cycles} cycles, {args.init_ms:g} ms PortAudio start-up, "
+          f"{args.open_ms:g} ms per stream open")
+
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(io.StringIO()):
+        capabilities = CapabilityCache(os.path.join(folder, 'devices.json'))
+        capabilities.probe_all(new_backend()) # Both variants start from a warm cache
+
+        results = {}
+        for label in ("PortAudio per route", "shared session"):
+            session = AudioSession(new_backend, capabilities) if label == "shared session" else None
+            starts, stops = [], []
+            for _ in range(args.cycles):
+                started = time.perf_counter()
+                router = AudioRouter(primary, [secondary], backend=new_backend, capabilities=capabilities,
+                                     session=session)
+                router.start_routing()
+                wait_until_routing(router)
+                starts.append((time.perf_counter() - started) * 1000.0)
+
+                started = time.perf_counter()
+                router.shutdown()
+                stops.append((time.perf_counter() - started) * 1000.0)
+            results[label] = (np.mean(starts), np.mean(stops))
+
+            if session:
+                router = AudioRouter(primary, [secondary], session=session)
+                router.start_routing()
+                wait_until_routing(router)
+                started = time.perf_counter()
+                router.add_sink(other)
+                router.remove_sink(secondary)
+                switch_ms = (time.perf_counter() - started) * 1000.0
+                router.shutdown()
+                timings = session.timing_summary()
+                session.terminate()
+
+    for label, (start_ms, stop_ms) in results.items():
+        print(f"  {label:<20} start {start_ms:7.1f} ms, stop {stop_ms:7.1f} ms")
+    print(f"  switching the secondary device on a running route: {switch_ms:.1f} ms")
+    for action, summary in timings.items():
+        print(f"  stream {action:<5} {summary['mean_ms']:6.1f} ms mean, {summary['max_ms']:6.1f} ms max "
+              f"over {summary['count']} streams")
+
+# What `startup` launches: one route on the default simulated devices
+STARTUP_ROUTE = {'name': 'bench', 'source': 'Speakers (Realtek', 'sinks': ['Headphones', 'Headset']}
+FIRST_AUDIO_LINE = re.compile(r"first audio (\d+) ms after start, (\d+) ms after loading")
+
+def bench_startup(args):
+    """Launches headless TwinPlay on simulated devices and times how long it takes until audio plays.
+
+    The first launch starts with an empty capability cache, the others find it filled. TwinPlay's
+    own log times start once its imports are done, so the import time is measured on its own.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    probe = ("import time; started = time.perf_counter(); import sys, TwinPlay; "
+             "print((time.perf_counter() - started) * 1000.0, 'tkinter' in sys.modules)")
+    output = subprocess.run([sys.executable, '-c', probe], cwd=here, capture_output=True, text=True, check=True)
+    import_ms, tkinter_loaded = output.stdout.split()
+    print(f"Headless startup, {args.runs} launches, {args.latency_ms:g} ms latency target")
+    print(f"  import TwinPlay: {float(import_ms):.0f} ms, Tk loaded: {tkinter_loaded == 'True'}")
+
+    runs = []
+    with tempfile.TemporaryDirectory() as folder:
+        config = os.path.join(folder, 'routes.json')
+        with open(config, 'w', encoding='utf-8') as f:
+            json.dump({'control_port': 0, 'routes': [dict(STARTUP_ROUTE, latency_ms=args.latency_ms)]}, f)
+        # APPDATA keeps the simulated devices out of the real device cache
+        env = dict(os.environ, TWINPLAY_BACKEND='simulated', APPDATA=folder)
+        for _ in range(args.runs):
+            launched = time.perf_counter()
+            # Run as a module like the README says: a script is compiled on every launch, a module is cached
+            process = subprocess.Popen([sys.executable, '-u', '-m', 'TwinPlay', '--headless', config], cwd=here,
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env)
+            port = match = None
+            for line in process.stdout:
+                if line.startswith("Listening for commands on"):
+                    port = int(line.rsplit(':', 1)[1])
+                match = FIRST_AUDIO_LINE.search(line)
+                if match:
+                    wall_ms = (time.perf_counter() - launched) * 1000.0
+                    break
+            if port:
+                send_command('shutdown', port)
+            process.communicate(timeout=10)
+            if not match:
+                print("  headless TwinPlay exited without playing audio")
+                return 1
+            runs.append((wall_ms, float(match.group(2)), float(match.group(1))))
+
+    for label, selected in (("cold cache", runs[:1]), ("warm cache", runs[1:])):
+        if not selected:
+            continue
+        wall, launch, start = (np.mean(column) for column in zip(*selected))
+        print(f"  {label}: first audio {wall:4.0f} ms after spawning the process, {launch:4.0f} ms after "
+              f"TwinPlay's imports, {start:3.0f} ms after the route started")
+
+# name -> (description, function(sim, outage seconds) that injects the fault)
+RECOVERY_FAULTS = {
+    'unplug': ("secondary unplugged, then plugged back in",
+               lambda sim, outage: (sim.disconnect(2), sim.sleep(outage), sim.reconnect(2))),
+    'output-stall': ("secondary stops consuming audio", lambda sim, outage: sim.stall(2, outage)),
+    'format': ("secondary switched from 48 to 44.1 kHz", lambda sim, outage: sim.change_format(2, 44100)),
+    'capture-unplug': ("loopback stream dies, then comes back",
+                       lambda sim, outage: (sim.disconnect(1), sim.sleep(outage), sim.reconnect(1))),
+}
+
+def bench_recovery(args):
+    """Injects device faults into a running route and measures how long it takes to recover."""
+    print(f"Recovery from device faults, {args.outage:g} s outages, stall timeout {args.stall_timeout:g} s")
+    for fault, (description, inject) in RECOVERY_FAULTS.items():
+        sim = SimulatedAudio()
+        with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as folder:
+            router = AudioRouter(0, [2, 3], backend=lambda: sim, stall_timeout_s=args.stall_timeout,
+                                 capabilities=CapabilityCache(os.path.join(folder, 'devices.json')))
+            router.start_routing()
+            sim.sleep(1.5)
+            bystander = next(s for s in router.sinks if s.device_index == 3)
+            underruns_before = bystander.metrics()['underruns']
+
+            inject(sim, args.outage)
+            deadline = time.perf_counter() + args.outage + 10.0
+            while not router.recoveries and time.perf_counter() < deadline:
+                time.sleep(0.01)
+            sim.sleep(1.0)
+            bystander = next(s for s in router.sinks if s.device_index == 3)
+            bystander_underruns = bystander.metrics()['underruns'] - underruns_before
+            recoveries = router.get_recoveries()
+            router.shutdown()
+
+        if not recoveries:
+            print(f"  {fault:<14} {description}: did not recover")
+            continue
+        first = recoveries[0]
+        print(f"  {fault:<14} {description}: recovered in {first['recovery_ms']:.0f} ms "
+              f"({first['attempts']} attempts, {len(recoveries)} streams reopened), "
+              f"other output: {bystander_underruns} underruns")
+
+# Loopback rate, output rate, loopback channels, output channels, sample format name (None for native)
+ALLOC_CHECK_SCENARIOS = {
+    'passthrough': (48000, 48000, 2, 2, None),
+    'resample': (44100, 48000, 2, 2, None),
+    'downmix': (48000, 48000, 6, 2, None),
+    'resample+upmix': (44100, 48000, 2, 6, None),
+    'int16': (48000, 48000, 2, 2, 'int16'),
+    'int24 resample': (44100, 48000, 2, 2, 'int24'),
+}
+# Down to the smallest block the low latency profile uses, where per-block overhead weighs most
+ALLOC_CHECK_BLOCKS = (64, 256, 1024)
+# Frames of traceback kept per allocation, enough to tell TwinPlay's from numpy's own wrappers
+ALLOC_CHECK_FRAMES = 8
+# Size of the largest Python float or int a counter holds
+ALLOC_CHECK_NUMBER_BYTES = 32
+# Blocks run before measuring, long enough to prime the drift cushion and fill every cache
+ALLOC_CHECK_WARMUP = 500
+
+def alloc_check_budget(block, in_channels, out_channels):
+    """Bytes of one float32 block on the narrower side of a route: the smallest audio buffer
+    the path handles. A per-block peak has to stay below it, so no copy of a block fits."""
+    return block * min(in_channels, out_channels) * 4
+
+def check_allocations(block, in_rate, out_rate, in_channels, out_channels, sample_format, blocks):
+    """Memory allocated by the capture callback and one render, once they have warmed up.
+
+    Returns (largest peak of a single callback or render, growth over the second half of
+    the blocks) in bytes. Like measure_allocations() this runs both on this thread without
+    streams, but measures each on its own: on devices they run on different threads. Growth
+    only counts memory allocated from TwinPlay, not tracemalloc's own or this loop's.
+    """
+    devices = [
+        {'name': 'Speakers', 'maxOutputChannels': in_channels, 'defaultSampleRate': float(in_rate)},
+        {'name': 'Speakers [Loopback]', 'maxInputChannels': in_channels, 'defaultSampleRate': float(in_rate),
+         'isLoopbackDevice': True},
+        {'name': 'Headphones', 'maxOutputChannels': out_channels, 'defaultSampleRate': float(out_rate)},
+    ]
+    sim = SimulatedAudio(devices)
+    with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as folder:
+        capabilities = CapabilityCache(os.path.join(folder, 'devices.json'))
+        router = AudioRouter(0, [], frames_per_buffer=block, backend=lambda: sim, capabilities=capabilities,
+                             sample_format=FORMATS_BY_NAME.get(sample_format))
+        sink = router.add_sink(2, channels=out_channels)
+        noise = np.random.default_rng(0).uniform(-0.25, 0.25, (block, in_channels)).astype(np.float32)
+        in_data = bytes(SampleEncoder(router.common_format, in_channels, block).encode(noise))
+        buffers = sink._render_buffers()
+        for _ in range(ALLOC_CHECK_WARMUP):
+            router._audio_callback(in_data, block, None, 0)
+            sink._render(*buffers)
+
+        steps = ((router._audio_callback, (in_data, block, None, 0)), (sink._render, buffers))
+        tracemalloc.start(ALLOC_CHECK_FRAMES)
+        worst = 0
+        for i in range(blocks):
+            if i == blocks // 2:
+                halfway = tracemalloc.take_snapshot()
+            for step, step_args in steps:
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                step(*step_args)
+                worst = max(worst, tracemalloc.get_traced_memory()[1] - before)
+        end = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        router.shutdown()
+
+    return worst, held_bytes(end) - held_bytes(halfway)
+
+def held_bytes(snapshot):
+    """Bytes held by allocations made from TwinPlay, leaving out lone Python numbers.
+
+    Counters and estimates are replaced by new numbers as they change, so a float or an int
+    can come and go between snapshots without anything accumulating.
+    """
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(True, TwinPlay.__file__, all_frames=True)])
+    return sum(trace.size for trace in snapshot.traces if trace.size > ALLOC_CHECK_NUMBER_BYTES)
+
+def bench_formats(args):
+    """Reports CPU time per second of audio to decode each capture format and encode each output format."""
+    rate = 48000
+    blocks = int(args.seconds * rate / args.block)
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, (args.block, args.channels)).astype(np.float32)
+    audio_seconds = blocks * args.block / rate
+    dither = 'off' if args.no_dither else 'on'
+    print(f"Sample format conversion, {args.channels} channel(s), {args.block}-frame blocks, "
+          f"{args.seconds}s of {rate} Hz audio per pair, dither {dither}")
+    print(f"  {'capture -> output':<20} {'decode ms/s':>11} {'encode ms/s':>11} {'total ms/s':>10} {'realtime':>9}")
+    for capture_format in NATIVE_FORMATS:
+        data = bytes(SampleEncoder(capture_format, args.channels, args.block).encode(audio))
+        decoder = SampleDecoder(capture_format, args.channels, args.block)
+        decoder.decode(data)
+        start = time.process_time()
+        for _ in range(blocks):
+            decoded = decoder.decode(data)
+        decode_ms = (time.process_time() - start) * 1000.0 / audio_seconds
+
+        for output_format in NATIVE_FORMATS:
+            encoder = SampleEncoder(output_format, args.channels, args.block, dither=not args.no_dither)
+            encoder.encode(decoded)
+            start = time.process_time()
+            for _ in range(blocks):
+                encoder.encode(decoded)
+            encode_ms = (time.process_time() - start) * 1000.0 / audio_seconds
+            total_ms = decode_ms + encode_ms
+            pair = f"{FORMAT_NAMES[capture_format]} -> {FORMAT_NAMES[output_format]}"
+            print(f"  {pair:<20} {decode_ms:>11.2f} {encode_ms:>11.2f} {total_ms:>10.2f} "
+                  f"{1000.0 / total_ms if total_ms else float('inf'):>8.0f}x")
+
+def bench_alloc_check(args):
+    """Fails if the per-block audio path allocates buffers or keeps memory it allocated.
+
+    A few hundred bytes of array views and Python numbers per block are unavoidable, they
+    stay below the budget of one block of audio. Anything audio-sized (a copy of a block, a
+    temporary the size of a filter window) goes over it, and nothing may accumulate.
+    """
+    print(f"Allocation check, {args.blocks} blocks per scenario, budget one float32 block")
+    failed = False
+    for block in args.block:
+        print(f"  {block}-frame blocks")
+        for name, (in_rate, out_rate, in_channels, out_channels, sample_format) in ALLOC_CHECK_SCENARIOS.items():
+            worst, growth = check_allocations(block, in_rate, out_rate, in_channels, out_channels, sample_format,
+                                              args.blocks)
+            budget = alloc_check_budget(block, in_channels, out_channels)
+            ok = worst < budget and growth <= 0
+            failed = failed or not ok
+            label = f"{name} ({in_rate}->{out_rate} Hz, {in_channels}->{out_channels} ch)"
+            print(f"    {label:<44} peak {worst:5d} of {budget:5d} B, growth {growth:5d} B  {'ok' if ok else 'FAIL'}")
+    return 1 if failed else 0
+
+# Longer than the safe profile's latency, so every click is paired with the one that caused it
+PROFILE_CLICK_PERIOD_S = 1.0
+
+def run_latency_profile(profile, seconds, device_ms, jitter_ms):
+    """Routes clicks to a simulated headphone under a latency profile and measures what it achieves."""
+    devices = [
+        {'name': 'Speakers', 'maxOutputChannels': 2, 'defaultSampleRate': 48000.0},
+        {'name': 'Speakers [Loopback]', 'maxInputChannels': 2, 'defaultSampleRate': 48000.0,
+         'isLoopbackDevice': True},
+        {'name': 'Headphones', 'maxOutputChannels': 2, 'defaultSampleRate': 48000.0, 'skewPpm': 50.0,
+         'bufferMs': device_ms, 'jitterMs': jitter_ms},
+    ]
+    sim = SimulatedAudio(devices, record_outputs=True)
+    clicks = []
+    sim.source = click_source(sim, clicks, period_s=PROFILE_CLICK_PERIOD_S)
+
+    with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as folder:
+        capabilities = CapabilityCache(os.path.join(folder, 'devices.json'))
+        router = AudioRouter(0, [2], backend=lambda: sim, capabilities=capabilities, latency_profile=profile)
+        router.start_routing()
+        sim.sleep(ROUTING_WARMUP_S)
+        measure_from = sim.now()
+        reported = []
+        while sim.now() - measure_from < seconds:
+            sim.sleep(0.25)
+            reported.extend(router.achieved_latency_ms().values())
+        snapshot = router.snapshot()
+        router.shutdown()
+
+    sink = next(iter(snapshot['sinks'].values()))
+    latencies = []
+    for heard in find_clicks(sim.recordings.get(2, []), sink['sample_rate'], PROFILE_CLICK_PERIOD_S):
+        captured = [c for c in clicks if c <= heard]
+        if heard >= measure_from and captured and heard - captured[-1] < PROFILE_CLICK_PERIOD_S:
+            latencies.append((heard - captured[-1]) * 1000.0)
+    return {
+        'capture_frames': snapshot['capture']['frames_per_buffer'],
+        'output_frames': sink['frames_per_buffer'],
+        'output_mode': sink['output_mode'],
+        'latency_ms_mean': float(np.mean(latencies)) if latencies else None,
+        'latency_ms_max': float(np.max(latencies)) if latencies else None,
+        'reported_ms': float(np.mean(reported)) if reported else None,
+        'underruns': sink['underruns'] + sink['output_underflows'],
+        'block_changes': len(snapshot['block_changes']),
+    }
+
+def bench_latency(args):
+    """Compares the latency profiles: block sizes chosen, latency achieved, and glitches."""
+    print(f"Latency profiles, {args.seconds:g}s of clicks to a {args.device_ms:g} ms device buffer "
+          f"with {args.jitter_ms:g} ms of callback jitter")
+    print(f"  {'profile':<9} {'blocks':>11} {'output':>9} {'heard ms':>9} {'max ms':>7} {'reported':>9} "
+          f"{'underruns':>9} {'resized':>7}")
+    for profile in LATENCY_PROFILES:
+        r = run_latency_profile(profile, args.seconds, args.device_ms, args.jitter_ms)
+        fmt = lambda value: f"{value:.1f}" if value is not None else "-"
+        blocks = f"{r['capture_frames']}/{r['output_frames']}"
+        print(f"  {profile:<9} {blocks:>11} {r['output_mode']:>9} {fmt(r['latency_ms_mean']):>9} "
+              f"{fmt(r['latency_ms_max']):>7} {fmt(r['reported_ms']):>9} {r['underruns']:>9} {r['block_changes']:>7}")
+
+def run_mix(sources, block, blocks, source_rate):
+    """CPU time and allocations of one sink mixing `sources` extra loopbacks into the primary.
+
+    Drives every capture callback and the sink's render on this thread, like
+    check_allocations(), so the numbers are the mixing path alone.
+    """
+    devices = [
+        {'name': 'Speakers', 'maxOutputChannels': 2, 'defaultSampleRate': 48000.0},
+        {'name': 'Speakers [Loopback]', 'maxInputChannels': 2, 'defaultSampleRate': 48000.0,
+         'isLoopbackDevice': True},
+        {'name': 'Headphones', 'maxOutputChannels': 2, 'defaultSampleRate': 48000.0},
+    ]
+    for i in range(sources):
+        devices.append({'name': f"Source {i + 1}", 'maxOutputChannels': 2, 'defaultSampleRate': float(source_rate)})
+        devices.append({'name': f"Source {i + 1} [Loopback]", 'maxInputChannels': 2,
+                        'defaultSampleRate': float(source_rate), 'isLoopbackDevice': True})
+    sim = SimulatedAudio(devices)
+    with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as folder:
+        capabilities = CapabilityCache(os.path.join(folder, 'devices.json'))
+        router = AudioRouter(0, [], frames_per_buffer=block, backend=lambda: sim, capabilities=capabilities,
+                             sources=[(3 + 2 * i, 0.5) for i in range(sources)])
+        sink = router.add_sink(2)
+        noise = np.random.default_rng(0).uniform(-0.5, 0.5, (block, 2)).astype(np.float32)
+        in_data = bytes(SampleEncoder(router.common_format, 2, block).encode(noise))
+        callbacks = [router._source_callback(i) for i in range(sources)]
+        source_data = []
+        for source in router.sources:
+            frames = block * source.sample_rate // router.loopback_sample_rate
+            source_data.append((bytes(SampleEncoder(source.sample_format, 2, frames).encode(noise[:frames])), frames))
+        buffers = sink._render_buffers()
+
+        def one_block():
+            router._audio_callback(in_data, block, None, 0)
+            for callback, (data, frames) in zip(callbacks, source_data):
+                callback(data, frames, None, 0)
+            sink._render(*buffers)
+
+        for _ in range(ALLOC_CHECK_WARMUP):
+            one_block()
+        start = time.process_time()
+        for _ in range(blocks):
+            one_block()
+        cpu_s = time.process_time() - start
+
+        tracemalloc.start()
+        worst = 0
+        for _ in range(min(blocks, 1000)):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            one_block()
+            worst = max(worst, tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        metrics = sink.metrics()
+        router.shutdown()
+    audio_s = blocks * block / 48000
+    return {
+        'cpu_ms_per_s': cpu_s * 1000.0 / audio_s,
+        'alloc_peak_bytes': worst,
+        'limited_blocks': metrics.get('limited_blocks', 0),
+    }
+
+def bench_mix(args):
+    """Cost of mixing extra loopback sources into a sink, from none up to --sources."""
+    blocks = int(args.seconds * 48000 / args.block)
+    print(f"Multi-source mixing, {args.block}-frame blocks, {args.seconds:g}s of 48000 Hz stereo per run, "
+          f"sources at {args.source_rate} Hz")
+    print(f"  {'sources':>7} {'ms/s':>8} {'realtime':>9} {'alloc B/block':>13} {'limited':>8}")
+    for sources in range(args.sources + 1):
+        r = run_mix(sources, args.block, blocks, args.source_rate)
+        realtime = 1000.0 / r['cpu_ms_per_s'] if r['cpu_ms_per_s'] else float('inf')
+        print(f"  {sources:>7} {r['cpu_ms_per_s']:>8.2f} {realtime:>8.0f}x {r['alloc_peak_bytes']:>13} "
+              f"{r['limited_blocks']:>8}")
+
+def burn(seconds):
+    """Pure-Python busy work that holds the GIL, like a Tk redraw or a DSP stage written in Python."""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(200))
+
+def start_load(load, stop, gui_ms, gui_period_ms, cpu_threads):
+    """Threads in this process that keep it busy until `stop` is set."""
+    def gui():
+        while not stop.is_set():
+            burn(gui_ms / 1000.0)
+            stop.wait(max(gui_period_ms - gui_ms, 0) / 1000.0)
+    def cpu():
+        while not stop.is_set():
+            burn(0.05)
+    targets = {'none': [], 'gui': [gui], 'gui+cpu': [gui] + [cpu] * cpu_threads}[load]
+    threads = [threading.Thread(target=target, daemon=True) for target in targets]
+    for thread in threads:
+        thread.start()
+    return threads
+
+@contextlib.contextmanager
+def settings_folder(folder):
+    """Points APPDATA, and with it TwinPlay's settings and device cache, at `folder` for a while.
+
+    Processes started meanwhile inherit it, so the simulated devices stay out of the real cache.
+    """
+    previous = os.environ.get('APPDATA')
+    os.environ['APPDATA'] = folder
+    try:
+        yield folder
+    finally:
+        if previous is None:
+            del os.environ['APPDATA']
+        else:
+            os.environ['APPDATA'] = previous
+
+def run_isolation(engine, load, seconds, gui_ms, gui_period_ms, cpu_threads):
+    """Capture callback jitter and output underruns of a simulated route while this process is loaded."""
+    stop = threading.Event()
+    threads = start_load(load, stop, gui_ms, gui_period_ms, cpu_threads)
+    with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as folder, \
+            settings_folder(folder):
+        if engine == 'process':
+            # The engine process opens its own device cache under APPDATA, which it inherits
+            router = RouterProcess(0, [2], backend='simulated')
+        else:
+            router = AudioRouter(0, [2], backend=lambda: create_backend('simulated'),
+                                 capabilities=CapabilityCache(os.path.join(folder, 'devices.json')))
+        try:
+            router.start_routing()
+            time.sleep(seconds)
+            snapshot = router.snapshot()
+        finally:
+            router.shutdown()
+            stop.set()
+            for thread in threads:
+                thread.join()
+    capture = snapshot['capture']
+    sinks = snapshot['sinks'].values()
+    return {
+        'jitter_p50_us': capture['jitter_p50_us'],
+        'jitter_p99_us': capture['jitter_p99_us'],
+        'jitter_max_us': capture['jitter_max_us'],
+        'callback_p99_us': capture['callback_p99_us'],
+        'underruns': sum(s['underruns'] + s['output_underflows'] for s in sinks),
+    }
+
+def bench_isolation(args):
+    """Capture callback jitter with the engine in this process vs. in its own, under synthetic load."""
+    print(f"Engine isolation, {args.seconds:g}s per run; GUI load {args.gui_ms:g} ms of Python every "
+          f"{args.gui_period_ms:g} ms, CPU load {args.cpu_threads} busy Python thread(s)")
+    print(f"  {'engine':<8} {'load':<8} {'jitter p50':>10} {'p99':>8} {'max':>8} {'callback p99':>12} {'underruns':>9}")
+    for load in ('none', 'gui', 'gui+cpu'):
+        for engine in ('thread', 'process'):
+            r = run_isolation(engine, load, args.seconds, args.gui_ms, args.gui_period_ms, args.cpu_threads)
+            fmt = lambda value: f"{value / 1000.0:.2f}" if value is not None else "-"
+            print(f"  {engine:<8} {load:<8} {fmt(r['jitter_p50_us']):>10} {fmt(r['jitter_p99_us']):>8} "
+                  f"{fmt(r['jitter_max_us']):>8} {fmt(r['callback_p99_us']):>12} {r['underruns']:>9}")
+    print("  (times in ms)")
+
+# (extension, sample format) of each recording throughput run. FLAC needs soundfile
+RECORD_FORMATS = [('wav', 'int16'), ('wav', 'int24'), ('wav', 'float32'), ('flac', 'int16'), ('flac', 'int24')]
+
+def run_record_throughput(extension, sample_format, seconds, block, flush_s, folder):
+    """Pushes `seconds` of 48 kHz stereo through a RecordingTap as fast as its writer takes it."""
+    noise = np.random.default_rng(0).uniform(-0.5, 0.5, (block, 2)).astype(np.float32)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tap = RecordingTap(os.path.join(folder, f"throughput.{extension}"), 48000, 2,
+                           sample_format=FORMATS_BY_NAME[sample_format], flush_s=flush_s)
+        blocks = int(seconds * 48000 / block)
+        started = time.perf_counter()
+        tap.start()
+        for _ in range(blocks):
+            while tap.buffer.free() < block:
+                time.sleep(0.001) # Wait for the writer instead of dropping, this measures the writer
+            tap.push(noise)
+        tap.stop()
+        elapsed = time.perf_counter() - started
+    size = os.path.getsize(tap.files[0])
+    return {
+        'mb_per_s': size / elapsed / 1e6,
+        'realtime': seconds / elapsed,
+        'file_mb': size / 1e6,
+        'batch_p99_ms': tap.batch_timer.summary().get('p99_us', 0.0) / 1000.0,
+    }
+
+def run_record_impact(taps, seconds, folder, queue_ms):
+    """Capture callback and render times of a simulated route while `taps` recordings run."""
+    sim = SimulatedAudio()
+    with contextlib.redirect_stdout(io.StringIO()):
+        router = AudioRouter(0, [2], backend=lambda: sim,
+                             capabilities=CapabilityCache(os.path.join(folder, 'devices.json')))
+        router.start_routing()
+        for i in range(taps):
+            router.add_tap(os.path.join(folder, f"impact{i}.wav"), 'capture' if i % 2 == 0 else 2, queue_ms=queue_ms)
+        sim.sleep(seconds)
+        snapshot = router.snapshot()
+        router.shutdown()
+    sink = next(iter(snapshot['sinks'].values()))
+    return {
+        'callback_p50_us': snapshot['capture']['callback_p50_us'],
+        'callback_p99_us': snapshot['capture']['callback_p99_us'],
+        'render_p99_us': sink['render_p99_us'],
+        'underruns': sink['underruns'],
+        'dropped_blocks': sum(tap['dropped_blocks'] for tap in snapshot['taps']),
+    }
+
+def bench_record(args):
+    """Sustained write throughput of a recording tap, and what recording costs the audio threads."""
+    print(f"Recording throughput, {args.seconds:g}s of 48000 Hz stereo in {args.block}-frame blocks, "
+          f"flushed every {args.flush_s * 1000:g} ms")
+    print(f"  {'file':<14} {'MB/s':>8} {'realtime':>9} {'size MB':>8} {'batch p99 ms':>12}")
+    with tempfile.TemporaryDirectory() as folder:
+        for extension, sample_format in RECORD_FORMATS:
+            label = f"{extension} {sample_format}"
+            try:
+                r = run_record_throughput(extension, sample_format, args.seconds, args.block, args.flush_s, folder)
+            except Exception as e:
+                print(f"  {label:<14} skipped: {e}")
+                continue
+            print(f"  {label:<14} {r['mb_per_s']:>8.1f} {r['realtime']:>8.0f}x {r['file_mb']:>8.1f} "
+                  f"{r['batch_p99_ms']:>12.2f}")
+
+        print(f"Callback impact, {args.impact_seconds:g}s of a simulated route per run")
+        print(f"  {'taps':<22} {'callback p50 us':>15} {'p99 us':>8} {'render p99 us':>13} {'underruns':>9} "
+              f"{'dropped':>7}")
+        runs = [('none', 0, 2000), ('capture + output', 2, 2000),
+                ('tiny queue (50 ms)', 2, 50)] # The writer can't keep up with 50 ms between 500 ms flushes
+        for label, taps, queue_ms in runs:
+            r = run_record_impact(taps, args.impact_seconds, folder, queue_ms)
+            print(f"  {label:<22} {r['callback_p50_us']:>15.0f} {r['callback_p99_us']:>8.0f} "
+                  f"{r['render_p99_us']:>13.0f} {r['underruns']:>9} {r['dropped_blocks']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description="TwinPlay engine benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    resample = subparsers.add_parser('resample', help="sample-rate conversion cost per rate pair")
+    resample.add_argument('--seconds', type=float, default=10.0)
+    resample.add_argument('--channels', type=int, default=2)
+    resample.add_argument('--block', type=int, default=1024)
+    resample.set_defaults(func=bench_resample)
+
+    routing = subparsers.add_parser('routing', help="per-block cost, latency and glitches of the routing pipeline")
+    routing.add_argument('--blocks', default='64,256,1024,4096', help="comma-separated frames per buffer")
+    routing.add_argument('--rates', default='48000:48000,44100:48000', help="comma-separated loopback:output rates")
+    routing.add_argument('--channels', default='2', help="comma-separated loopback channel counts")
+    routing.add_argument('--seconds', type=float, default=5.0)
+    routing.add_argument('--speed', type=float, default=1.0, help="simulated device clocks run this much faster")
+    routing.add_argument('--output', help="write the results as JSON")
+    routing.add_argument('--baseline', help="JSON from an earlier run, exit with 1 on regressions")
+    routing.set_defaults(func=bench_routing)
+
+    probe = subparsers.add_parser('probe', help="device capability probing, cold and warm cache")
+    probe.add_argument('--outputs', type=int, default=12, help="simulated output devices, each with a loopback")
+    probe.add_argument('--open-ms', type=float, default=30.0, help="time a driver takes to open a stream")
+    probe.add_argument('--query-ms', type=float, default=2.0, help="time a format query takes")
+    probe.set_defaults(func=bench_probe)
+
+    session = subparsers.add_parser('session', help="route start/stop and device switch time")
+    session.add_argument('--cycles', type=int, default=5)
+    session.add_argument('--outputs', type=int, default=12, help="simulated output devices, each with a loopback")
+    session.add_argument('--init-ms', type=float, default=300.0, help="time PortAudio takes to start up")
+    session.add_argument('--open-ms', type=float, default=30.0, help="time a driver takes to open a stream")
+    session.set_defaults(func=bench_session)
+
+    recovery = subparsers.add_parser('recovery', help="time to recover from unplugged, stalled and reformatted devices")
+    recovery.add_argument('--outage', type=float, default=1.0, help="seconds each device stays gone or stalled")
+    recovery.add_argument('--stall-timeout', type=float, default=1.0)
+    recovery.set_defaults(func=bench_recovery)
+
+    startup = subparsers.add_parser('startup', help="headless launch to first audio, cold and warm cache")
+    startup.add_argument('--runs', type=int, default=4)
+    startup.add_argument('--latency-ms', type=float, default=60.0)
+    startup.set_defaults(func=bench_startup)
+
+    formats = subparsers.add_parser('formats', help="sample format conversion cost per capture/output format pair")
+    formats.add_argument('--seconds', type=float, default=10.0)
+    formats.add_argument('--channels', type=int, default=2)
+    formats.add_argument('--block', type=int, default=1024)
+    formats.add_argument('--no-dither', action='store_true', help="measure integer outputs without dither")
+    formats.set_defaults(func=bench_formats)
+
+    alloc_check = subparsers.add_parser('alloc-check', help="fail if the per-block audio path allocates buffers")
+    alloc_check.add_argument('--block', type=int, nargs='+', default=list(ALLOC_CHECK_BLOCKS))
+    alloc_check.add_argument('--blocks', type=int, default=2000)
+    alloc_check.set_defaults(func=bench_alloc_check)
+
+    latency = subparsers.add_parser('latency', help="block sizes and latency achieved by each latency profile")
+    latency.add_argument('--seconds', type=float, default=5.0)
+    latency.add_argument('--device-ms', type=float, default=20.0, help="device buffer, which sets its reported latency")
+    latency.add_argument('--jitter-ms', type=float, default=0.0, help="random lateness of every output callback")
+    latency.set_defaults(func=bench_latency)
+
+    mix = subparsers.add_parser('mix', help="CPU and allocations of mixing extra loopback sources into a sink")
+    mix.add_argument('--sources', type=int, default=4)
+    mix.add_argument('--block', type=int, default=1024)
+    mix.add_argument('--seconds', type=float, default=10.0)
+    mix.add_argument('--source-rate', type=int, default=48000, help="rate of the extra sources' loopbacks")
+    mix.set_defaults(func=bench_mix)
+
+    isolation = subparsers.add_parser('isolation', help="capture callback jitter under load, engine in-process vs. out-of-process")
+    isolation.add_argument('--seconds', type=float, default=5.0)
+    isolation.add_argument('--gui-ms', type=float, default=8.0, help="Python work per simulated GUI redraw")
+    isolation.add_argument('--gui-period-ms', type=float, default=16.0, help="time between simulated GUI redraws")
+    isolation.add_argument('--cpu-threads', type=int, default=1, help="busy Python threads added for the gui+cpu load")
+    isolation.set_defaults(func=bench_isolation)
+
+    record = subparsers.add_parser('record', help="recording tap write throughput and its cost to the audio threads")
+    record.add_argument('--seconds', type=float, default=120.0, help="audio pushed per throughput run")
+    record.add_argument('--block', type=int, default=1024)
+    record.add_argument('--flush-s', type=float, default=0.01, help="writer interval for the throughput runs")
+    record.add_argument('--impact-seconds', type=float, default=4.0)
+    record.set_defaults(func=bench_record)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
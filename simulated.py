@@ -0,0 +1,448 @@
+"""Hardware-free stand-in for PyAudio, for tests, benchmarks and running TwinPlay without sound hardware.
+
+Select it with `--backend simulated` or TWINPLAY_BACKEND=simulated, or give AudioSession and
+AudioRouter a backend factory that returns a SimulatedAudio.
+"""
+import threading
+import time
+
+import numpy as np
+
+from TwinPlay import SAMPLE_SIZES, pyaudio
+
+def _simulated_encode(samples, sample_format):
+    """float (frames, channels) in [-1, 1] to interleaved bytes."""
+    samples = np.clip(samples, -1.0, 1.0)
+    if sample_format == pyaudio.paFloat32:
+        return samples.astype('<f4').tobytes()
+    if sample_format == pyaudio.paInt32:
+        return (samples * 2147483647).astype('<i4').tobytes()
+    if sample_format == pyaudio.paInt24:
+        as_int32 = (samples * 8388607).astype('<i4').reshape(-1, 1).view(np.uint8)
+        return as_int32[:, :3].tobytes()
+    return (samples * 32767).astype('<i2').tobytes()
+
+def _simulated_decode(data, sample_format, channels):
+    """Interleaved bytes to float (frames, channels) in [-1, 1]."""
+    if sample_format == pyaudio.paFloat32:
+        samples = np.frombuffer(data, dtype='<f4').astype(np.float32)
+    elif sample_format == pyaudio.paInt32:
+        samples = np.frombuffer(data, dtype='<i4') / 2147483648.0
+    elif sample_format == pyaudio.paInt24:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(raw), 4), dtype=np.uint8)
+        padded[:, 1:] = raw
+        samples = padded.view('<i4')[:, 0] / 2147483648.0
+    else:
+        samples = np.frombuffer(data, dtype='<i2') / 32768.0
+    return samples.reshape(-1, channels)
+
+def default_simulated_devices():
+    """A typical setup: speakers with their loopback, a Bluetooth headset, headphones and a mic."""
+    return [
+        {'name': 'Speakers (Realtek High Definition Audio)', 'maxOutputChannels': 2, 'defaultSampleRate': 48000.0},
+        {'name': 'Speakers (Realtek High Definition Audio) [Loopback]', 'maxInputChannels': 2,
+         'defaultSampleRate': 48000.0, 'isLoopbackDevice': True},
+        {'name': 'Headset (Bluetooth Hands-Free)', 'maxOutputChannels': 2, 'defaultSampleRate': 48000.0,
+         'skewPpm': 80.0, 'jitterMs': 4.0, 'bufferMs': 60.0},
+        {'name': 'Headphones (USB Audio)', 'maxOutputChannels': 2, 'defaultSampleRate': 44100.0, 'skewPpm': -35.0},
+        {'name': 'Microphone (USB Audio)', 'maxInputChannels': 1, 'defaultSampleRate': 44100.0, 'skewPpm': -35.0},
+    ]
+
+def sine_source(frequency=440.0, level=0.25):
+    """Signal generator for simulated inputs: the same sine on every channel."""
+    def source(device, start_frame, frames, channels, rate):
+        t = np.arange(start_frame, start_frame + frames) / rate
+        tone = (level * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+        return np.repeat(tone[:, None], channels, axis=1)
+    return source
+
+class SimulatedAudio:
+    """Hardware-free stand-in for pyaudio.PyAudio, for tests and benchmarks.
+
+    Devices are dicts shaped like PyAudio's device info, plus simulation settings:
+        skewPpm         how far the device clock is off, positive runs fast
+        jitterMs        random lateness added to every callback
+        bufferMs        device buffer, which is also the reported stream latency
+        supportedRates  rates open() accepts, defaults to the native rate only (like WASAPI)
+        sampleFormats   PortAudio sample formats open() accepts, defaults to all of them
+    Everything runs `speed` times faster than real time. stall(), disconnect() and
+    set_default_output() inject the trouble that real hardware causes. Closing a stream
+    while another thread is blocked writing to it, which can crash real PortAudio, is
+    counted in unsafe_closes.
+    """
+    # Format queries only read device settings, so CapabilityCache may run them in parallel
+    thread_safe_queries = True
+
+    def __init__(self, devices=None, speed=1.0, seed=0, default_output_index=0, open_latency=0.0,
+                 source=None, record_outputs=False, query_latency=0.0, init_latency=0.0):
+        # Real seconds PortAudio takes to start up and enumerate the devices
+        if init_latency:
+            time.sleep(init_latency)
+        self.speed = speed
+        self.rng = np.random.default_rng(seed)
+        self.default_output_index = default_output_index
+        self.open_latency = open_latency # Real seconds every open() takes, like a slow driver
+        self.query_latency = query_latency # Real seconds every is_format_supported() takes
+        self.opens = 0
+        self.queries = 0
+        self.unsafe_closes = 0
+        self.source = source or sine_source()
+        self.record_outputs = record_outputs
+        self.recordings = {} # Output device index -> [(simulated time it plays, float block)]
+        self.streams = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+        self.devices = []
+        for index, device in enumerate(devices if devices is not None else default_simulated_devices()):
+            device = dict(device)
+            device['index'] = index
+            device.setdefault('hostApi', 0)
+            device.setdefault('maxInputChannels', 0)
+            device.setdefault('maxOutputChannels', 0)
+            device.setdefault('defaultSampleRate', 48000.0)
+            device.setdefault('isLoopbackDevice', False)
+            device.setdefault('bufferMs', 20.0)
+            device.setdefault('defaultLowOutputLatency', device['bufferMs'] / 2000.0)
+            device.setdefault('defaultHighOutputLatency', device['bufferMs'] / 1000.0 * 4)
+            device.setdefault('defaultLowInputLatency', device['bufferMs'] / 2000.0)
+            device.setdefault('defaultHighInputLatency', device['bufferMs'] / 1000.0 * 4)
+            device.setdefault('supportedRates', [int(device['defaultSampleRate'])])
+            device.setdefault('sampleFormats', list(SAMPLE_SIZES))
+            device.setdefault('skewPpm', 0.0)
+            device.setdefault('jitterMs', 0.0)
+            device['connected'] = True
+            device['stalls'] = [] # (start, end) windows in simulated seconds
+            self.devices.append(device)
+
+    # Simulated time
+
+    def now(self):
+        return (time.perf_counter() - self._origin) * self.speed
+
+    def sleep(self, seconds):
+        """Sleeps for `seconds` of simulated time."""
+        if seconds > 0:
+            time.sleep(seconds / self.speed)
+
+    def device_frames(self, device, since, until):
+        """Frames the device clock ticks between two simulated times, net of stalls."""
+        elapsed = until - since
+        for start, end in device['stalls']:
+            elapsed -= max(0.0, min(end, until) - max(start, since))
+        return max(0.0, elapsed) * device['defaultSampleRate'] * (1.0 + device['skewPpm'] * 1e-6)
+
+    # Trouble injection
+
+    def stall(self, device_index, seconds):
+        """Freezes a device's clock for `seconds` of simulated time, starting now."""
+        now = self.now()
+        self.devices[device_index]['stalls'].append((now, now + seconds))
+
+    def disconnect(self, device_index):
+        """Unplugs a device: its streams go inactive and further I/O raises OSError."""
+        self.devices[device_index]['connected'] = False
+
+    def reconnect(self, device_index):
+        self.devices[device_index]['connected'] = True
+
+    def change_format(self, device_index, rate, channels=None):
+        """Changes a device's native format, which invalidates its open streams like WASAPI does."""
+        device = self.devices[device_index]
+        device['defaultSampleRate'] = float(rate)
+        device['supportedRates'] = [int(rate)]
+        if channels is not None:
+            device['maxInputChannels' if device['maxInputChannels'] else 'maxOutputChannels'] = channels
+        with self._lock:
+            for stream in self.streams:
+                if stream.device is device:
+                    stream.invalidated = True
+                    stream.active = False
+
+    def set_default_output(self, device_index):
+        self.default_output_index = device_index
+
+    # PyAudio API
+
+    def get_device_count(self):
+        return len(self.devices)
+
+    def get_device_info_by_index(self, device_index):
+        if not 0 <= device_index < len(self.devices):
+            raise OSError(f"[Errno -9996] Invalid device index: {device_index}")
+        device = self.devices[device_index]
+        return {key: value for key, value in device.items() if key not in ('stalls', 'connected')}
+
+    def get_host_api_count(self):
+        return 1
+
+    def get_host_api_info_by_index(self, host_api_index):
+        if host_api_index != 0:
+            raise OSError(f"[Errno -9979] Invalid host api index: {host_api_index}")
+        return {
+            'index': 0,
+            'type': pyaudio.paWASAPI,
+            'name': 'Windows WASAPI',
+            'deviceCount': len(self.devices),
+            'defaultOutputDevice': self.default_output_index,
+            'defaultInputDevice': next((d['index'] for d in self.devices
+                                        if d['maxInputChannels'] > 0 and not d['isLoopbackDevice']), -1),
+        }
+
+    def get_host_api_info_by_type(self, host_api_type):
+        if host_api_type != pyaudio.paWASAPI:
+            raise OSError(f"[Errno -9979] Host API type not available: {host_api_type}")
+        return self.get_host_api_info_by_index(0)
+
+    def get_default_output_device_info(self):
+        return self.get_device_info_by_index(self.default_output_index)
+
+    def get_default_input_device_info(self):
+        index = self.get_host_api_info_by_index(0)['defaultInputDevice']
+        if index < 0:
+            raise OSError("[Errno -9996] No Default Input Device Available")
+        return self.get_device_info_by_index(index)
+
+    def get_sample_size(self, sample_format):
+        return SAMPLE_SIZES[sample_format]
+
+    def _check_format(self, device_index, rate, channels, sample_format, direction):
+        if device_index is None or not 0 <= device_index < len(self.devices):
+            raise ValueError("Invalid device")
+        device = self.devices[device_index]
+        if not device['connected']:
+            raise ValueError("Device unavailable")
+        if channels < 1 or channels > device[f'max{direction}Channels']:
+            raise ValueError("Invalid number of channels")
+        if int(rate) not in device['supportedRates']:
+            raise ValueError("Invalid sample rate")
+        if sample_format not in SAMPLE_SIZES or sample_format not in device['sampleFormats']:
+            raise ValueError("Sample format not supported")
+
+    def is_format_supported(self, rate, input_device=None, input_channels=None, input_format=None,
+                            output_device=None, output_channels=None, output_format=None):
+        self.queries += 1
+        if self.query_latency:
+            time.sleep(self.query_latency)
+        if input_device is not None:
+            self._check_format(input_device, rate, input_channels or 1, input_format or pyaudio.paInt16, 'Input')
+        if output_device is not None:
+            self._check_format(output_device, rate, output_channels or 1, output_format or pyaudio.paInt16, 'Output')
+        return True
+
+    def open(self, rate, channels, format, input=False, output=False, input_device_index=None,
+             output_device_index=None, frames_per_buffer=1024, start=True, stream_callback=None, **kwargs):
+        if input == output:
+            raise ValueError("Simulated streams are either input or output")
+        if input and input_device_index is None:
+            input_device_index = self.get_default_input_device_info()['index']
+        if output and output_device_index is None:
+            output_device_index = self.default_output_index
+        device_index = input_device_index if input else output_device_index
+        # Drivers take their time even to refuse a format
+        self.opens += 1
+        if self.open_latency:
+            time.sleep(self.open_latency)
+        try:
+            self._check_format(device_index, rate, channels, format, 'Input' if input else 'Output')
+        except ValueError as e:
+            raise OSError(f"[Errno -9997] {e}")
+
+        stream = SimulatedStream(self, self.devices[device_index], input, rate, channels, format,
+                                 frames_per_buffer, stream_callback)
+        with self._lock:
+            self.streams.append(stream)
+        if start:
+            stream.start_stream()
+        return stream
+
+    def terminate(self):
+        for stream in list(self.streams):
+            stream.close()
+
+class SimulatedStream:
+    """A stream on a SimulatedAudio device, with the same methods as pyaudio.Stream."""
+    def __init__(self, audio, device, is_input, rate, channels, sample_format, frames_per_buffer, callback):
+        self.audio = audio
+        self.device = device
+        self.is_input = is_input
+        self.rate = rate
+        self.channels = channels
+        self.sample_format = sample_format
+        self.frames_per_buffer = frames_per_buffer
+        self.callback = callback
+        # PortAudio double-buffers callback streams, blocking ones only need room for one write
+        self.buffer_frames = max(frames_per_buffer * (2 if callback else 1), int(rate * device['bufferMs'] / 1000.0))
+
+        self.active = False
+        self.closed = False
+        self.invalidated = False # The device changed format under this stream
+        self.thread = None
+        self.started_at = None
+        self.frames = 0 # Frames captured (input) or queued (output) so far
+        self.silence_frames = 0 # Device time an output spent starved
+        self.input_overflows = 0
+        self.output_underflows = 0
+        self.callbacks = 0
+        self.writing = 0 # Threads inside write() right now
+
+    def _device_position(self):
+        return self.audio.device_frames(self.device, self.started_at, self.audio.now()) - self.silence_frames
+
+    def _check_connected(self):
+        if not self.device['connected'] or self.invalidated:
+            self.active = False
+            raise OSError("[Errno -9999] Unanticipated host error")
+
+    def _wait_for_position(self, position):
+        """Sleeps until the device clock reaches `position` frames."""
+        frame_rate = self.rate * (1.0 + self.device['skewPpm'] * 1e-6)
+        while self.active and self.device['connected']:
+            missing = position - self._device_position()
+            if missing <= 0:
+                return True
+            self.audio.sleep(max(missing / frame_rate, 0.0005))
+        return False
+
+    def _note_underflow(self):
+        """A starved output plays silence, which pushes the rest of the stream later."""
+        lag = self._device_position() - self.frames
+        if lag > 0:
+            self.silence_frames += lag
+            self.output_underflows += 1
+            return pyaudio.paOutputUnderflow
+        return 0
+
+    def _record(self, data):
+        if self.audio.record_outputs:
+            # Remember when the block will reach the speaker: after everything queued before it
+            frame_rate = self.rate * (1.0 + self.device['skewPpm'] * 1e-6)
+            queued = max(0.0, self.frames - self._device_position())
+            plays_at = self.audio.now() + queued / frame_rate
+            block = _simulated_decode(data, self.sample_format, self.channels)
+            self.audio.recordings.setdefault(self.device['index'], []).append((plays_at, block))
+
+    def _time_info(self):
+        now = self.audio.now()
+        return {'input_buffer_adc_time': now, 'current_time': now, 'output_buffer_dac_time': now}
+
+    def _run_callbacks(self):
+        jitter_s = self.device['jitterMs'] / 1000.0
+        while self.active:
+            status = 0
+            if self.is_input:
+                if not self._wait_for_position(self.frames + self.frames_per_buffer):
+                    break
+                behind = self._device_position() - self.frames - self.frames_per_buffer
+                if behind >= self.frames_per_buffer:
+                    # The callback fell a whole buffer behind, the device dropped the oldest audio
+                    skipped = int(behind // self.frames_per_buffer) * self.frames_per_buffer
+                    self.frames += skipped
+                    self.input_overflows += 1
+                    status |= pyaudio.paInputOverflow
+                samples = self.audio.source(self.device, self.frames, self.frames_per_buffer, self.channels, self.rate)
+                in_data = _simulated_encode(samples, self.sample_format)
+            else:
+                # Ask for more as soon as a buffer's worth of room opens up in the device
+                if not self._wait_for_position(self.frames + self.frames_per_buffer - self.buffer_frames):
+                    break
+                status |= self._note_underflow()
+                in_data = None
+
+            if jitter_s:
+                self.audio.sleep(jitter_s * self.audio.rng.random())
+            self.callbacks += 1
+            out_data, flag = self.callback(in_data, self.frames_per_buffer, self._time_info(), status)
+
+            if self.is_input:
+                self.frames += self.frames_per_buffer
+            elif out_data:
+                self._record(out_data)
+                self.frames += len(out_data) // (SAMPLE_SIZES[self.sample_format] * self.channels)
+            if flag != pyaudio.paContinue:
+                break
+        self.active = False
+
+    # pyaudio.Stream API
+
+    def start_stream(self):
+        if self.active:
+            return
+        self._check_connected()
+        self.active = True
+        if self.started_at is None:
+            self.started_at = self.audio.now()
+        if self.callback:
+            self.thread = threading.Thread(target=self._run_callbacks, daemon=True)
+            self.thread.start()
+
+    def stop_stream(self):
+        self.active = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+        self.thread = None
+
+    def abort_stream(self):
+        """Stops at once. A write blocked on the stream returns with an error."""
+        self.stop_stream()
+
+    def close(self):
+        if self.writing:
+            self.audio.unsafe_closes += 1
+        self.stop_stream()
+        self.closed = True
+        with self.audio._lock:
+            if self in self.audio.streams:
+                self.audio.streams.remove(self)
+
+    def is_active(self):
+        return self.active and self.device['connected']
+
+    def is_stopped(self):
+        return not self.active
+
+    def get_time(self):
+        return self.audio.now()
+
+    def get_input_latency(self):
+        return self.buffer_frames / self.rate if self.is_input else 0.0
+
+    def get_output_latency(self):
+        return 0.0 if self.is_input else self.buffer_frames / self.rate
+
+    def get_read_available(self):
+        return max(0, int(self._device_position() - self.frames))
+
+    def get_write_available(self):
+        return max(0, int(self.buffer_frames - (self.frames - self._device_position())))
+
+    def read(self, num_frames, exception_on_overflow=True):
+        self._check_connected()
+        if not self._wait_for_position(self.frames + num_frames):
+            self._check_connected()
+        behind = self._device_position() - self.frames - num_frames
+        if behind >= self.buffer_frames:
+            self.input_overflows += 1
+            if exception_on_overflow:
+                raise OSError("[Errno -9981] Input overflowed")
+            self.frames += int(behind)
+        samples = self.audio.source(self.device, self.frames, num_frames, self.channels, self.rate)
+        self.frames += num_frames
+        return _simulated_encode(samples, self.sample_format)
+
+    def write(self, frames, num_frames=None, exception_on_underflow=False):
+        self._check_connected()
+        if num_frames is None:
+            num_frames = len(frames) // (SAMPLE_SIZES[self.sample_format] * self.channels)
+        self._note_underflow()
+        # Block while the device buffer is full, exactly like a blocking PortAudio write
+        self.writing += 1
+        try:
+            if not self._wait_for_position(self.frames + num_frames - self.buffer_frames):
+                self._check_connected()
+                raise OSError("[Errno -9983] Stream is stopped")
+        finally:
+            self.writing -= 1
+        self._record(frames)
+        self.frames += num_frames
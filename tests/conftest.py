@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# TwinPlay is a single module at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(autouse=True)
+def settings_folder(tmp_path, monkeypatch):
+    """Keeps calibration and the device cache of the simulated devices out of the real settings folder."""
+    monkeypatch.setenv('APPDATA', str(tmp_path))
+    return tmp_path
@@ -0,0 +1,11 @@
+"""Helpers for tests that run routes on the simulated backend."""
+import time
+
+def wait_until(condition, timeout=5.0):
+    """Polls `condition` until it is true. Returns whether it came true within `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
@@ -0,0 +1,7 @@
+"""Test signals shared by the DSP tests."""
+import numpy as np
+
+def sine(frequency, rate, frames, channels=2, level=0.5):
+    """A float32 tone, the same on every channel."""
+    t = np.arange(frames) / rate
+    return np.repeat((level * np.sin(2 * np.pi * frequency * t)).astype(np.float32)[:, None], channels, axis=1)
@@ -0,0 +1,12 @@
+"""The per-block audio path must not allocate audio buffers or hold on to memory."""
+import pytest
+
+from benchmark import ALLOC_CHECK_BLOCKS, ALLOC_CHECK_SCENARIOS, alloc_check_budget, check_allocations
+
+@pytest.mark.parametrize('block', ALLOC_CHECK_BLOCKS)
+@pytest.mark.parametrize('scenario', list(ALLOC_CHECK_SCENARIOS))
+def test_capture_and_render_stay_under_one_block(block, scenario):
+    in_rate, out_rate, in_channels, out_channels, sample_format = ALLOC_CHECK_SCENARIOS[scenario]
+    worst, growth = check_allocations(block, in_rate, out_rate, in_channels, out_channels, sample_format, 400)
+    assert worst < alloc_check_budget(block, in_channels, out_channels)
+    assert growth == 0
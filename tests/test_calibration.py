@@ -0,0 +1,55 @@
+"""Offset estimation by cross-correlation, and the delays calibration sets from the offsets."""
+import numpy as np
+import pytest
+
+from TwinPlay import AudioRouter, create_backend, estimate_offsets, saved_delay
+from helpers import wait_until
+
+@pytest.mark.parametrize('delay_ms', [-120.0, 0.0, 37.5, 250.0])
+def test_estimate_offsets_finds_known_lag(delay_ms):
+    rate = 16000
+    rng = np.random.default_rng(5)
+    reference = rng.standard_normal(rate)
+    shift = int(rate * delay_ms / 1000)
+    recording = 0.3 * np.roll(reference, shift) + 0.05 * rng.standard_normal(rate)
+    offsets = estimate_offsets(reference, recording, rate, max_lag_ms=500)
+    assert offsets[0][0] == pytest.approx(delay_ms, abs=1000.0 / rate)
+    assert offsets[0][1] > offsets[1][1]
+
+def test_estimate_offsets_separates_peaks():
+    rate = 8000
+    reference = np.random.default_rng(6).standard_normal(rate)
+    recording = np.roll(reference, 80) + 0.5 * np.roll(reference, 400)
+    lags = sorted(lag for lag, _ in estimate_offsets(reference, recording, rate, peaks=2))
+    assert lags == pytest.approx([10.0, 50.0])
+
+# Simulated device indices: 0 is the primary, 2 and 3 outputs, 4 a microphone
+@pytest.mark.parametrize('lateness,delays,expected', [
+    ({2: -50.0}, {2: 100.0}, {2: 50.0}), # Delayed too much already: the delay comes down
+    ({2: 40.0, 3: 120.0}, {2: 0.0, 3: 0.0}, {2: 80.0, 3: 0.0}),
+    ({2: -130.0, 3: 40.0}, {2: 100.0, 3: 20.0}, {2: 170.0, 3: 0.0}),
+])
+def test_calibration_converges_whatever_the_delays_were(monkeypatch, lateness, delays, expected):
+    """`lateness` is how far each output lags the primary on its own, what the microphone
+    hears is that plus the delay the sink has at the time."""
+    router = AudioRouter(0, list(lateness), backend=lambda: create_backend('simulated'))
+
+    def record_offsets(input_device_index, seconds):
+        # Peaks like estimate_offsets returns them: the primary, then any unmuted sink
+        return [(0.0, 1.0)] + [(lateness[s.device_index] + s.delay_ms, 0.8) for s in router.sinks if not s.muted]
+
+    monkeypatch.setattr(router, '_record_offsets', record_offsets)
+    router.start_routing()
+    try:
+        assert wait_until(lambda: router.first_audio_ms() is not None)
+        for sink in router.sinks:
+            sink.set_delay(delays[sink.device_index])
+        for _ in range(2): # Calibrating again must not move the delays
+            results = router.calibrate(4, test_signal=False)
+            for sink in router.sinks:
+                assert sink.delay_ms == pytest.approx(expected[sink.device_index])
+                assert results[sink.name]['offset_ms'] == pytest.approx(lateness[sink.device_index])
+                assert saved_delay(router.primary_info['name'], sink.name) == pytest.approx(sink.delay_ms)
+    finally:
+        router.stop_routing()
+        router.shutdown()
@@ -0,0 +1,58 @@
+"""Device capabilities probed once, kept in devices.json, and probed again only when a device changes."""
+import json
+
+from TwinPlay import CapabilityCache
+from simulated import SimulatedAudio
+
+def test_rates_are_probed_once_and_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'devices.json')
+    sim = SimulatedAudio()
+    cache = CapabilityCache(path)
+    cache.sync(sim)
+    assert cache.supported_rates(sim, 3) == [44100]
+    probed = sim.queries
+    assert probed > 0 and cache.misses == 1
+
+    assert cache.supported_rates(sim, 3) == [44100]
+    assert sim.queries == probed and cache.hits == 1
+
+    restarted = CapabilityCache(path)
+    restarted.sync(sim)
+    assert restarted.supported_rates(sim, 3) == [44100]
+    assert sim.queries == probed and restarted.misses == 0
+
+def test_a_device_that_changes_format_is_probed_again(tmp_path):
+    sim = SimulatedAudio()
+    cache = CapabilityCache(str(tmp_path / 'devices.json'))
+    cache.sync(sim)
+    cache.supported_rates(sim, 3)
+    sim.change_format(3, 48000)
+    cache.sync(sim)
+    assert cache.supported_rates(sim, 3) == [48000]
+    assert cache.misses == 2
+    # The 44.1 kHz device is gone, so is its entry
+    assert len([identity for identity in cache.devices if 'Headphones' in identity]) == 1
+
+def test_stale_entries_are_probed_again(tmp_path):
+    sim = SimulatedAudio()
+    cache = CapabilityCache(str(tmp_path / 'devices.json'))
+    cache.sync(sim)
+    cache.supported_rates(sim, 2)
+    for entry in cache.devices.values():
+        entry['probed'] = 0 # Probed in 1970
+    cache.supported_rates(sim, 2)
+    assert cache.misses == 2 and cache.hits == 0
+
+def test_probe_all_fills_the_cache_for_every_device(tmp_path):
+    path = tmp_path / 'devices.json'
+    sim = SimulatedAudio()
+    cache = CapabilityCache(str(path))
+    cache.probe_all(sim)
+    # Each of the five simulated devices is either an input or an output, so one probe each
+    assert cache.misses == 5
+    saved = json.loads(path.read_text())
+    assert len(saved['devices']) == 5 and saved['fingerprint'] == cache.fingerprint
+
+    probed = sim.queries
+    cache.probe_all(sim)
+    assert sim.queries == probed and cache.hits == 5
@@ -0,0 +1,32 @@
+"""Channel layouts and the mix matrix stage, checked against plain NumPy."""
+import numpy as np
+import pytest
+
+from TwinPlay import ChannelMixer, mix_matrix
+
+@pytest.mark.parametrize('in_layout,out_layout', [
+    ('stereo', 'mono'), ('mono', 'stereo'), ('5.1', 'stereo'), ('stereo', '7.1'), ('5.1', '7.1'), ('7.1', '5.1'), (3, 4), (4, 3)])
+def test_mix_matrix_shapes_and_normalization(in_layout, out_layout):
+    matrix = mix_matrix(in_layout, out_layout)
+    in_channels = mix_matrix(in_layout, in_layout).shape[0]
+    out_channels = mix_matrix(out_layout, out_layout).shape[0]
+    assert matrix.shape == (in_channels, out_channels)
+    assert matrix.dtype == np.float32
+    assert np.all(np.abs(matrix).sum(axis=0) <= 1.0 + 1e-6)
+
+def test_mix_matrix_identity_and_lfe():
+    np.testing.assert_array_equal(mix_matrix('stereo', 'stereo'), np.eye(2))
+    # LFE (channel 3 of 5.1) does not reach the stereo fold-down
+    np.testing.assert_array_equal(mix_matrix('5.1', 'stereo')[3], 0)
+    with pytest.raises(ValueError):
+        mix_matrix('quad', 'stereo')
+
+def test_channel_mixer_matches_numpy_matmul():
+    block = np.random.default_rng(1).uniform(-1, 1, (256, 6)).astype(np.float32)
+    mixer = ChannelMixer(6, 2, 512)
+    np.testing.assert_allclose(mixer.process(block), block @ mix_matrix(6, 2), rtol=1e-6, atol=1e-6)
+    custom = np.array([[1.0], [0.0], [0.0], [0.0], [0.0], [0.5]])
+    np.testing.assert_allclose(ChannelMixer(6, 1, 512, custom).process(block)[:, 0],
+                               block[:, 0] + 0.5 * block[:, 5], rtol=1e-6, atol=1e-6)
+    with pytest.raises(ValueError):
+        ChannelMixer(6, 2, 512, np.eye(6))
@@ -0,0 +1,108 @@
+"""Drift estimation and compensation against a fake clock, and the streaming resampler under them."""
+import numpy as np
+import pytest
+
+from TwinPlay import DriftCompensator, DriftEstimator, RingBuffer, StreamingResampler
+from signals import sine
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_drift_estimator_ratio_follows_fill_error():
+    estimator = DriftEstimator(48000, target_ms=50)
+    assert estimator.update(estimator.target_frames, 480) == pytest.approx(1.0)
+    # Too full: consume faster than real time
+    assert DriftEstimator(48000, target_ms=50).update(4800, 480) > 1.0
+    # Too empty: consume slower
+    assert DriftEstimator(48000, target_ms=50).update(0, 480) < 1.0
+
+def test_drift_estimator_clamps_correction():
+    estimator = DriftEstimator(48000, target_ms=50, max_ppm=500)
+    for _ in range(1000):
+        ratio = estimator.update(48000, 480)
+    assert ratio == pytest.approx(1.0 + 500e-6)
+    assert abs(estimator.integral_ppm) <= 500
+
+def test_streaming_resampler_unity_ratio_is_a_delay_line():
+    ring = RingBuffer(1000, 1000, 2, dtype=np.float32)
+    signal = sine(30, 1000, 400)
+    ring.write(signal)
+    resampler = StreamingResampler(2, 64, max_ratio=1.01)
+    out = np.zeros((64, 2), dtype=np.float32)
+    pulled = []
+    for _ in range(5):
+        resampler.pull(ring, out, 1.0)
+        pulled.append(out.copy())
+    np.testing.assert_allclose(np.concatenate(pulled), signal[:320], atol=1e-6)
+
+def test_streaming_resampler_consumes_ratio_times_output():
+    ring = RingBuffer(10000, 1000, 1, dtype=np.float32)
+    ring.write(np.zeros((9000, 1), dtype=np.float32))
+    resampler = StreamingResampler(1, 100, max_ratio=1.01)
+    out = np.zeros((100, 1), dtype=np.float32)
+    for _ in range(50):
+        resampler.pull(ring, out, 1.005)
+    consumed = 9000 - ring.available() - resampler.buffered()
+    assert consumed == pytest.approx(5000 * 1.005, abs=1e-6)
+
+@pytest.mark.parametrize('drift_ppm', [-300, 0, 300])
+def test_drift_compensator_holds_target_against_clock_drift(drift_ppm):
+    rate, block = 48000, 480
+    clock = FakeClock()
+    ring = RingBuffer(500, rate, 1, dtype=np.float32, clock=clock)
+    compensator = DriftCompensator(rate, 1, block, target_ms=50)
+    out = np.zeros((block, 1), dtype=np.float32)
+    produced = 0.0
+    written = 0
+    for i in range(12000): # Two minutes of 10 ms blocks
+        clock.now = i * block / rate
+        produced += block * (1 + drift_ppm * 1e-6)
+        frames = int(produced) - written
+        ring.write(np.zeros((frames, 1), dtype=np.float32))
+        written += frames
+        compensator.pull(ring, out)
+
+    assert not compensator.priming
+    assert compensator.resyncs == 0
+    assert ring.overruns == 0 and ring.underruns == 0
+    # The smoothed fill is measured before each pull, so it settles on the target itself
+    assert compensator.estimator.fill_frames == pytest.approx(compensator.target_frames, abs=block / 4)
+    assert (compensator.ratio - 1) * 1e6 == pytest.approx(drift_ppm, abs=50)
+
+def test_drift_compensator_primes_with_silence_then_plays():
+    ring = RingBuffer(500, 48000, 1, dtype=np.float32)
+    compensator = DriftCompensator(48000, 1, 480, target_ms=50)
+    out = np.full((480, 1), 0.5, dtype=np.float32)
+    ring.write(np.ones((480, 1), dtype=np.float32))
+    compensator.pull(ring, out)
+    assert compensator.priming
+    np.testing.assert_array_equal(out, 0)
+    assert ring.available() == 480 # Nothing consumed while priming
+
+    ring.write(np.ones((2400, 1), dtype=np.float32))
+    compensator.pull(ring, out)
+    assert not compensator.priming
+    np.testing.assert_allclose(out, 1.0)
+
+def test_drift_compensator_skips_back_to_target_after_a_stall():
+    ring = RingBuffer(1000, 48000, 1, dtype=np.float32)
+    compensator = DriftCompensator(48000, 1, 480, target_ms=50)
+    out = np.zeros((480, 1), dtype=np.float32)
+    ring.write(np.zeros((compensator.target_frames, 1), dtype=np.float32))
+    compensator.pull(ring, out)
+    ring.write(np.zeros((24000, 1), dtype=np.float32)) # Half a second arrives at once
+    compensator.pull(ring, out)
+    assert compensator.resyncs == 1
+    assert ring.available() + compensator.resampler.buffered() <= compensator.target_frames
+
+def test_drift_compensator_minimum_target_is_two_blocks():
+    compensator = DriftCompensator(48000, 2, 2048, target_ms=10)
+    assert compensator.target_frames == 4096
+    compensator.retarget(5)
+    ring = RingBuffer(1000, 48000, 2, dtype=np.float32)
+    compensator.pull(ring, np.zeros((2048, 2), dtype=np.float32))
+    assert compensator.target_frames == 4096
@@ -0,0 +1,60 @@
+"""The engine in its own process: the shared-memory snapshot and calls over the pipe."""
+import pytest
+
+from TwinPlay import RouterProcess, SharedSnapshot
+from helpers import wait_until
+
+def test_snapshot_round_trips_between_readers():
+    published = SharedSnapshot()
+    reader = SharedSnapshot(published.name)
+    try:
+        assert reader.read() is None
+        published.publish({'running': True, 'sinks': {'Headset': {'fill_ms': 12.5}}})
+        published.publish({'running': False, 'sinks': {}})
+        assert reader.read() == {'running': False, 'sinks': {}}
+        assert published.sequence == 4
+    finally:
+        reader.close()
+        published.close()
+
+def test_snapshot_readers_skip_a_publish_under_way():
+    snapshot = SharedSnapshot()
+    try:
+        snapshot.publish({'running': True})
+        SharedSnapshot.HEADER.pack_into(snapshot.shm.buf, 0, snapshot.sequence + 1, 0)
+        assert snapshot.read(attempts=3) is None
+    finally:
+        snapshot.close()
+
+def test_oversized_snapshots_are_dropped_not_truncated():
+    snapshot = SharedSnapshot(size=64)
+    try:
+        snapshot.publish({'running': True})
+        snapshot.publish({'padding': 'x' * 100})
+        assert snapshot.oversized == 1
+        assert snapshot.read() == {'running': True}
+    finally:
+        snapshot.close()
+
+def test_router_process_forwards_calls_and_publishes_metrics():
+    router = RouterProcess(0, 2, backend='simulated')
+    try:
+        router.start_routing()
+        assert wait_until(lambda: router.first_audio_ms() is not None)
+        assert router.running
+        metrics = router.add_sink(3)
+        assert metrics['device_index'] == 3
+        assert wait_until(lambda: len(router.snapshot()['sinks']) == 2)
+        assert router.set_delay(3, 40) == 40
+        with pytest.raises(Exception, match="already an output"):
+            router.add_sink(3)
+        with pytest.raises(AttributeError):
+            router.sinks # Only ENGINE_METHODS go over the pipe
+    finally:
+        router.shutdown()
+    assert not router.process.is_alive()
+    assert router.snapshot() is None
+
+def test_router_process_reports_an_engine_that_cannot_start():
+    with pytest.raises(Exception, match="Invalid device index"):
+        RouterProcess(0, 99, backend='simulated')
@@ -0,0 +1,53 @@
+"""One capture mirrored to several outputs, with outputs added and removed while it runs."""
+import time
+
+import numpy as np
+import pytest
+
+from TwinPlay import AudioRouter
+from simulated import SimulatedAudio
+from helpers import wait_until
+
+# Simulated devices: 0 is the primary, 2 a Bluetooth headset at 48 kHz, 3 USB headphones at 44.1 kHz
+
+def heard(sim, device_index):
+    """Whether the simulated device has been given more than silence to play."""
+    return any(np.abs(block).max() > 0.1 for _, block in list(sim.recordings.get(device_index, [])))
+
+@pytest.fixture
+def sim():
+    return SimulatedAudio(record_outputs=True)
+
+def test_one_capture_feeds_every_output(sim):
+    router = AudioRouter(0, [2, 3], backend=lambda: sim)
+    router.start_routing()
+    try:
+        assert wait_until(lambda: heard(sim, 2) and heard(sim, 3))
+        assert len([stream for stream in sim.streams if stream.is_input]) == 1
+        assert [sink.device_index for sink in router.sinks] == [2, 3]
+    finally:
+        router.stop_routing()
+        router.shutdown()
+
+def test_outputs_come_and_go_without_restarting_capture(sim):
+    router = AudioRouter(0, 2, backend=lambda: sim)
+    router.start_routing()
+    try:
+        assert wait_until(lambda: heard(sim, 2))
+        capture = router.stream
+        router.add_sink(3)
+        assert wait_until(lambda: heard(sim, 3))
+        with pytest.raises(Exception):
+            router.add_sink(3)
+
+        router.remove_sink(2)
+        assert [sink.device_index for sink in router.sinks] == [3]
+        blocks = len(sim.recordings[2])
+        time.sleep(0.2)
+        assert len(sim.recordings[2]) == blocks # Nothing more went to the removed output
+        router.remove_sink(2) # Already gone, nothing to do
+
+        assert router.stream is capture and capture.is_active()
+    finally:
+        router.stop_routing()
+        router.shutdown()
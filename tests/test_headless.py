@@ -0,0 +1,101 @@
+"""Headless mode: config files, device names, and the daemon's control channel on simulated devices."""
+import json
+import threading
+from pathlib import Path
+
+import pytest
+
+from TwinPlay import ROUTE_DEFAULTS, AudioSession, RouteDaemon, find_device, load_routes, send_command
+from simulated import SimulatedAudio
+from helpers import wait_until
+
+LOBBY = {'name': 'lobby', 'source': 'Speakers', 'sinks': ['Headset']}
+BAR = {'name': 'bar', 'source': 'Speakers', 'sinks': [{'device': 'Headphones', 'delay_ms': 40}]}
+
+def write_config(path, routes, **config):
+    path.write_text(json.dumps(dict(config, routes=routes)))
+    return str(path)
+
+def test_routes_get_defaults_and_sinks_become_dicts(tmp_path):
+    routes, config = load_routes(write_config(tmp_path / 'routes.json', [LOBBY, dict(BAR, name=None)], control_port=0))
+    assert list(routes) == ['lobby', 'route2']
+    assert routes['lobby']['sinks'] == [{'device': 'Headset'}]
+    assert routes['lobby']['buffer_ms'] == ROUTE_DEFAULTS['buffer_ms']
+    assert routes['route2']['sinks'] == [{'device': 'Headphones', 'delay_ms': 40}]
+    assert config['control_port'] == 0
+
+@pytest.mark.parametrize('route', [
+    {'name': 'lobby', 'source': 'Speakers', 'sinks': []},
+    dict(LOBBY, latency='low'),
+    dict(LOBBY, sample_format='float64'),
+    dict(LOBBY, latency_profile='fastest'),
+    dict(LOBBY, sinks=[{'device': 'Headset', 'volume': 2}]),
+    dict(LOBBY, record=[{'rotate_s': 60}]),
+])
+def test_bad_routes_are_refused(tmp_path, route):
+    with pytest.raises(ValueError):
+        load_routes(write_config(tmp_path / 'routes.json', [route]))
+
+def test_route_names_must_be_unique(tmp_path):
+    with pytest.raises(ValueError, match="more than one"):
+        load_routes(write_config(tmp_path / 'routes.json', [LOBBY, LOBBY]))
+
+def test_devices_are_found_by_index_name_or_unique_part_of_it():
+    session = AudioSession(SimulatedAudio)
+    try:
+        devices = session.list_devices()
+    finally:
+        session.terminate()
+    assert find_device(devices, 'Headphones (USB Audio)') == 3
+    assert find_device(devices, 'speakers') == 0 # Its loopback doesn't count
+    assert find_device(devices, 'usb', io='input') == 4
+    assert find_device(devices, 2) == 2
+    with pytest.raises(Exception, match="several"):
+        find_device(devices, 'H')
+    with pytest.raises(Exception):
+        find_device(devices, 4) # A microphone is no output
+
+@pytest.fixture
+def daemon(tmp_path):
+    path = tmp_path / 'routes.json'
+    write_config(path, [LOBBY, BAR])
+    daemon = RouteDaemon(str(path), backend=SimulatedAudio, control_port=0)
+    thread = threading.Thread(target=daemon.run, daemon=True)
+    thread.start()
+    assert wait_until(lambda: len(daemon.routers) == 2)
+    yield daemon
+    daemon.shutdown()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+
+def command(daemon, line):
+    return send_command(line, daemon.control_port)
+
+def test_control_channel_starts_and_stops_routes(daemon):
+    status = command(daemon, 'status')
+    assert status['ok'] and set(status['routes']) == {'lobby', 'bar'}
+    assert wait_until(lambda: command(daemon, 'status')['routes']['lobby']['first_audio_ms'] is not None)
+
+    assert command(daemon, 'stop bar')['routes']['bar']['running'] is False
+    assert 'lobby' in daemon.routers
+    assert command(daemon, 'start')['routes']['bar']['running'] is True
+
+    assert command(daemon, 'stop nowhere') == {'ok': False, 'error': "Unknown route: nowhere"}
+    assert command(daemon, 'dance')['ok'] is False
+
+def test_reload_only_restarts_routes_that_changed(daemon):
+    lobby, bar = daemon.routers['lobby'], daemon.routers['bar']
+    write_config(Path(daemon.config_path), [LOBBY, dict(BAR, latency_ms=80), dict(LOBBY, name='hall', source='Nowhere')])
+    status = command(daemon, 'reload')['routes']
+    assert daemon.routers['lobby'] is lobby # Unchanged, kept playing
+    assert daemon.routers['bar'] is not bar and not bar.running
+    assert status['hall']['running'] is False and "Nowhere" in status['hall']['error']
+
+    write_config(Path(daemon.config_path), [LOBBY])
+    assert set(command(daemon, 'reload')['routes']) == {'lobby'}
+    assert daemon.routers['lobby'] is lobby
+
+def test_a_config_that_does_not_load_changes_nothing(daemon):
+    Path(daemon.config_path).write_text("{not json")
+    assert command(daemon, 'reload')['ok'] is False
+    assert set(daemon.routers) == {'lobby', 'bar'}
@@ -0,0 +1,63 @@
+"""The peak limiter that keeps mixed sources from clipping."""
+import numpy as np
+import pytest
+
+from TwinPlay import Limiter
+from signals import sine
+
+def limit_levels(limiter, levels, frames):
+    """Runs DC blocks at `levels` through the limiter. Returns the output and the gain applied to each frame."""
+    out, gains = [], []
+    for level in levels:
+        block = np.full((frames, 2), level, dtype=np.float32)
+        limiter.process(block)
+        out.append(block.copy())
+        gains.append(block[:, 0] / np.float32(level))
+    return out, gains
+
+def test_limiter_leaves_quiet_audio_alone():
+    limiter = Limiter(2, 512, 48000)
+    block = sine(440, 48000, 512, level=0.5)
+    expected = block.copy()
+    limiter.process(block)
+    np.testing.assert_array_equal(block, expected)
+    assert limiter.limited_blocks == 0
+
+def test_limiter_keeps_peaks_under_threshold_and_recovers():
+    limiter = Limiter(2, 480, 48000, threshold=0.9, attack_ms=1.0, release_ms=50.0)
+    loud = sine(440, 48000, 480 * 20, level=1.8)
+    for start in range(0, len(loud), 480):
+        block = loud[start:start + 480]
+        limiter.process(block)
+        if start >= 480: # The first block ramps down over the attack time
+            # Within the attack time a sliver of the rise can still get through
+            assert np.abs(block).max() <= 0.9 * 1.001
+    assert limiter.limited_blocks > 0
+    assert limiter.gain == pytest.approx(0.5, abs=0.01)
+
+    quiet = sine(440, 48000, 480 * 100, level=0.1)
+    for start in range(0, len(quiet), 480):
+        limiter.process(quiet[start:start + 480])
+    assert limiter.gain == 1.0
+
+def test_limiter_holds_the_target_when_the_gain_rises_while_limiting():
+    limiter = Limiter(2, 480, 48000, threshold=0.95)
+    limit_levels(limiter, [1.9] * 50, 480)
+    assert limiter.gain == pytest.approx(0.5, abs=1e-3)
+    # Still too loud for the released gain, so the gain rises only as far as the new limit
+    out, gains = limit_levels(limiter, [1.85], 480)
+    assert np.abs(out[0]).max() <= 0.95 * 1.0001
+    assert limiter.gain == pytest.approx(0.95 / 1.85, rel=1e-4)
+    assert gains[0][-1] == pytest.approx(limiter.gain)
+
+def test_limiter_gain_is_continuous_and_output_stays_under_full_scale():
+    # A level that swells from 0.4 to 2.0 and back with some jitter, in and out of limiting
+    swell = 1.2 - 0.8 * np.cos(2 * np.pi * np.arange(2000) / 400)
+    levels = swell * np.random.default_rng(7).uniform(0.99, 1.01, 2000)
+    limiter = Limiter(2, 480, 48000, threshold=0.95)
+    out, gains = limit_levels(limiter, levels, 480)
+    assert limiter.limited_blocks > 0
+    assert max(np.abs(block).max() for block in out) <= 1.0
+    for previous, current in zip(gains, gains[1:]):
+        # Each block starts from the gain the last one ended on, bar the snap to unity
+        assert current[0] == pytest.approx(previous[-1], abs=1e-4)
@@ -0,0 +1,77 @@
+"""Recording taps: what reaches the file, dropped blocks, and rotation by size and age."""
+import os
+import time
+import wave
+
+import numpy as np
+import pytest
+
+from TwinPlay import AudioRouter, RecordingTap
+from simulated import SimulatedAudio
+from signals import sine
+
+def read_wav(path):
+    """A 16-bit WAV file as float32 (frames, channels), checking its header on the way."""
+    with wave.open(str(path), 'rb') as f:
+        assert f.getsampwidth() == 2
+        data = f.readframes(f.getnframes())
+        channels = f.getnchannels()
+    return (np.frombuffer(data, dtype='<i2') / 32768.0).astype(np.float32).reshape(-1, channels)
+
+def record(tap, signal, block=480):
+    tap.start()
+    for start in range(0, len(signal), block):
+        tap.push(signal[start:start + block])
+    tap.stop()
+
+def test_a_recording_holds_exactly_what_was_pushed(tmp_path):
+    signal = sine(440, 48000, 48000)
+    tap = RecordingTap(str(tmp_path / 'take.wav'), 48000, 2, flush_s=0.05)
+    record(tap, signal)
+    assert tap.files == [str(tmp_path / 'take.wav')]
+    assert tap.written_frames == len(signal) and tap.dropped_blocks == 0
+    # Dither adds up to one LSB, rounding another half
+    np.testing.assert_allclose(read_wav(tap.files[0]), signal, rtol=0, atol=2.0 ** -14)
+
+def test_blocks_that_do_not_fit_are_dropped_whole(tmp_path):
+    tap = RecordingTap(str(tmp_path / 'take.wav'), 48000, 2, queue_ms=100, flush_s=10)
+    record(tap, sine(440, 48000, 6000), block=2000) # The writer only drains the 4800-frame ring on stop
+    assert tap.dropped_blocks == 1 and tap.dropped_frames == 2000
+    assert len(read_wav(tap.files[0])) == 4000
+
+def test_files_rotate_at_rotate_mb_without_splitting_frames(tmp_path):
+    signal = sine(440, 48000, 10000)
+    tap = RecordingTap(str(tmp_path / 'take.wav'), 48000, 2, flush_s=0.05, rotate_mb=0.01)
+    record(tap, signal)
+    assert [os.path.basename(path) for path in tap.files] == ['take.wav', 'take-002.wav', 'take-003.wav', 'take-004.wav']
+    parts = [read_wav(path) for path in tap.files]
+    limit = int(0.01 * 1024 * 1024) // 4
+    assert [len(part) for part in parts] == [limit, limit, limit, len(signal) - 3 * limit]
+    np.testing.assert_allclose(np.concatenate(parts), signal, rtol=0, atol=2.0 ** -14)
+
+def test_files_rotate_at_rotate_s(tmp_path):
+    tap = RecordingTap(str(tmp_path / 'take.wav'), 1000, 1, flush_s=0.02, rotate_s=0.1)
+    tap.start()
+    for _ in range(40):
+        tap.push(np.full((10, 1), 0.5, dtype=np.float32))
+        time.sleep(0.01)
+    tap.stop()
+    assert len(tap.files) >= 3
+    assert sum(len(read_wav(path)) for path in tap.files) == 400
+
+def test_only_wav_and_flac_can_be_recorded(tmp_path):
+    with pytest.raises(ValueError):
+        RecordingTap(str(tmp_path / 'take.mp3'), 48000, 2)
+
+def test_a_route_records_its_capture(tmp_path):
+    router = AudioRouter(0, 2, backend=SimulatedAudio)
+    router.start_routing()
+    try:
+        tap = router.add_tap(str(tmp_path / 'capture.wav'))
+        time.sleep(0.5)
+    finally:
+        router.stop_routing()
+        router.shutdown()
+    audio = read_wav(tap.files[0])
+    assert len(audio) > 0.2 * 48000
+    assert np.abs(audio).max() == pytest.approx(0.25, abs=0.01) # The simulated source's sine
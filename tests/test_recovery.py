@@ -0,0 +1,55 @@
+"""The watchdog: streams that stall, vanish or change format are reopened while the rest keep playing."""
+import pytest
+
+from TwinPlay import AudioRouter
+from simulated import SimulatedAudio
+from helpers import wait_until
+
+# Simulated devices: 0 is the primary with its loopback on 1, 2 and 3 are outputs
+
+@pytest.fixture
+def sim():
+    return SimulatedAudio()
+
+@pytest.fixture
+def router(sim):
+    router = AudioRouter(0, [2, 3], backend=lambda: sim, stall_timeout_s=0.3)
+    router.start_routing()
+    assert wait_until(lambda: router.first_audio_ms() is not None)
+    yield router
+    router.stop_routing()
+    router.shutdown()
+
+def sink_on(router, device_index):
+    return next(sink for sink in router.sinks if sink.device_index == device_index)
+
+def test_a_stalled_output_is_reopened_once_its_writer_has_let_go(sim, router):
+    stalled = sink_on(router, 2)
+    writer, stream = stalled.thread, stalled.stream
+    capture = router.stream
+    sim.stall(2, 1.0)
+    assert wait_until(lambda: router.get_recoveries())
+    assert router.get_recoveries()[0]['reason'] == "output stalled"
+    # The writer was blocked in a write. It must be gone before its stream was closed
+    assert not writer.is_alive()
+    assert stream.closed and sim.unsafe_closes == 0
+    assert sink_on(router, 2) is not stalled
+    assert router.stream is capture
+
+def test_an_unplugged_output_comes_back_when_it_is_plugged_in_again(sim, router):
+    other = sink_on(router, 3)
+    sim.disconnect(2)
+    assert wait_until(lambda: 2 in router._recovering)
+    assert wait_until(lambda: router._recovering[2]['attempts'] >= 2) # Reopening fails while it is unplugged
+    sim.reconnect(2)
+    assert wait_until(lambda: router.get_recoveries())
+    recovery = router.get_recoveries()[0]
+    assert recovery['attempts'] >= 2 and "write failed" in recovery['reason']
+    assert sink_on(router, 3) is other and other.failure is None
+
+def test_a_loopback_format_change_rebuilds_every_output(sim, router):
+    sim.change_format(1, 44100)
+    assert wait_until(lambda: not router._recovering and len(router.get_recoveries()) >= 3)
+    assert router.loopback_sample_rate == 44100
+    assert [sink.source_rate for sink in router.sinks] == [44100, 44100]
+    assert wait_until(lambda: all(sink.first_audio is not None for sink in router.sinks))
@@ -0,0 +1,37 @@
+"""PolyphaseResampler against the tone it was given."""
+import numpy as np
+import pytest
+
+from TwinPlay import PolyphaseResampler
+from signals import sine
+
+def dominant_frequency(signal, rate):
+    windowed = signal * np.hanning(len(signal))
+    spectrum = np.abs(np.fft.rfft(windowed))
+    return np.argmax(spectrum) * rate / len(signal)
+
+@pytest.mark.parametrize('in_rate,out_rate', [(44100, 48000), (48000, 44100), (96000, 48000), (48000, 48000)])
+def test_polyphase_resampler_preserves_tone(in_rate, out_rate):
+    frames = in_rate // 2
+    signal = sine(1000, in_rate, frames)
+    resampler = PolyphaseResampler(in_rate, out_rate, 2, 1024)
+    out = np.zeros((resampler.max_output_frames, 2), dtype=np.float32)
+    produced = []
+    for start in range(0, frames, 1000): # Odd block size, so phase carries across blocks
+        count = resampler.process(signal[start:start + 1000], out)
+        assert count <= resampler.output_frames_for(len(signal[start:start + 1000]))
+        produced.append(out[:count].copy())
+    result = np.concatenate(produced)
+
+    assert len(result) == pytest.approx(frames * out_rate / in_rate, abs=2)
+    steady = result[resampler.taps:, 0] # Skip the filter's start-up
+    assert dominant_frequency(steady, out_rate) == pytest.approx(1000, abs=out_rate / len(steady) + 1)
+    rms = np.sqrt(np.mean(steady ** 2))
+    assert rms == pytest.approx(0.5 / np.sqrt(2), rel=0.02)
+    np.testing.assert_allclose(result[:, 0], result[:, 1], rtol=0, atol=1e-6)
+
+def test_polyphase_resampler_rejects_content_above_new_nyquist():
+    resampler = PolyphaseResampler(48000, 24000, 1, 4800)
+    out = np.zeros((resampler.max_output_frames, 1), dtype=np.float32)
+    count = resampler.process(sine(18000, 48000, 4800, channels=1), out)
+    assert np.sqrt(np.mean(out[resampler.taps:count] ** 2)) < 1e-3
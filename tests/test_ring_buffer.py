@@ -0,0 +1,123 @@
+"""RingBuffer overrun and underrun policies, exercised with plain NumPy blocks."""
+import numpy as np
+import pytest
+
+from TwinPlay import DROP_NEWEST, DROP_OLDEST, INSERT_SILENCE, REPEAT_LAST, RingBuffer
+
+def ramp(start, frames, channels=2):
+    """Frames numbered start, start + 1, ... on every channel, so order is easy to check."""
+    return np.repeat(np.arange(start, start + frames, dtype=np.float32)[:, None], channels, axis=1)
+
+def ring(capacity_frames, **kwargs):
+    # 1000 Hz makes the capacity in ms equal to the capacity in frames
+    return RingBuffer(capacity_frames, 1000, 2, dtype=np.float32, **kwargs)
+
+def test_write_then_read_round_trips():
+    r = ring(16)
+    assert r.write(ramp(0, 10)) == 10
+    assert r.available() == 10 and r.free() == 6
+    out = np.zeros((10, 2), dtype=np.float32)
+    assert r.read(out) == 10
+    np.testing.assert_array_equal(out, ramp(0, 10))
+    assert r.available() == 0 and r.underruns == 0
+
+def test_wraparound_keeps_order():
+    r = ring(16)
+    out = np.zeros((6, 2), dtype=np.float32)
+    start = 0
+    for _ in range(10): # Write and read positions pass the end of the buffer several times
+        r.write(ramp(start, 6))
+        r.read(out)
+        np.testing.assert_array_equal(out, ramp(start, 6))
+        start += 6
+    assert r.overruns == 0 and r.underruns == 0
+
+def test_drop_oldest_lapping_reader_catches_up():
+    r = ring(16, overrun_policy=DROP_OLDEST)
+    r.write(ramp(0, 10))
+    assert r.write(ramp(10, 10)) == 10 # Overwrites frames 0-3
+    assert r.overruns == 1 and r.dropped_frames == 4
+    assert r.available() == 16
+
+    out = np.zeros((16, 2), dtype=np.float32)
+    assert r.read(out) == 16
+    np.testing.assert_array_equal(out, ramp(4, 16)) # The reader skips what was overwritten
+
+def test_drop_oldest_block_larger_than_capacity_keeps_newest():
+    r = ring(8, overrun_policy=DROP_OLDEST)
+    r.write(ramp(0, 20))
+    out = np.zeros((8, 2), dtype=np.float32)
+    assert r.read(out) == 8
+    np.testing.assert_array_equal(out, ramp(12, 8))
+    assert r.dropped_frames == 12
+
+def test_drop_newest_truncates_incoming_block():
+    r = ring(16, overrun_policy=DROP_NEWEST)
+    r.write(ramp(0, 10))
+    assert r.write(ramp(10, 10)) == 6
+    assert r.overruns == 1 and r.dropped_frames == 4
+    assert r.write(ramp(20, 5)) == 0 # Full: the whole block goes
+    assert r.overruns == 2 and r.dropped_frames == 9
+
+    out = np.zeros((16, 2), dtype=np.float32)
+    r.read(out)
+    np.testing.assert_array_equal(out, ramp(0, 16))
+
+def test_insert_silence_pads_underrun():
+    r = ring(16, underrun_policy=INSERT_SILENCE)
+    r.write(ramp(1, 4))
+    out = np.full((6, 2), -1.0, dtype=np.float32)
+    assert r.read(out) == 4
+    np.testing.assert_array_equal(out[:4], ramp(1, 4))
+    np.testing.assert_array_equal(out[4:], 0)
+    assert r.underruns == 1 and r.inserted_frames == 2
+
+def test_repeat_last_pads_with_tail_of_previous_read():
+    r = ring(16, underrun_policy=REPEAT_LAST)
+    r.write(ramp(1, 6))
+    first = np.zeros((6, 2), dtype=np.float32)
+    r.read(first)
+
+    r.write(ramp(100, 2))
+    out = np.zeros((6, 2), dtype=np.float32)
+    assert r.read(out) == 2
+    np.testing.assert_array_equal(out[:2], ramp(100, 2))
+    np.testing.assert_array_equal(out[2:], ramp(3, 4)) # The last 4 frames read before
+    assert r.underruns == 1 and r.inserted_frames == 4
+
+def test_repeat_last_falls_back_to_silence_without_history():
+    r = ring(16, underrun_policy=REPEAT_LAST)
+    out = np.full((4, 2), -1.0, dtype=np.float32)
+    assert r.read(out) == 0
+    np.testing.assert_array_equal(out, 0)
+
+def test_skip_discards_oldest_and_is_bounded():
+    r = ring(16)
+    r.write(ramp(0, 10))
+    assert r.skip(3) == 3
+    assert r.skip(100) == 7
+    assert r.available() == 0
+    r.write(ramp(10, 4))
+    out = np.zeros((4, 2), dtype=np.float32)
+    r.read(out)
+    np.testing.assert_array_equal(out, ramp(10, 4))
+
+def test_skip_after_lapping_starts_from_oldest_kept_frame():
+    r = ring(8, overrun_policy=DROP_OLDEST)
+    r.write(ramp(0, 12)) # Frames 0-3 are gone
+    assert r.skip(2) == 2
+    out = np.zeros((6, 2), dtype=np.float32)
+    assert r.read(out) == 6
+    np.testing.assert_array_equal(out, ramp(6, 6))
+
+def test_clear_drops_everything_unread():
+    r = ring(16)
+    r.write(ramp(0, 10))
+    r.clear()
+    assert r.available() == 0 and r.free() == 16
+
+def test_unknown_policies_are_rejected():
+    with pytest.raises(ValueError):
+        ring(16, overrun_policy='wait')
+    with pytest.raises(ValueError):
+        ring(16, underrun_policy='stretch')
@@ -0,0 +1,36 @@
+"""Float32 to device sample formats and back: dither, rounding and clipping."""
+import numpy as np
+import pytest
+
+from TwinPlay import SampleDecoder, SampleEncoder, pyaudio
+
+@pytest.mark.parametrize('sample_format,lsb', [
+    (pyaudio.paFloat32, 0.0), (pyaudio.paInt32, 2.0 ** -24), (pyaudio.paInt24, 2.0 ** -23), (pyaudio.paInt16, 2.0 ** -15)])
+def test_encoder_decoder_round_trip(sample_format, lsb):
+    block = np.random.default_rng(2).uniform(-0.9, 0.9, (300, 2)).astype(np.float32)
+    encoder = SampleEncoder(sample_format, 2, 512, seed=3)
+    decoder = SampleDecoder(sample_format, 2, 512)
+    data = encoder.encode(block)
+    assert data.readonly
+    decoded = decoder.decode(bytes(data))
+    assert decoded.shape == block.shape
+    # Dither adds up to one LSB, rounding another half
+    np.testing.assert_allclose(decoded, block, rtol=0, atol=max(2 * lsb, 1e-7))
+    assert encoder.clipped_blocks == 0
+
+def test_encoder_int16_matches_numpy_reference_without_dither():
+    block = np.random.default_rng(4).uniform(-1, 1, (128, 2)).astype(np.float32)
+    encoder = SampleEncoder(pyaudio.paInt16, 2, 128, dither=False)
+    reference = np.clip(np.rint(block * 32768), -32768, 32767).astype(np.int16)
+    np.testing.assert_array_equal(np.frombuffer(encoder.encode(block), dtype=np.int16).reshape(-1, 2), reference)
+
+@pytest.mark.parametrize('sample_format', [pyaudio.paFloat32, pyaudio.paInt32, pyaudio.paInt24, pyaudio.paInt16])
+def test_encoder_clips_to_full_scale(sample_format):
+    block = np.array([[2.0, -2.0], [0.0, 0.0]], dtype=np.float32)
+    encoder = SampleEncoder(sample_format, 2, 8, dither=False)
+    decoded = SampleDecoder(sample_format, 2, 8).decode(bytes(encoder.encode(block)))
+    assert encoder.clipped_blocks == 1
+    assert decoded[0, 0] == pytest.approx(1.0, abs=1e-4) and decoded[0, 0] <= 1.0
+    assert decoded[0, 1] == -1.0
+    encoder.encode(block[1:])
+    assert encoder.clipped_blocks == 1